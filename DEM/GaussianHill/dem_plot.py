@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Level-of-detail plotting of large grids.
+
+Grids are reduced to a pixel (imshow) or point (3D scatter) budget before
+they are handed to matplotlib. The reduction works on square blocks of
+f x f cells and is deterministic:
+    'minmax'    keep the minimum and the maximum of each block, so peaks,
+                pits, ridges and valleys survive: both nodes of every
+                block for scatter plots, and for images the block maximum
+                and minimum alternately (checkerboard); the global minimum
+                and maximum are always kept
+    'mean'      block average (smooth images)
+    'decimate'  every f-th cell, like z[::f, ::f]
+
+Usage:
+    lod_imshow(ax, z, max_pixels = 1000, cmap = pl.cm.viridis)
+    lod_scatter3d(ax, x, y, z, c = slope, max_points = 20000, s = 5)
+"""
+import numpy as np
+
+MODES = ('minmax', 'mean', 'decimate')
+
+
+def block_factor(shape, budget):
+    """
+    Smallest block size f so that the reduced grid has <= budget cells
+    along its longest axis
+    """
+    return max(1, int(np.ceil(max(shape) / float(budget))))
+
+
+def _blocks(a, f):
+    #(by, bx, f*f) view of a, NaN-padded to a multiple of f
+    rows, cols = a.shape
+    by, bx = -(-rows // f), -(-cols // f)
+    if (by * f, bx * f) != a.shape:
+        p = np.full((by * f, bx * f), np.nan)
+        p[:rows, :cols] = a
+        a = p
+    else:
+        a = np.asarray(a, dtype = np.float64)
+    return a.reshape(by, f, bx, f).transpose(0, 2, 1, 3).reshape(by, bx, f * f)
+
+
+def _block_minmax_index(b):
+    #indices (within each block) of the block minimum and maximum
+    nan = np.isnan(b)
+    imin = np.where(nan, np.inf, b).argmin(axis = 2)
+    imax = np.where(nan, -np.inf, b).argmax(axis = 2)
+    return imin, imax
+
+
+def reduce_grid(z, f, mode = 'minmax'):
+    """
+    Reduce the 2-D grid z by blocks of f x f cells
+    """
+    if mode not in MODES:
+        raise ValueError('mode must be one of %s' % (MODES,))
+    if f == 1:
+        return np.asarray(z)
+    if mode == 'decimate':
+        return np.asarray(z[::f, ::f])
+    b = _blocks(z, f)
+    if mode == 'mean':
+        return np.nanmean(b, axis = 2)
+    imin, imax = _block_minmax_index(b)
+    by, bx = np.indices(imin.shape)
+    #maximum and minimum of alternate blocks
+    i = np.where((by + bx) % 2 == 0, imax, imin)
+    zr = np.take_along_axis(b, i[..., np.newaxis], axis = 2)[..., 0]
+    #the blocks holding the global minimum and maximum always show them
+    flat = b.reshape(-1)
+    jmin, jmax = np.nanargmin(flat), np.nanargmax(flat)
+    kmin, kmax = jmin // (f * f), jmax // (f * f)
+    if kmin == kmax and zr.size > 1:
+        #one pixel cannot show both: the minimum goes to a neighbouring pixel
+        r, c = divmod(kmin, zr.shape[1])
+        if zr.shape[1] > 1:
+            c = c + 1 if c + 1 < zr.shape[1] else c - 1
+        else:
+            r = r + 1 if r + 1 < zr.shape[0] else r - 1
+        kmin = r * zr.shape[1] + c
+    zr.flat[kmin] = flat[jmin]
+    zr.flat[kmax] = flat[jmax]
+    return zr
+
+
+def lod_imshow(ax, z, max_pixels = 1000, mode = 'minmax', **kwargs):
+    """
+    ax.imshow of z reduced to at most max_pixels along each axis. The image
+    keeps the extent of the full grid, so axis coordinates stay in cells.
+    """
+    zr = reduce_grid(z, block_factor(z.shape, max_pixels), mode)
+    rows, cols = z.shape
+    kwargs.setdefault('extent', (-0.5, cols - 0.5, rows - 0.5, -0.5))
+    return ax.imshow(zr, **kwargs)
+
+
+def lod_nodes(z, max_points = 20000, mode = 'minmax'):
+    """
+    Flat indices of at most ~max_points representative nodes of grid z.
+
+    For 'minmax' the lowest and the highest node of every block are kept
+    (two nodes per block), plus the global minimum and maximum; for
+    'decimate' a regular subset.
+    """
+    if mode not in ('minmax', 'decimate'):
+        raise ValueError("mode must be 'minmax' or 'decimate' for nodes")
+    per_block = 2 if mode == 'minmax' else 1
+    f = max(1, int(np.ceil(np.sqrt(per_block * z.size / float(max_points)))))
+    rows, cols = z.shape
+    if f == 1:
+        return np.arange(z.size)
+    if mode == 'decimate':
+        r, c = np.meshgrid(np.arange(0, rows, f), np.arange(0, cols, f), indexing = 'ij')
+        return (r * cols + c).ravel()
+    i = np.stack(_block_minmax_index(_blocks(z, f)))
+    br, bc = np.indices(i.shape[1:])
+    r = br * f + i // f
+    c = bc * f + i % f
+    idx = (r * cols + c).ravel()
+    zf = np.asarray(z).ravel()
+    extremes = [np.nanargmin(zf), np.nanargmax(zf)]
+    return np.unique(np.concatenate((idx, extremes)))
+
+
+def lod_scatter3d(ax, x, y, z, c = None, max_points = 20000, mode = 'minmax',
+                  **kwargs):
+    """
+    3-D scatter of grid nodes reduced to about max_points points.
+
+    x, y, z (and c, if it is an array) are grids of the same shape (x and y
+    may be broadcastable, e.g., from GaussianHillField.grid()).
+    """
+    x, y, z = np.broadcast_arrays(x, y, z)
+    r, cc = np.divmod(lod_nodes(z, max_points, mode), z.shape[1])
+    if c is not None and np.ndim(c) == 2:
+        c = np.asarray(c)[r, cc]
+    return ax.scatter(x[r, cc], y[r, cc], z[r, cc], c = c, **kwargs)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution DEM pyramid for scale-dependence analyses.
+
+Level 0 is the input DEM and every following level halves the resolution,
+either by taking every second cell ('decimate', the same as z[::2, ::2]) or
+by averaging 2 x 2 blocks ('mean'). Each level is built once from the level
+above. Elevations and derived slope/curvature grids are kept in a small
+in-memory LRU cache and, if cache_dir is given, stored as .npy files named
+after a hash of the DEM, so later runs (or other scripts) load them
+memory-mapped instead of recomputing.
+
+Usage:
+    pyr = DEMPyramid(z, d, method = 'mean', cache_dir = 'pyramid_cache')
+    for k in range(pyr.nlevels):
+        s = pyr.slope(k)    #cell size pyr.cell_size(k)
+"""
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from terrain_attributes import TerrainAttributes
+
+PRODUCTS = ('elevation', 'slope', 'aspect', 'profile_curvature',
+            'planform_curvature', 'abs_curvature')
+
+
+def downsample(z, method = 'mean'):
+    """
+    Halve the resolution of z by decimation or 2 x 2 block averaging
+    """
+    if method == 'decimate':
+        return np.ascontiguousarray(z[::2, ::2])
+    if method == 'mean':
+        rows, cols = (z.shape[0] // 2) * 2, (z.shape[1] // 2) * 2
+        zc = np.asarray(z[:rows, :cols], dtype = np.float64)
+        out = zc[0::2, 0::2] + zc[1::2, 0::2]
+        out += zc[0::2, 1::2]
+        out += zc[1::2, 1::2]
+        out *= 0.25
+        return out
+    raise ValueError("method must be 'mean' or 'decimate', not %r" % (method,))
+
+
+class DEMPyramid(object):
+    def __init__(self, z, d, method = 'mean', nlevels = None, min_size = 8,
+                 cache_dir = None, max_cached = 8, stencil = 'zt'):
+        if method not in ('mean', 'decimate'):
+            raise ValueError("method must be 'mean' or 'decimate', not %r" % (method,))
+        self.d = float(d)
+        self.method = method
+        self.stencil = stencil
+        self.shape = z.shape
+        if nlevels is None:
+            nlevels = 1
+            while min(self.shape) // 2**nlevels >= min_size:
+                nlevels += 1
+        self.nlevels = nlevels
+        self.cache_dir = cache_dir
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._z = z
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(z).view(np.uint8))
+        h.update(('%s %s %r %s %s' % (z.dtype, z.shape, self.d, method, stencil)).encode())
+        self.key = h.hexdigest()[:16]
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok = True)
+
+    def cell_size(self, level):
+        return self.d * 2**level
+
+    def _fname(self, level, product):
+        return os.path.join(self.cache_dir, '%s_L%d_%s.npy' % (self.key, level, product))
+
+    def _get(self, level, product):
+        key = (level, product)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        #the input DEM itself is never copied to disk
+        on_disk = self.cache_dir is not None and (level, product) != (0, 'elevation')
+        if on_disk and os.path.exists(self._fname(level, product)):
+            a = np.load(self._fname(level, product), mmap_mode = 'r')
+        else:
+            a = self._compute(level, product)
+            if on_disk:
+                #write to a temporary file first so that an interrupted run
+                #never leaves a truncated cache file behind
+                tmp = self._fname(level, product) + '.tmp.npy'
+                np.save(tmp, a)
+                os.replace(tmp, self._fname(level, product))
+        self._cache[key] = a
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last = False)
+        return a
+
+    def _compute(self, level, product):
+        if product == 'elevation':
+            if level == 0:
+                return self._z
+            return downsample(self.elevation(level - 1), self.method)
+        z = self.elevation(level)
+        ta = TerrainAttributes(z.shape, self.cell_size(level),
+                               method = self.stencil, attributes = (product,))
+        return getattr(ta.compute(z), product)
+
+    def _check(self, level):
+        if not 0 <= level < self.nlevels:
+            raise IndexError('level must be in [0, %d)' % self.nlevels)
+
+    def elevation(self, level):
+        self._check(level)
+        return self._get(level, 'elevation')
+
+    def attribute(self, level, product):
+        self._check(level)
+        if product not in PRODUCTS:
+            raise ValueError('unknown product %r' % (product,))
+        return self._get(level, product)
+
+    def slope(self, level):
+        return self.attribute(level, 'slope')
+
+    def curvature(self, level, kind = 'profile'):
+        return self.attribute(level, kind + '_curvature')
+
+    def clear(self, disk = False):
+        """
+        Empty the in-memory cache and, with disk = True, the on-disk files
+        """
+        self._cache.clear()
+        if disk and self.cache_dir is not None:
+            for f in os.listdir(self.cache_dir):
+                if f.startswith(self.key + '_'):
+                    os.remove(os.path.join(self.cache_dir, f))
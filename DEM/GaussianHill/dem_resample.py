@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resampling of regular DEM grids (replacement for scipy.interpolate.interp2d,
+which has been removed from SciPy).
+
+The interpolation is separable: every output column and row gets a fixed set
+of source indices and weights (2 for 'linear'/'bilinear', 4 for Keys (1981)
+'cubic' convolution, 1 for 'nearest'), computed once per axis. The grid is
+then processed in blocks of output rows, so only the source rows needed for
+one block are read and interpolated at a time. This works on memory-mapped
+inputs and outputs and for up- and downsampling.
+
+Usage:
+    zi = resample(zs, xs, ys, xi, yi, kind = 'linear')
+    dh = resample_difference(z, zs, xs, ys, xi, yi)    #z - zi, block by block
+"""
+import numpy as np
+
+KINDS = ('nearest', 'linear', 'bilinear', 'cubic')
+
+
+def _regular_spacing(x):
+    x = np.asarray(x, dtype = np.float64)
+    if x.ndim != 1 or len(x) < 2:
+        raise ValueError('coordinates must be 1-D with at least two values')
+    dx = (x[-1] - x[0]) / (len(x) - 1)
+    if not dx > 0 or not np.allclose(np.diff(x), dx, rtol = 1e-6, atol = 0):
+        raise ValueError('coordinates must be regularly spaced and increasing')
+    return x[0], dx
+
+
+def axis_weights(x, xi, kind = 'linear'):
+    """
+    Source indices and weights, each of shape (len(xi), k), to interpolate
+    a regular 1-D grid x at positions xi. Positions outside x are flagged in
+    the returned boolean mask.
+    """
+    if kind not in KINDS:
+        raise ValueError('kind must be one of %s' % (KINDS,))
+    x0, dx = _regular_spacing(x)
+    n = len(x)
+    xi = np.asarray(xi, dtype = np.float64)
+    f = (xi - x0) / dx
+    #tolerate round-off at the grid ends
+    outside = (f < -1e-9) | (f > n - 1 + 1e-9)
+    f = np.clip(f, 0, n - 1)
+
+    if kind == 'nearest':
+        idx = np.round(f).astype(np.intp)[:, np.newaxis]
+        return idx, np.ones(idx.shape), outside
+
+    i = np.minimum(np.floor(f).astype(np.intp), n - 2)
+    t = f - i
+    if kind in ('linear', 'bilinear'):
+        idx = np.stack((i, i + 1), axis = 1)
+        w = np.stack((1 - t, t), axis = 1)
+    else:
+        t2 = t * t
+        t3 = t2 * t
+        idx = np.clip(np.stack((i - 1, i, i + 1, i + 2), axis = 1), 0, n - 1)
+        w = np.stack((-0.5*t3 + t2 - 0.5*t,
+                      1.5*t3 - 2.5*t2 + 1,
+                      -1.5*t3 + 2*t2 + 0.5*t,
+                      0.5*t3 - 0.5*t2), axis = 1)
+    return idx, w, outside
+
+
+def _interp_rows(zr, ix, wx):
+    #interpolate every row of zr at the x positions given by (ix, wx)
+    out = zr[:, ix[:, 0]] * wx[:, 0]
+    for j in range(1, ix.shape[1]):
+        out += zr[:, ix[:, j]] * wx[:, j]
+    return out
+
+
+def resample_blocks(z, x, y, xi, yi, kind = 'linear', fill_value = np.nan,
+                    block_rows = 256):
+    """
+    Yield (row slice, block) of the resampled grid, block_rows output rows
+    at a time. z has shape (len(y), len(x)) and rows follow y.
+    """
+    ix, wx, xout = axis_weights(x, xi, kind)
+    iy, wy, yout = axis_weights(y, yi, kind)
+    ny_out = len(yi)
+    for r0 in range(0, ny_out, block_rows):
+        r1 = min(r0 + block_rows, ny_out)
+        lo = int(iy[r0:r1].min())
+        hi = int(iy[r0:r1].max()) + 1
+        zx = _interp_rows(np.asarray(z[lo:hi], dtype = np.float64), ix, wx)
+        k = iy[r0:r1] - lo
+        block = zx[k[:, 0]] * wy[r0:r1, 0, np.newaxis]
+        for j in range(1, k.shape[1]):
+            block += zx[k[:, j]] * wy[r0:r1, j, np.newaxis]
+        if fill_value is not None:
+            block[yout[r0:r1]] = fill_value
+            block[:, xout] = fill_value
+        yield slice(r0, r1), block
+
+
+def resample(z, x, y, xi, yi, kind = 'linear', fill_value = np.nan,
+             out = None, block_rows = 256):
+    """
+    Resample the regular grid z(y, x) to the grid (yi, xi).
+
+    kind is 'nearest', 'linear' (same as 'bilinear') or 'cubic'. Points
+    outside the source grid are set to fill_value, or clamped to the edge
+    when fill_value is None. out can be a preallocated (e.g., memory-mapped)
+    array of shape (len(yi), len(xi)).
+    """
+    if out is None:
+        out = np.empty((len(yi), len(xi)))
+    for rows, block in resample_blocks(z, x, y, xi, yi, kind, fill_value,
+                                       block_rows):
+        out[rows] = block
+    return out
+
+
+def resample_difference(z_ref, z, x, y, xi, yi, kind = 'linear',
+                        fill_value = np.nan, out = None, block_rows = 256):
+    """
+    Difference z_ref - resample(z, ...) computed block by block, without
+    holding the full resampled grid. z_ref must be on the grid (yi, xi).
+    """
+    if out is None:
+        out = np.empty((len(yi), len(xi)))
+    for rows, block in resample_blocks(z, x, y, xi, yi, kind, fill_value,
+                                       block_rows):
+        np.subtract(z_ref[rows], block, out = block)
+        out[rows] = block
+    return out
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming, mergeable terrain statistics.
+
+StreamingHistogram keeps fixed-bin counts (plus under-/overflow, min, max,
+mean) and QuantileSketch is a log-bucketed quantile sketch (DDSketch,
+Masson et al., 2019) with a guaranteed relative error. Both are fed tile by
+tile or time step by time step with update(), can be combined across
+workers with merge() and only need O(bins) memory, so slope distributions,
+percentiles and hypsometric curves of large DEMs can be computed without
+raveling or sorting the whole raster.
+
+Usage:
+    h = StreamingHistogram(0, 9000, nbins = 900)
+    s = QuantileSketch(relative_accuracy = 0.005)
+    for z in tiles:
+        h.update(z)
+        s.update(z)
+    s.percentile([5, 10, 25, 50, 75, 90, 95])
+    elevation, area_fraction = h.hypsometric_curve()
+"""
+import numpy as np
+
+from dem_tiles import open_dem, map_tiles
+
+
+class StreamingHistogram(object):
+    def __init__(self, vmin, vmax, nbins = 100):
+        if not vmax > vmin:
+            raise ValueError('vmax must be larger than vmin')
+        self.edges = np.linspace(vmin, vmax, nbins + 1)
+        self.counts = np.zeros(nbins, dtype = np.int64)
+        self.below = 0
+        self.above = 0
+        self.nan = 0
+        self.sum = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def nbins(self):
+        return len(self.counts)
+
+    @property
+    def n(self):
+        """
+        Number of finite values seen (including under- and overflow)
+        """
+        return int(self.counts.sum()) + self.below + self.above
+
+    @property
+    def mean(self):
+        return self.sum / self.n if self.n else np.nan
+
+    def update(self, values):
+        v = np.asarray(values).ravel()
+        finite = np.isfinite(v)
+        n_finite = np.count_nonzero(finite)
+        self.nan += v.size - n_finite
+        if n_finite < v.size:
+            v = v[finite]
+        if v.size == 0:
+            return self
+        self.sum += float(v.sum(dtype = np.float64))
+        self.min = min(self.min, float(v.min()))
+        self.max = max(self.max, float(v.max()))
+        vmin, vmax = self.edges[0], self.edges[-1]
+        idx = np.subtract(v, vmin, dtype = np.float64)
+        idx *= self.nbins / (vmax - vmin)
+        below = idx < 0
+        above = v > vmax
+        self.below += int(np.count_nonzero(below))
+        self.above += int(np.count_nonzero(above))
+        #same convention as np.histogram: the last bin includes vmax
+        idx = idx.astype(np.intp)
+        np.minimum(idx, self.nbins - 1, out = idx)
+        inside = ~(below | above)
+        self.counts += np.bincount(idx[inside], minlength = self.nbins)
+        return self
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('histograms must have the same bin edges to be merged')
+        self.counts += other.counts
+        self.below += other.below
+        self.above += other.above
+        self.nan += other.nan
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        """
+        Percentiles (0-100) interpolated within bins.
+
+        The error is at most one bin width as long as the percentile lies
+        inside [vmin, vmax]; percentiles falling into the under- or overflow
+        are clipped to the observed min or max.
+        """
+        p = np.asarray(p, dtype = np.float64)
+        n = self.n
+        if n == 0:
+            return np.full(p.shape, np.nan)
+        cum = np.concatenate(([self.below], self.below + np.cumsum(self.counts)))
+        rank = p / 100. * n
+        i = np.searchsorted(cum, rank, side = 'left') - 1
+        i = np.clip(i, 0, self.nbins - 1)
+        width = self.edges[1] - self.edges[0]
+        c = self.counts[i]
+        frac = np.divide(rank - cum[i], c, out = np.zeros_like(rank), where = c > 0)
+        q = self.edges[i] + np.clip(frac, 0, 1) * width
+        q = np.where(rank <= self.below, self.min, q)
+        q = np.where(rank >= cum[-1], self.max, q)
+        return q
+
+    def hypsometric_curve(self, normalize = True):
+        """
+        Return (bin edges, fraction of area above each edge)
+
+        With normalize = True the elevations are scaled to (h - min)/(max - min)
+        as in the usual hypsometric integral.
+        """
+        n = self.n
+        above = n - np.concatenate(([self.below], self.below + np.cumsum(self.counts)))
+        fraction = above / float(n) if n else np.full(len(self.edges), np.nan)
+        h = self.edges
+        if normalize and self.max > self.min:
+            h = (h - self.min) / (self.max - self.min)
+        return h, fraction
+
+    def hypsometric_integral(self):
+        h, fraction = self.hypsometric_curve(normalize = True)
+        inside = (h >= 0) & (h <= 1)
+        h, fraction = h[inside], fraction[inside]
+        if len(h) < 2:
+            return np.nan
+        return float(np.sum(0.5 * (fraction[1:] + fraction[:-1]) * np.diff(h)))
+
+    def plot(self, ax, density = False, **kwargs):
+        """
+        Draw the histogram as steps, like ax.hist(..., histtype='step')
+        """
+        counts = self.counts
+        if density:
+            counts = counts / (counts.sum() * np.diff(self.edges))
+        return ax.stairs(counts, self.edges, **kwargs)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch with relative error <= relative_accuracy.
+
+    Values are counted in logarithmic buckets of ratio
+    gamma = (1 + a)/(1 - a); negative values use a mirrored set of buckets
+    and |v| < min_value counts as zero. Memory grows with the log of the
+    value range, e.g. about 1200 buckets for slopes between 1e-6 and 1e4
+    at a = 0.01.
+    """
+    def __init__(self, relative_accuracy = 0.01, min_value = 1e-9):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be in (0, 1)')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._inv_log_gamma = 1. / np.log(self.gamma)
+        self.min_value = min_value
+        self.zero = 0
+        self.nan = 0
+        #dense bucket counts; bucket key k is stored at index k - offset
+        self._pos = np.zeros(0, dtype = np.int64)
+        self._pos_offset = 0
+        self._neg = np.zeros(0, dtype = np.int64)
+        self._neg_offset = 0
+
+    @property
+    def n(self):
+        return int(self._pos.sum() + self._neg.sum()) + self.zero
+
+    def _keys(self, v):
+        return np.ceil(np.log(v) * self._inv_log_gamma).astype(np.int64)
+
+    @staticmethod
+    def _add(store, offset, keys, counts = None):
+        if keys.size == 0:
+            return store, offset
+        kmin, kmax = int(keys.min()), int(keys.max())
+        if store.size == 0:
+            offset = kmin
+        new_offset = min(offset, kmin)
+        new_size = max(offset + store.size, kmax + 1) - new_offset
+        if new_offset != offset or new_size != store.size:
+            grown = np.zeros(new_size, dtype = np.int64)
+            grown[offset - new_offset:offset - new_offset + store.size] = store
+            store, offset = grown, new_offset
+        store += np.bincount(keys - offset, weights = counts,
+                             minlength = store.size).astype(np.int64)
+        return store, offset
+
+    def update(self, values):
+        v = np.asarray(values, dtype = np.float64).ravel()
+        finite = np.isfinite(v)
+        self.nan += v.size - int(np.count_nonzero(finite))
+        if not finite.all():
+            v = v[finite]
+        pos = v >= self.min_value
+        neg = v <= -self.min_value
+        self.zero += v.size - int(np.count_nonzero(pos)) - int(np.count_nonzero(neg))
+        self._pos, self._pos_offset = self._add(self._pos, self._pos_offset,
+                                                self._keys(v[pos]))
+        self._neg, self._neg_offset = self._add(self._neg, self._neg_offset,
+                                                self._keys(-v[neg]))
+        return self
+
+    def merge(self, other):
+        if other.gamma != self.gamma or other.min_value != self.min_value:
+            raise ValueError('sketches must have the same accuracy to be merged')
+        self.zero += other.zero
+        self.nan += other.nan
+        keys = np.arange(other._pos.size) + other._pos_offset
+        self._pos, self._pos_offset = self._add(self._pos, self._pos_offset,
+                                                keys, other._pos)
+        keys = np.arange(other._neg.size) + other._neg_offset
+        self._neg, self._neg_offset = self._add(self._neg, self._neg_offset,
+                                                keys, other._neg)
+        return self
+
+    def _value(self, key):
+        return 2. * np.power(self.gamma, key) / (self.gamma + 1)
+
+    def percentile(self, p):
+        """
+        Percentiles (0-100) with relative error <= relative_accuracy
+        """
+        p = np.atleast_1d(np.asarray(p, dtype = np.float64))
+        n = self.n
+        if n == 0:
+            return np.full(p.shape, np.nan)
+        #buckets in ascending order of value: most negative first
+        keys = np.concatenate((np.arange(self._neg.size)[::-1] + self._neg_offset,
+                               [0],
+                               np.arange(self._pos.size) + self._pos_offset))
+        counts = np.concatenate((self._neg[::-1], [self.zero], self._pos))
+        values = np.concatenate((-self._value(keys[:self._neg.size]), [0.],
+                                 self._value(keys[self._neg.size + 1:])))
+        cum = np.cumsum(counts)
+        rank = p / 100. * (n - 1)
+        i = np.searchsorted(cum, rank, side = 'right')
+        return values[np.minimum(i, len(values) - 1)]
+
+
+def dem_statistics(dem, vmin, vmax, nbins = 1000, relative_accuracy = 0.01,
+                   tile_size = 1024, n_workers = None):
+    """
+    Histogram and quantile sketch of a DEM (file name, memmap or array),
+    accumulated tile by tile on a thread pool and merged at the end.
+    """
+    reader = open_dem(dem)
+
+    def accumulate(z, window, inner):
+        h = StreamingHistogram(vmin, vmax, nbins).update(z)
+        s = QuantileSketch(relative_accuracy).update(z)
+        return h, s
+
+    hist = StreamingHistogram(vmin, vmax, nbins)
+    sketch = QuantileSketch(relative_accuracy)
+    for h, s in map_tiles(accumulate, reader, tile_size, halo = 0,
+                          n_workers = n_workers):
+        hist.merge(h)
+        sketch.merge(s)
+    return hist, sketch
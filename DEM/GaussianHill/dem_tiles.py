@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Out-of-core, tiled terrain attributes for DEMs that do not fit in memory.
+
+The DEM is split into tiles. Every tile is read together with a halo of
+`halo` cells (one cell is enough for the 3x3 stencil of TerrainAttributes),
+processed on a thread pool (NumPy releases the GIL in the array operations)
+and the tile interior is written into memory-mapped .npy output rasters.
+Peak memory is set by tile_size and the number of workers, not by the DEM
+size. Because the halo supplies the true neighbours and the DEM edges use
+the same extrapolation as TerrainAttributes, the stitched result is
+identical to processing the whole DEM at once.
+
+Usage:
+    out = tiled_terrain_attributes('Baspa_SRTM1_30m_UTM46N.tif', 'baspa',
+                                   attributes = ('slope', 'profile_curvature'),
+                                   tile_size = 1024, n_workers = 4)
+    out['slope']    #np.memmap stored in baspa_slope.npy
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from terrain_attributes import TerrainAttributes
+
+
+def dem_tiles(shape, tile_size = 1024, halo = 1):
+    """
+    Yield (read_window, inner) for every tile of a DEM of the given shape.
+
+    read_window = (r0, r1, c0, c1) is the tile including the halo (clipped
+    at the DEM edges) and inner = (r0, r1, c0, c1) is the part of the DEM
+    the tile is responsible for. Both are half-open row/column ranges.
+    """
+    rows, cols = shape
+    for r0, r1 in _splits(rows, tile_size):
+        for c0, c1 in _splits(cols, tile_size):
+            window = (max(r0 - halo, 0), min(r1 + halo, rows),
+                      max(c0 - halo, 0), min(c1 + halo, cols))
+            yield window, (r0, r1, c0, c1)
+
+
+def _splits(n, tile_size):
+    #a last strip of a single cell is merged into the previous tile, so that
+    #every tile has at least the 3 cells the stencil needs at the DEM edge
+    starts = list(range(0, n, tile_size))
+    if len(starts) > 1 and n - starts[-1] < 2:
+        starts.pop()
+    ends = starts[1:] + [n]
+    return list(zip(starts, ends))
+
+
+class ArrayReader(object):
+    """
+    Window reader for an in-memory or memory-mapped array
+    """
+    def __init__(self, dem, d = 1.):
+        self.dem = dem
+        self.shape = dem.shape
+        self.d = d
+        self.nodata = None
+
+    def read(self, r0, r1, c0, c1):
+        return np.asarray(self.dem[r0:r1, c0:c1], dtype = np.float64)
+
+
+class GdalReader(object):
+    """
+    Window reader for a GeoTIFF (or any single-band GDAL raster).
+
+    GDAL datasets must not be shared between threads, so every thread opens
+    its own handle. Nodata cells are returned as NaN.
+    """
+    def __init__(self, dem_fname, band = 1):
+        from osgeo import gdal
+        self._gdal = gdal
+        self.dem_fname = dem_fname
+        self.band = band
+        t = gdal.Open(dem_fname)
+        if t is None:
+            raise IOError('could not open %s' % dem_fname)
+        self.gt = t.GetGeoTransform()
+        self.shape = (t.RasterYSize, t.RasterXSize)
+        self.d = abs(self.gt[1])
+        self.nodata = t.GetRasterBand(band).GetNoDataValue()
+        self._local = threading.local()
+
+    def _band(self):
+        if not hasattr(self._local, 'band'):
+            self._local.dataset = self._gdal.Open(self.dem_fname)
+            self._local.band = self._local.dataset.GetRasterBand(self.band)
+        return self._local.band
+
+    def read(self, r0, r1, c0, c1):
+        z = self._band().ReadAsArray(c0, r0, c1 - c0, r1 - r0).astype(np.float64)
+        if self.nodata is not None:
+            z[z == self.nodata] = np.nan
+        return z
+
+
+def open_dem(dem, d = None):
+    """
+    Return a window reader for a file name, an array or an existing reader
+    """
+    if isinstance(dem, (ArrayReader, GdalReader)):
+        return dem
+    if isinstance(dem, str):
+        if dem.endswith('.npy'):
+            return ArrayReader(np.load(dem, mmap_mode = 'r'), 1. if d is None else d)
+        reader = GdalReader(dem)
+        if d is not None:
+            reader.d = d
+        return reader
+    return ArrayReader(dem, 1. if d is None else d)
+
+
+def map_tiles(func, reader, tile_size = 1024, halo = 1, n_workers = None):
+    """
+    Call func(z_tile, window, inner) for all tiles on a thread pool.
+
+    At most 2 * n_workers tiles are read and in flight at any time, so peak
+    memory is bounded by the tile size. Results are returned in tile order.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    def job(window, inner):
+        return func(reader.read(*window), window, inner)
+
+    results = []
+    pending = set()
+    with ThreadPoolExecutor(max_workers = n_workers) as pool:
+        for window, inner in dem_tiles(reader.shape, tile_size, halo):
+            if len(pending) >= 2 * n_workers:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for f in done:
+                    f.result()
+            f = pool.submit(job, window, inner)
+            pending.add(f)
+            results.append(f)
+        return [f.result() for f in results]
+
+
+def tiled_terrain_attributes(dem, out_prefix, attributes = ('slope',),
+                             method = 'zt', d = None, tile_size = 1024,
+                             halo = 1, n_workers = None, dtype = np.float32):
+    """
+    Compute terrain attributes tile by tile into memory-mapped .npy files.
+
+    dem can be a GDAL-readable file name, a .npy file (opened memory-mapped)
+    or an array. d is the cell size; it is taken from the geotransform for
+    GDAL rasters and must be given for arrays. Output rasters are written to
+    <out_prefix>_<attribute>.npy and returned as np.memmap in a dict.
+    """
+    if halo < 1:
+        raise ValueError('a halo of at least one cell is needed for the 3x3 stencil')
+    reader = open_dem(dem, d)
+    out = {}
+    for name in attributes:
+        out[name] = np.lib.format.open_memmap('%s_%s.npy' % (out_prefix, name),
+                                             mode = 'w+', dtype = dtype,
+                                             shape = reader.shape)
+    #one engine per thread and tile shape, so buffers are reused between tiles
+    local = threading.local()
+
+    def engine(shape):
+        if not hasattr(local, 'engines'):
+            local.engines = {}
+        if shape not in local.engines:
+            local.engines[shape] = TerrainAttributes(shape, reader.d,
+                                                     method = method,
+                                                     attributes = attributes)
+        return local.engines[shape]
+
+    def process(z, window, inner):
+        ta = engine(z.shape).compute(z)
+        r0, r1, c0, c1 = inner
+        rr = slice(r0 - window[0], r1 - window[0])
+        cc = slice(c0 - window[2], c1 - window[2])
+        for name in attributes:
+            out[name][r0:r1, c0:c1] = getattr(ta, name)[rr, cc]
+
+    map_tiles(process, reader, tile_size, halo, n_workers)
+    for name in attributes:
+        out[name].flush()
+    return out
+
+
+if __name__ == '__main__':
+    #slope and curvature of the 30 m SRTM1 DEM of the Baspa catchment
+    dem_fname = '../../Matlab-Topotools/Baspa_SRTM1_30m_UTM46N.tif'
+    out = tiled_terrain_attributes(dem_fname, 'Baspa_SRTM1_30m',
+                                   attributes = ('slope', 'profile_curvature'),
+                                   tile_size = 512)
+    print('slope percentiles:', np.nanpercentile(out['slope'], [5, 50, 95]))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel comparison of flow-routing methods against the analytic specific
+catchment area (SCA) of the Gaussian Hill and the inverted valley head
+(z = 1 - z).
+
+The DEMs and their analytic SCA are copied once into a block of shared
+memory. Every (case, method, exponent) combination is a job of a process
+pool; the workers attach to the shared block instead of receiving a pickled
+copy of the grids, so sweeps over methods and exponents scale with the
+number of cores. Each job returns the error metrics of SCA = accumulation * d
+over the interior cells (the edge cells are outlets and the hill top /
+valley bottom, where the analytic SCA is 0 or infinite, is excluded).
+
+Usage:
+    table = compare_flow_methods(n = 234, exponents = (1.1, 2, 5))
+    python flow_comparison.py --n 234 --exponents 1.1 2 5 --output flow_comparison.csv
+"""
+import argparse
+import csv
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from flow_accumulation import METHODS, flow_accumulation
+from gaussian_hill_field import GaussianHillField
+
+CASES = ('hill', 'valley')
+#methods with a flow-partition exponent
+MFD_METHODS = ('freeman', 'quinn')
+
+#set in every worker by _attach()
+_shared = {}
+
+
+def valley_head_sca(gh):
+    """
+    Analytic SCA of the valley head 1 - exp(-x^2 - y^2) on the square grid
+    of gh. Flow converges radially, so a cell at radius r drains the ray
+    between r and the domain edge at R = b' r / max(|x|, |y|):
+    SCA = (R^2 - r^2) / (2 r). b' = b - d/2 because the edge cells are
+    outlets and do not pass their flow on.
+    """
+    m = np.maximum(np.abs(gh.x), np.abs(gh.y))
+    bb = gh.b - gh.d / 2.
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        sca = gh.r * (bb * bb / (m * m) - 1) / 2
+    return np.maximum(sca, 0)
+
+
+def _attach(name, shape):
+    #pool initializer: map the shared (case, [z, sca], rows, cols) block
+    shm = shared_memory.SharedMemory(name = name)
+    _shared['shm'] = shm
+    _shared['grids'] = np.ndarray(shape, dtype = np.float64, buffer = shm.buf)
+
+
+def error_metrics(sca, reference):
+    """
+    RMSE, MAE, maximum error, bias and median relative error of sca over
+    the interior cells where the reference is finite and positive
+    """
+    valid = np.isfinite(reference) & (reference > 0)
+    valid[[0, -1], :] = False
+    valid[:, [0, -1]] = False
+    e = sca[valid] - reference[valid]
+    ae = np.abs(e)
+    return {'rmse': float(np.sqrt(np.mean(e*e))), 'mae': float(ae.mean()),
+            'linf': float(ae.max()), 'bias': float(e.mean()),
+            'median_rel_error': float(np.median(ae / reference[valid]))}
+
+
+def _run_job(job):
+    case, method, exponent, d = job
+    z, reference = _shared['grids'][CASES.index(case)]
+    t0 = time.perf_counter()
+    sca = flow_accumulation(z, method, exponent, d)
+    sca *= d
+    result = {'case': case, 'method': method,
+              'exponent': '' if exponent is None else exponent,
+              'wall_time_s': time.perf_counter() - t0}
+    result.update(error_metrics(sca, reference))
+    return result
+
+
+def compare_flow_methods(n = 234, b = 2.5, methods = METHODS,
+                         exponents = (1.1,), cases = CASES, n_workers = None,
+                         output = None):
+    """
+    Run every method (and, for 'freeman' and 'quinn', every exponent) on
+    the Gaussian Hill and valley head in a process pool. Returns the error
+    metrics as a list of dicts in job order and writes them to a CSV file
+    if output is given.
+    """
+    gh = GaussianHillField(n, b)
+    shape = (len(CASES), 2, n, n)
+    shm = shared_memory.SharedMemory(create = True,
+                                     size = int(np.prod(shape)) * 8)
+    try:
+        grids = np.ndarray(shape, dtype = np.float64, buffer = shm.buf)
+        grids[0, 0] = gh.elevation
+        grids[0, 1] = gh.sca
+        np.subtract(1, gh.elevation, out = grids[1, 0])
+        grids[1, 1] = valley_head_sca(gh)
+        del grids
+        gh.clear()
+
+        jobs = []
+        for case in cases:
+            for method in methods:
+                for exponent in (exponents if method in MFD_METHODS else (None,)):
+                    jobs.append((case, method, exponent, float(gh.d)))
+        results = []
+        with ProcessPoolExecutor(n_workers, initializer = _attach,
+                                 initargs = (shm.name, shape)) as pool:
+            for r in pool.map(_run_job, jobs):
+                print('%-6s %-7s %4s  %7.3f s  RMSE=%.3e  MAE=%.3e  median rel=%.3f'
+                      % (r['case'], r['method'], r['exponent'], r['wall_time_s'],
+                         r['rmse'], r['mae'], r['median_rel_error']))
+                results.append(r)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if output is not None:
+        with open(output, 'w', newline = '') as f:
+            w = csv.DictWriter(f, fieldnames = list(results[0].keys()))
+            w.writeheader()
+            w.writerows(results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--n', type = int, default = 234)
+    parser.add_argument('--methods', nargs = '+', default = list(METHODS),
+                        choices = METHODS)
+    parser.add_argument('--exponents', type = float, nargs = '+', default = [1.1])
+    parser.add_argument('--cases', nargs = '+', default = list(CASES),
+                        choices = CASES)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--output', default = None)
+    args = parser.parse_args()
+    compare_flow_methods(args.n, methods = args.methods,
+                         exponents = args.exponents, cases = args.cases,
+                         n_workers = args.workers, output = args.output)
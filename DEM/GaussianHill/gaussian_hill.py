@@ -1,47 +1,46 @@
 import numpy as np
 from matplotlib import pyplot as pl
+from gaussian_hill_field import GaussianHillField
+from terrain_attributes import TerrainAttributes
+from dem_stats import StreamingHistogram
+from dem_plot import lod_scatter3d
 
 def gaussian_hill_elevation(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    z = np.exp(-x*x-y*y)
-    return (x, y, z)
+    gh = GaussianHillField(n, b)
+    x, y = gh.grid()
+    return (x, y, gh.elevation)
 
 def gaussian_hill_slope(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    r = np.sqrt(x*x+y*y)
-    return 2*r*np.exp(-r*r)
+    return GaussianHillField(n, b).slope
 
 def gaussian_hill_curvature(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    r = np.sqrt(x*x+y*y)
-    return (1 - 2*r*r)*2*np.exp(-r*r)
+    return GaussianHillField(n, b).curvature
 
 def np_slope(x, y, z):
     d = y[1,0] - y[0,0]
-    dy, dx = np.gradient(z, d)
-    return np.sqrt(dx*dx+dy*dy)
+    ta = TerrainAttributes(z.shape, d, attributes = ('slope',))
+    return ta.compute(z).slope
 
 def np_abs_curvature(x, y, z):
     d = y[1,0] - y[0,0]
-    dy, dx = np.gradient(z, d)
-    dz = np.sqrt(dx*dx+dy*dy)
-    dy, dx = np.gradient(dz, d)
-    return np.sqrt(dx*dx+dy*dy)
+    ta = TerrainAttributes(z.shape, d, attributes = ('abs_curvature',))
+    return ta.compute(z).abs_curvature
 
 #Plot Analytical Solution of Gaussian Hill Elevation, Slope, and Curvature
 n = 111
 fg, ax = pl.subplots(1, 3)
-x, y, z = gaussian_hill_elevation(n)
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+#derivatives are computed once and shared by all numeric slope/curvature plots
+ta = TerrainAttributes(z.shape, gh.d).compute(z)
 im = ax[0].imshow(z, cmap = pl.cm.cividis_r)
 cb = fg.colorbar(im, ax = ax[0], orientation = 'horizontal')
 cb.set_label('Elevation')
-im = ax[1].imshow(gaussian_hill_slope(n), cmap = pl.cm.magma_r)
+im = ax[1].imshow(gh.slope, cmap = pl.cm.magma_r)
 cb = fg.colorbar(im, ax = ax[1], orientation = 'horizontal')
 cb.set_label('Slope')
-v = gaussian_hill_curvature(n)
+v = gh.curvature
 vmax = v.max()
 im = ax[2].imshow(v, cmap = pl.cm.seismic, vmin = -vmax, vmax = vmax)
 cb = fg.colorbar(im, ax = ax[2], orientation = 'horizontal')
@@ -52,7 +51,8 @@ pl.show()
 from mpl_toolkits.mplot3d import Axes3D  
 fig = pl.figure()
 ax = fig.add_subplot(111, projection='3d')
-ax.scatter(x.ravel(), y.ravel(), z.ravel(), s=5, c=z.ravel(), cmap='viridis', marker='o')
+#large grids are reduced to ~20000 min/max-preserving nodes before plotting
+lod_scatter3d(ax, x, y, z, c=z, max_points=20000, s=5, cmap='viridis', marker='o')
 ax.set_xlabel('X')
 ax.set_ylabel('Y')
 ax.set_zlabel('Z')
@@ -61,22 +61,22 @@ ax.set_zlabel('Z')
 from mpl_toolkits.mplot3d import Axes3D  
 fig = pl.figure()
 ax = fig.add_subplot(111, projection='3d')
-ax.scatter(x.ravel(), y.ravel(), z.ravel(), s=5, c=gaussian_hill_slope(n).ravel(), cmap='magma_r', marker='o')
+lod_scatter3d(ax, x, y, z, c=gh.slope, max_points=20000, s=5, cmap='magma_r', marker='o')
 ax.set_xlabel('X')
 ax.set_ylabel('Y')
 ax.set_zlabel('Z')
 
 # Plot Analytical and numerical Slope analysis
 fg, ax = pl.subplots(1, 3)
-im = ax[0].imshow(gaussian_hill_slope(n), cmap = pl.cm.magma_r)
+im = ax[0].imshow(gh.slope, cmap = pl.cm.magma_r)
 cb = fg.colorbar(im, ax = ax[0], orientation = 'horizontal')
 cb.set_label('Slope (analytic)')
 
-im = ax[1].imshow(np_slope(x, y, z), cmap = pl.cm.magma_r)
+im = ax[1].imshow(ta.slope, cmap = pl.cm.magma_r)
 cb = fg.colorbar(im, ax = ax[1], orientation = 'horizontal')
 cb.set_label('Slope (numeric)')
 
-v = gaussian_hill_slope(n) - np_slope(x, y, z)
+v = gh.slope - ta.slope
 vmax = v.max()
 im = ax[2].imshow(v, cmap = pl.cm.seismic, vmin = -vmax, vmax = vmax)
 cb = fg.colorbar(im, ax = ax[2], orientation = 'horizontal')
@@ -85,19 +85,19 @@ pl.show()
 
 # Plot Analytical and numerical Curvature analysis
 fg, ax = pl.subplots(1, 3)
-v = gaussian_hill_curvature(n)
+v = gh.curvature
 vmax = v.max()
 im = ax[0].imshow(v, cmap = pl.cm.seismic, vmin = -vmax, vmax = vmax)
 cb = fg.colorbar(im, ax = ax[0], orientation = 'horizontal')
 cb.set_label('Curvature (analytic)')
 
-v = np_abs_curvature(x, y, z)
+v = ta.abs_curvature
 vmax = v.max()
 im = ax[1].imshow(v, cmap = pl.cm.seismic, vmin = -vmax, vmax = vmax)
 cb = fg.colorbar(im, ax = ax[1], orientation = 'horizontal')
 cb.set_label('Curvature (numeric)')
 
-v = np.abs(gaussian_hill_curvature(n)) - np_abs_curvature(x, y, z)
+v = np.abs(gh.curvature) - ta.abs_curvature
 vmax = np.percentile(v, 99)
 im = ax[2].imshow(v, cmap = pl.cm.seismic, vmin = -vmax, vmax = vmax)
 cb = fg.colorbar(im, ax = ax[2], orientation = 'horizontal')
@@ -105,86 +105,99 @@ cb.set_label('Absolute difference (analytic - numeric)')
 pl.show()
 
 # Slope Distributions
+#histograms are accumulated in fixed bins (slopes of the Gaussian Hill are < 1)
 n=11
-x, y, z = gaussian_hill_elevation(n)
-G_grad = gaussian_hill_slope(n)
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+G_grad = gh.slope
 G_numerical_grad = np_slope(x, y, z)
 G_grad_p = np.percentile(G_grad.ravel(), [5,10,25,50,75,90,95])
 G_numerical_grad_p = np.percentile(G_numerical_grad.ravel(), [5,10,25,50,75,90,95])
 G_grad_p-G_numerical_grad_p
 
 fg, ax = pl.subplots(1, 1)
-ax.hist(G_grad.ravel(), bins=10, color='b', histtype='step', label='Gaussian H. analytical gradient')
+StreamingHistogram(0, 1, 10).update(G_grad).plot(ax, color='b', label='Gaussian H. analytical gradient')
 ax.set_xlabel('Slope', fontsize=16)
 ax.set_ylabel('#', fontsize=16)
 ax.set_xlim((0, 1))
-ax.hist(G_numerical_grad.ravel(), bins=100, color='r', histtype='step', label='Gaussian H. numerical gradient')
+StreamingHistogram(0, 1, 100).update(G_numerical_grad).plot(ax, color='r', label='Gaussian H. numerical gradient')
 ax.legend()
 ax.set_title('Gaussian Hill with %d x %d elements'%(n,n), fontsize=24 )
 
 n=111
-x, y, z = gaussian_hill_elevation(n)
-G_grad = gaussian_hill_slope(n)
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+G_grad = gh.slope
 G_numerical_grad = np_slope(x, y, z)
 G_grad_p = np.percentile(G_grad.ravel(), [5,10,25,50,75,90,95])
 G_numerical_grad_p = np.percentile(G_numerical_grad.ravel(), [5,10,25,50,75,90,95])
 G_grad_p-G_numerical_grad_p
 
 fg, ax = pl.subplots(1, 1)
-ax.hist(G_grad.ravel(), bins=100, color='b', histtype='step', label='Gaussian H. analytical gradient')
+StreamingHistogram(0, 1, 100).update(G_grad).plot(ax, color='b', label='Gaussian H. analytical gradient')
 ax.set_xlabel('Slope', fontsize=16)
 ax.set_ylabel('#', fontsize=16)
 ax.set_xlim((0, 1))
-ax.hist(G_numerical_grad.ravel(), bins=100, color='r', histtype='step', label='Gaussian H. numerical gradient')
+StreamingHistogram(0, 1, 100).update(G_numerical_grad).plot(ax, color='r', label='Gaussian H. numerical gradient')
 ax.legend()
 ax.set_title('Gaussian Hill with %d x %d elements'%(n,n), fontsize=24 )
 
 n=1111
-x, y, z = gaussian_hill_elevation(n)
-G_grad = gaussian_hill_slope(n)
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+G_grad = gh.slope
 G_numerical_grad = np_slope(x, y, z)
 G_grad_p = np.percentile(G_grad.ravel(), [5,10,25,50,75,90,95])
 G_numerical_grad_p = np.percentile(G_numerical_grad.ravel(), [5,10,25,50,75,90,95])
 G_grad_p-G_numerical_grad_p
 
 fg, ax = pl.subplots(1, 1)
-ax.hist(G_grad.ravel(), bins=1000, color='b', histtype='step', label='Gaussian H. analytical gradient')
+StreamingHistogram(0, 1, 1000).update(G_grad).plot(ax, color='b', label='Gaussian H. analytical gradient')
 ax.set_xlabel('Slope', fontsize=16)
 ax.set_ylabel('#', fontsize=16)
 ax.set_xlim((0, 1))
-ax.hist(G_numerical_grad.ravel(), bins=100, color='r', histtype='step', label='Gaussian H. numerical gradient')
+StreamingHistogram(0, 1, 100).update(G_numerical_grad).plot(ax, color='r', label='Gaussian H. numerical gradient')
 ax.legend()
 ax.set_title('Gaussian Hill with %d x %d elements'%(n,n), fontsize=24 )
 
 #Subsampling/Resampling
 n=111
-x, y, z = gaussian_hill_elevation(n)
-G_grad = gaussian_hill_slope(n)
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+G_grad = gh.slope
+#level 1 of a decimating pyramid is z[::2, ::2]; coarser levels and their
+#slopes are built once and cached (pyr.elevation(k), pyr.slope(k))
+from dem_pyramid import DEMPyramid
+pyr = DEMPyramid(z, gh.d, method='decimate')
 xs = x[::2, ::2]
 ys = y[::2, ::2]
-zs = z[::2, ::2]
+zs = pyr.elevation(1)
 
 # Plot 3D view using elevation as color code and subsampled data
 from mpl_toolkits.mplot3d import Axes3D  
 fig = pl.figure()
 ax = fig.add_subplot(111, projection='3d')
-ax.scatter(x.ravel(), y.ravel(), z.ravel(), s=25, c=z.ravel(), cmap='viridis', marker='o')
-ax.scatter(xs.ravel(), ys.ravel(), zs.ravel(), s=15, c='k', marker='x')
+lod_scatter3d(ax, x, y, z, c=z, max_points=20000, s=25, cmap='viridis', marker='o')
+lod_scatter3d(ax, xs, ys, zs, c='k', max_points=20000, s=15, marker='x')
 ax.set_xlabel('X')
 ax.set_ylabel('Y')
 ax.set_zlabel('Z')
 
 #Interpolate to surface with higher density
-#scipy.interpolate.interp2d(x, y, z, kind='linear', copy=True, bounds_error=False, fill_value=nan)[source]
-from scipy.interpolate import interp2d
+#separable regular-grid resampling (kind='linear', 'cubic' or 'nearest'),
+#scipy.interpolate.interp2d has been removed from SciPy
+from dem_resample import resample
 b=2.5
 x_elementsi = np.linspace(-b,b,n)[::2]
 y_elementsi = np.linspace(-b,b,n)[::2]
-zsi = interp2d(x_elementsi, y_elementsi, zs, kind='linear')
 
-x_elementsi = np.linspace(-b,b,n)
-y_elementsi = np.linspace(-b,b,n)
-zi = zsi(x_elementsi, y_elementsi)
+x_elementsi_full = np.linspace(-b,b,n)
+y_elementsi_full = np.linspace(-b,b,n)
+zi = resample(zs, x_elementsi, y_elementsi, x_elementsi_full, y_elementsi_full, kind='linear')
 
 fg, ax = pl.subplots(2, 2)
 vmin = 0
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resolution-convergence benchmark of numeric vs analytic Gaussian Hill
+derivatives.
+
+For every grid size n and stencil the numeric slope and curvature of the
+Gaussian Hill are compared with the analytic solution of GaussianHillField.
+Each configuration records the wall time (best of `repeats` calls after a
+warm-up call), the peak memory allocated by NumPy for the first call
+including all buffers (tracemalloc), the RMS (L2) and maximum (Linf) error
+of slope and curvature and the bias of the slope percentiles
+(numeric - analytic). Errors are taken over the interior cells;
+the outermost ring uses one-sided differences.
+
+Stencils:
+    gradient  np.gradient slope and nested-gradient abs curvature (the
+              original np_slope / np_abs_curvature)
+    zt        TerrainAttributes, Zevenbergen & Thorne (1987)
+    horn      TerrainAttributes, Horn (1981) first derivatives
+
+Run with:
+    python gaussian_hill_benchmark.py --sizes 11 111 1111 --output bench.csv
+"""
+import argparse
+import csv
+import time
+import tracemalloc
+
+import numpy as np
+
+from gaussian_hill_field import GaussianHillField
+from terrain_attributes import TerrainAttributes
+
+PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+STENCILS = ('gradient', 'zt', 'horn')
+
+
+def gradient_derivatives(z, d):
+    dy, dx = np.gradient(z, d)
+    slope = np.sqrt(dx*dx+dy*dy)
+    dy, dx = np.gradient(slope, d)
+    return slope, np.sqrt(dx*dx+dy*dy)
+
+
+def derivative_kernel(shape, d, stencil, dtype = np.float64):
+    """
+    Return a function z -> (slope, curvature). Curvature is the abs
+    curvature for 'gradient' and the profile curvature for the 3x3 stencils,
+    matching the definition of gaussian_hill_curvature(). The TerrainAttributes
+    buffers are allocated here once and reused by every call, as they would
+    be in a time loop.
+    """
+    if stencil == 'gradient':
+        return lambda z: gradient_derivatives(z, d)
+    ta = TerrainAttributes(shape, d, method = stencil,
+                           attributes = ('slope', 'profile_curvature'),
+                           dtype = dtype)
+
+    def kernel(z):
+        ta.compute(z)
+        return ta.slope, ta.profile_curvature
+    return kernel
+
+
+def error_norms(numeric, analytic):
+    e = (numeric - analytic)[1:-1, 1:-1]
+    return float(np.sqrt(np.mean(e*e))), float(np.abs(e).max())
+
+
+def run_case(n, stencil, repeats = 3, dtype = np.float64):
+    gh = GaussianHillField(n, dtype = dtype)
+    z = gh.elevation
+
+    tracemalloc.start()
+    kernel = derivative_kernel(z.shape, gh.d, stencil, dtype)
+    slope, curvature = kernel(z)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for i in range(repeats):
+        t0 = time.perf_counter()
+        kernel(z)
+        times.append(time.perf_counter() - t0)
+
+    if stencil == 'gradient':
+        analytic_curvature = np.abs(gh.curvature)
+    else:
+        analytic_curvature = gh.curvature
+    slope_l2, slope_linf = error_norms(slope, gh.slope)
+    curv_l2, curv_linf = error_norms(curvature, analytic_curvature)
+    bias = np.percentile(slope, PERCENTILES) - np.percentile(gh.slope, PERCENTILES)
+
+    result = {'n': n, 'stencil': stencil, 'dtype': np.dtype(dtype).name,
+              'd': float(gh.d), 'wall_time_s': min(times),
+              'peak_memory_mb': peak / 1024.**2,
+              'slope_l2': slope_l2, 'slope_linf': slope_linf,
+              'curvature_l2': curv_l2, 'curvature_linf': curv_linf}
+    for p, b in zip(PERCENTILES, bias):
+        result['slope_p%02d_bias' % p] = float(b)
+    return result
+
+
+def run_benchmark(sizes = (11, 111, 1111), stencils = STENCILS, repeats = 3,
+                  dtype = np.float64, output = None):
+    """
+    Sweep grid sizes and stencils; write the results to a CSV file if
+    output is given and return them as a list of dicts
+    """
+    results = []
+    for n in sizes:
+        for stencil in stencils:
+            r = run_case(n, stencil, repeats, dtype)
+            print('n=%5d %-8s %8.4f s %8.1f MB  slope Linf=%.3e  curvature Linf=%.3e'
+                  % (n, stencil, r['wall_time_s'], r['peak_memory_mb'],
+                     r['slope_linf'], r['curvature_linf']))
+            results.append(r)
+    if output is not None:
+        with open(output, 'w', newline = '') as f:
+            w = csv.DictWriter(f, fieldnames = list(results[0].keys()))
+            w.writeheader()
+            w.writerows(results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [11, 111, 1111])
+    parser.add_argument('--stencils', nargs = '+', default = list(STENCILS),
+                        choices = STENCILS)
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--float32', action = 'store_true',
+                        help = 'run in single precision')
+    parser.add_argument('--output', default = 'gaussian_hill_benchmark.csv')
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.stencils, args.repeats,
+                  np.float32 if args.float32 else np.float64, args.output)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analytic Gaussian Hill z = exp(-x^2 - y^2) on an n x n grid spanning [-b, b].
+
+The coordinates are kept as open (broadcastable) 1-D arrays, x with shape
+(1, n) and y with shape (n, 1), so they only take O(n) memory. r^2 is
+computed once and elevation, slope, curvature and specific catchment area
+(SCA) are derived from it the first time they are accessed.
+
+Usage:
+    gh = GaussianHillField(1111, dtype=np.float32)
+    x, y = gh.grid()    #full n x n views for plotting (no copy)
+    z = gh.elevation
+    s = gh.slope        #computed once, cached afterwards
+"""
+from functools import cached_property
+
+import numpy as np
+
+
+class GaussianHillField(object):
+    def __init__(self, n, b = 2.5, dtype = np.float64):
+        self.n = n
+        self.b = b
+        self.dtype = np.dtype(dtype)
+        c = np.linspace(-b, b, n, dtype = self.dtype)
+        self.x = c[np.newaxis, :]
+        self.y = c[:, np.newaxis]
+        #grid spacing, same as y[1,0] - y[0,0] in np_slope
+        self.d = c[1] - c[0]
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    def grid(self):
+        """
+        Return read-only n x n views of x and y (no memory is allocated)
+        """
+        return np.broadcast_arrays(self.x, self.y)
+
+    def clear(self):
+        """
+        Drop all cached fields to release memory
+        """
+        for name in ('r2', 'r', 'elevation', 'slope', 'curvature', 'sca'):
+            self.__dict__.pop(name, None)
+
+    @cached_property
+    def r2(self):
+        r2 = self.x * self.x
+        r2 = r2 + self.y * self.y
+        return r2
+
+    @cached_property
+    def r(self):
+        return np.sqrt(self.r2)
+
+    @cached_property
+    def elevation(self):
+        z = np.negative(self.r2)
+        np.exp(z, out = z)
+        return z
+
+    @cached_property
+    def slope(self):
+        #2*r*exp(-r^2)
+        s = np.multiply(self.r, self.elevation)
+        s *= 2
+        return s
+
+    @cached_property
+    def curvature(self):
+        #(1 - 2*r^2)*2*exp(-r^2)
+        c = np.multiply(self.r2, -2)
+        c += 1
+        c *= self.elevation
+        c *= 2
+        return c
+
+    @cached_property
+    def sca(self):
+        return self.r / 2.0
@@ -1,49 +1,51 @@
 import numpy as np
-import richdem as rd
 from matplotlib import pyplot as pl
 from matplotlib.colors import LogNorm
+from gaussian_hill_field import GaussianHillField
+from terrain_attributes import TerrainAttributes
+from flow_accumulation import mfd_flow_accumulation
+#richdem is optional, the built-in Freeman MFD gives the same result
+try:
+    import richdem as rd
+except ImportError:
+    rd = None
 
 def gaussian_hill_elevation(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    z = np.exp(-x*x-y*y)
-    return (x, y, z)
+    gh = GaussianHillField(n, b)
+    x, y = gh.grid()
+    return (x, y, gh.elevation)
 
 def gaussian_hill_slope(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    r = np.sqrt(x*x+y*y)
-    return 2*r*np.exp(-r*r)
+    return GaussianHillField(n, b).slope
 
 def gaussian_hill_curvature(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    r = np.sqrt(x*x+y*y)
-    return (1 - 2*r*r)*2*np.exp(-r*r)
+    return GaussianHillField(n, b).curvature
 
 def gaussian_hill_sca(n, b = 2.5):
-    x, y = np.meshgrid(np.linspace(-b,b,n),
-                       np.linspace(-b,b,n))
-    r = np.sqrt(x*x+y*y)
-    return r/2.0
+    return GaussianHillField(n, b).sca
+
+def freeman_flow_accumulation(z, exponent = 1.1):
+    if rd is None:
+        return mfd_flow_accumulation(z, exponent = exponent)
+    return rd.FlowAccumulation(rd.rdarray(z, no_data = -9999), method = 'Freeman', exponent = exponent)
 
 def np_slope(x, y, z):
     d = y[1,0] - y[0,0]
-    dy, dx = np.gradient(z, d)
-    return np.sqrt(dx*dx+dy*dy)
+    ta = TerrainAttributes(z.shape, d, attributes = ('slope',))
+    return ta.compute(z).slope
 
 def np_curvature(x, y, z):
     d = y[1,0] - y[0,0]
-    dy, dx = np.gradient(z, d)
-    dz = np.sqrt(dx*dx+dy*dy)
-    dy, dx = np.gradient(dz, d)
-    return np.sqrt(dx*dx+dy*dy)
+    ta = TerrainAttributes(z.shape, d, attributes = ('abs_curvature',))
+    return ta.compute(z).abs_curvature
 
 # Gaussian hill
 n = 234
-x, y, z = gaussian_hill_elevation(n)
-d = y[1,0] - y[0,0]
-sca = rd.FlowAccumulation(rd.rdarray(z, no_data = -9999), method = 'Freeman', exponent = 1.1)
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+d = gh.d
+sca = freeman_flow_accumulation(z, exponent = 1.1)
 sca *= d
 
 fg, ax = pl.subplots(1, 3)
@@ -55,7 +57,7 @@ im = ax[1].imshow(sca, cmap = pl.cm.viridis_r)
 cb = fg.colorbar(im, ax = ax[1], orientation = 'horizontal')
 cb.set_label('SCA (Freeman 1991 flow accumulation, MFD)')
 
-v = gaussian_hill_sca(n) - sca
+v = gh.sca - sca
 vmin = v.min()
 im = ax[2].imshow(v, cmap = pl.cm.seismic, vmin = vmin, vmax = -vmin)
 cb = fg.colorbar(im, ax = ax[2], orientation = 'horizontal')
@@ -70,13 +72,15 @@ pl.show()
 
 # Gaussian valley head
 n = 234
-x, y, z = gaussian_hill_elevation(n)
-d = y[1,0] - y[0,0]
+gh = GaussianHillField(n)
+x, y = gh.grid()
+z = gh.elevation
+d = gh.d
 z = 1 - z
 
 #x, y, z = x[:,n//2:], y[:,n//2:], z[:,n//2:]
 
-sca = rd.FlowAccumulation(rd.rdarray(z, no_data = -9999), method = 'Freeman', exponent = 1.1)
+sca = freeman_flow_accumulation(z, exponent = 1.1)
 sca *= d
 
 fg, ax = pl.subplots(1, 2)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-pass terrain attributes from a 3x3 stencil.
+
+First (p = dz/dx, q = dz/dy) and second (r = d2z/dx2, s = d2z/dxdy,
+t = d2z/dy2) derivatives are computed once per DEM with the
+Zevenbergen & Thorne (1987) stencil ('zt') or, for p and q, the Horn (1981)
+stencil ('horn'). Slope, aspect, profile and planform curvature and the
+"abs curvature" used in gaussian_hill.py are then derived from these
+derivatives. All arrays are allocated once in __init__ and reused by every
+call to compute(), so repeated calls on grids of the same shape do not
+allocate.
+
+Rows are the y direction and columns the x direction, as in np_slope().
+Edges are handled by linear extrapolation of the DEM by one cell, which makes
+the 'zt' first derivatives identical to np.gradient(z, d) (central
+differences inside, one-sided differences at the edges).
+
+Curvatures use the sign convention of gaussian_hill_curvature(): convex
+(e.g., the top of a hill) is positive. Where the surface is flat the
+curvatures fall back to -(r + t)/2, the limit for a radially symmetric
+surface.
+
+Usage:
+    ta = TerrainAttributes(z.shape, d)
+    ta.compute(z)
+    ta.slope, ta.aspect, ta.profile_curvature, ta.planform_curvature
+"""
+import numpy as np
+
+ATTRIBUTES = ('slope', 'aspect', 'profile_curvature', 'planform_curvature',
+              'abs_curvature')
+
+
+class TerrainAttributes(object):
+    def __init__(self, shape, d, method = 'zt', attributes = ATTRIBUTES,
+                 dtype = np.float64):
+        if method not in ('zt', 'horn'):
+            raise ValueError("method must be 'zt' or 'horn', not %r" % (method,))
+        for name in attributes:
+            if name not in ATTRIBUTES:
+                raise ValueError('unknown attribute %r' % (name,))
+        self.shape = tuple(shape)
+        self.d = float(d)
+        self.method = method
+        self.attributes = tuple(attributes)
+        self.dtype = np.dtype(dtype)
+        #slope and aspect only need the first derivatives
+        self.second_derivatives = any(name.endswith('curvature')
+                                      for name in self.attributes)
+
+        ny, nx = self.shape
+        self._zp = np.empty((ny + 2, nx + 2), dtype = self.dtype)
+        self.p = np.empty(self.shape, dtype = self.dtype)
+        self.q = np.empty(self.shape, dtype = self.dtype)
+        self.r = np.empty(self.shape, dtype = self.dtype)
+        self.s = np.empty(self.shape, dtype = self.dtype)
+        self.t = np.empty(self.shape, dtype = self.dtype)
+        self._g2 = np.empty(self.shape, dtype = self.dtype)
+        self._tmp = np.empty(self.shape, dtype = self.dtype)
+        self._flat = np.empty(self.shape, dtype = bool)
+        self._sloped = np.empty(self.shape, dtype = bool)
+        if 'abs_curvature' in self.attributes:
+            self._tmp2 = np.empty(self.shape, dtype = self.dtype)
+        for name in ATTRIBUTES:
+            if name in self.attributes:
+                setattr(self, name, np.empty(self.shape, dtype = self.dtype))
+            else:
+                setattr(self, name, None)
+
+    def _pad(self, z):
+        zp = self._zp
+        zp[1:-1, 1:-1] = z
+        np.multiply(z[0], 2, out = zp[0, 1:-1])
+        zp[0, 1:-1] -= z[1]
+        np.multiply(z[-1], 2, out = zp[-1, 1:-1])
+        zp[-1, 1:-1] -= z[-2]
+        np.multiply(zp[:, 1], 2, out = zp[:, 0])
+        zp[:, 0] -= zp[:, 2]
+        np.multiply(zp[:, -2], 2, out = zp[:, -1])
+        zp[:, -1] -= zp[:, -3]
+        return zp
+
+    def derivatives(self, z):
+        """
+        Fill p, q and (if a curvature is requested) r, s, t for DEM z
+        in place, without allocating
+        """
+        z = np.asarray(z)
+        if z.shape != self.shape:
+            raise ValueError('DEM shape %s does not match %s' % (z.shape, self.shape))
+        if min(self.shape) < 3:
+            raise ValueError('DEM must be at least 3 x 3 cells')
+        zp = self._pad(z)
+        d = self.d
+        c = zp[1:-1, 1:-1]
+        n, s_, w, e = zp[:-2, 1:-1], zp[2:, 1:-1], zp[1:-1, :-2], zp[1:-1, 2:]
+        nw, ne, sw, se = zp[:-2, :-2], zp[:-2, 2:], zp[2:, :-2], zp[2:, 2:]
+        p, q, r, s, t = self.p, self.q, self.r, self.s, self.t
+
+        if self.method == 'zt':
+            np.subtract(e, w, out = p)
+            p *= 1. / (2 * d)
+            np.subtract(s_, n, out = q)
+            q *= 1. / (2 * d)
+        else:
+            np.add(ne, se, out = p)
+            p += e
+            p += e
+            p -= nw
+            p -= sw
+            p -= w
+            p -= w
+            p *= 1. / (8 * d)
+            np.add(sw, se, out = q)
+            q += s_
+            q += s_
+            q -= nw
+            q -= ne
+            q -= n
+            q -= n
+            q *= 1. / (8 * d)
+
+        if not self.second_derivatives:
+            return self
+        np.multiply(c, -2, out = r)
+        r += e
+        r += w
+        r *= 1. / (d * d)
+        np.multiply(c, -2, out = t)
+        t += n
+        t += s_
+        t *= 1. / (d * d)
+        np.subtract(se, ne, out = s)
+        s -= sw
+        s += nw
+        s *= 1. / (4 * d * d)
+        return self
+
+    def compute(self, z):
+        """
+        Compute derivatives and all requested attributes of DEM z
+        """
+        self.derivatives(z)
+        p, q, r, s, t = self.p, self.q, self.r, self.s, self.t
+        g2, tmp, flat, sloped = self._g2, self._tmp, self._flat, self._sloped
+
+        np.multiply(p, p, out = g2)
+        np.multiply(q, q, out = tmp)
+        g2 += tmp
+        np.equal(g2, 0, out = flat)
+        np.logical_not(flat, out = sloped)
+        has_flat = flat.any()
+
+        if self.slope is not None:
+            np.sqrt(g2, out = self.slope)
+
+        if self.aspect is not None:
+            #downslope direction in degrees, counter-clockwise from +x
+            a = self.aspect
+            np.arctan2(q, p, out = a)
+            np.degrees(a, out = a)
+            a += 180.
+            np.mod(a, 360., out = a)
+            if has_flat:
+                np.copyto(a, np.nan, where = flat)
+
+        if self.profile_curvature is not None:
+            #-(p^2 r + 2 p q s + q^2 t) / (p^2 + q^2)
+            k = self.profile_curvature
+            np.multiply(p, p, out = k)
+            k *= r
+            np.multiply(p, q, out = tmp)
+            tmp *= s
+            tmp *= 2
+            k += tmp
+            np.multiply(q, q, out = tmp)
+            tmp *= t
+            k += tmp
+            self._normalise_curvature(k)
+
+        if self.planform_curvature is not None:
+            #-(q^2 r - 2 p q s + p^2 t) / (p^2 + q^2)
+            k = self.planform_curvature
+            np.multiply(q, q, out = k)
+            k *= r
+            np.multiply(p, q, out = tmp)
+            tmp *= s
+            tmp *= 2
+            k -= tmp
+            np.multiply(p, p, out = tmp)
+            tmp *= t
+            k += tmp
+            self._normalise_curvature(k)
+
+        if self.abs_curvature is not None:
+            #|grad(|grad z|)| = |H grad z| / |grad z|
+            k = self.abs_curvature
+            np.multiply(r, p, out = k)
+            np.multiply(s, q, out = tmp)
+            k += tmp
+            np.multiply(k, k, out = k)
+            np.multiply(s, p, out = tmp)
+            tmp += np.multiply(t, q, out = self._tmp2)
+            np.multiply(tmp, tmp, out = tmp)
+            k += tmp
+            np.divide(k, g2, out = k, where = sloped)
+            np.sqrt(k, out = k)
+            if has_flat:
+                np.add(r, t, out = tmp)
+                tmp *= 0.5
+                np.abs(tmp, out = tmp)
+                np.copyto(k, tmp, where = flat)
+        return self
+
+    def _normalise_curvature(self, k):
+        np.divide(k, self._g2, out = k, where = self._sloped)
+        np.negative(k, out = k)
+        if self._flat.any():
+            tmp = self._tmp
+            np.add(self.r, self.t, out = tmp)
+            tmp *= -0.5
+            np.copyto(k, tmp, where = self._flat)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Verification and timing of linear diffusion against the analytic
+fault-scarp solution.
+
+A straight scarp of height h at y_f (as in
+landlab_faultscarp_lineardiffusion.py: closed left and right edges, open
+top and bottom) diffuses as
+    z(y, t) = h / 2 * (1 + erf((y - y_f) / (2 sqrt(kappa t))))
+For every diffusion solver, time step dt, grid spacing dx and diffusivity
+kappa the model is run to total_time. The wall time (best of `repeats`
+runs) and the RMS (L2), maximum (Linf) and mean (bias) error of the core
+nodes against the analytic solution are recorded. The domain has to be
+long compared to the diffusion length 2 sqrt(kappa t), otherwise the fixed
+boundaries add to the error.
+
+Solvers:
+    explicit        landlab LinearDiffuser (internal stability substeps)
+    implicit        lem_diffusion.ImplicitDiffuser, backward Euler
+    crank-nicolson  lem_diffusion.ImplicitDiffuser, theta = 0.5
+
+fastest() picks the fastest configuration that meets an error target and
+compare() lists the configurations that became slower or less accurate
+than in an earlier results table.
+
+Run with:
+    python faultscarp_benchmark.py --dt 100 250 1000 --dx 0.5 1 2 \
+        --kappa 0.01 --target 0.05 --output faultscarp_benchmark.csv
+    python faultscarp_benchmark.py --baseline faultscarp_benchmark.csv
+"""
+import argparse
+import csv
+import itertools
+import sys
+import time
+
+import numpy as np
+from scipy.special import erf
+
+from landlab import RasterModelGrid
+from landlab.components import LinearDiffuser
+
+from lem_diffusion import ImplicitDiffuser
+
+SOLVERS = ('explicit', 'implicit', 'crank-nicolson')
+KEYS = ('solver', 'dt', 'dx', 'kappa')
+
+
+def scarp_elevation(y, t, kappa, height = 10., fault_y = 50.):
+    """
+    Analytic elevation of a diffused vertical scarp at time t
+    """
+    if t <= 0:
+        return np.where(y > fault_y, height, 0.)
+    return height / 2. * (1. + erf((y - fault_y) / (2. * np.sqrt(kappa * t))))
+
+
+def scarp_grid(length = 100., width = 100., dx = 1., height = 10.):
+    """
+    Grid, elevation field and fault position of a straight scarp in the
+    middle of the domain. The discrete step lies halfway between the last
+    node of the footwall and the first node of the hanging wall.
+    """
+    mg = RasterModelGrid((int(round(length / dx)), int(round(width / dx))), dx)
+    z = mg.add_zeros('topographic__elevation', at = 'node')
+    mg.set_closed_boundaries_at_grid_edges(right_is_closed = True, top_is_closed = False,
+                                           left_is_closed = True, bottom_is_closed = False)
+    y = np.unique(mg.node_y)
+    fault_y = (y[y <= length / 2.].max() + y[y > length / 2.].min()) / 2.
+    z[mg.node_y > fault_y] = height
+    return mg, z, fault_y
+
+
+def make_diffuser(mg, solver, kappa):
+    if solver == 'explicit':
+        return LinearDiffuser(mg, linear_diffusivity = kappa)
+    if solver == 'implicit':
+        return ImplicitDiffuser(mg, kappa)
+    if solver == 'crank-nicolson':
+        return ImplicitDiffuser(mg, kappa, theta = 0.5)
+    raise ValueError('unknown solver %r' % (solver,))
+
+
+def run_case(solver, dt, dx, kappa, total_time = 12500., length = 100.,
+             width = 100., height = 10., repeats = 3):
+    nsteps = int(round(total_time / dt))
+    times = []
+    for i in range(repeats):
+        mg, z, fault_y = scarp_grid(length, width, dx, height)
+        ld = make_diffuser(mg, solver, kappa)
+        t0 = time.perf_counter()
+        for j in range(nsteps):
+            ld.run_one_step(dt)
+        times.append(time.perf_counter() - t0)
+    core = mg.core_nodes
+    e = z[core] - scarp_elevation(mg.node_y[core], nsteps * dt, kappa, height, fault_y)
+    return {'solver': solver, 'dt': dt, 'dx': dx, 'kappa': kappa,
+            'n_steps': nsteps, 'n_nodes': mg.number_of_nodes,
+            'wall_time_s': min(times), 'l2': float(np.sqrt(np.mean(e*e))),
+            'linf': float(np.abs(e).max()), 'bias': float(e.mean())}
+
+
+def run_benchmark(solvers = SOLVERS, dts = (100., 250., 1000.), spacings = (1.,),
+                  diffusivities = (0.01,), total_time = 12500., length = 100.,
+                  width = 100., height = 10., repeats = 3, output = None):
+    """
+    Run every combination of solver, dt, grid spacing and diffusivity; write
+    the results to a CSV file if output is given and return them as a list
+    of dicts
+    """
+    results = []
+    for solver, dt, dx, kappa in itertools.product(solvers, dts, spacings, diffusivities):
+        r = run_case(solver, dt, dx, kappa, total_time, length, width, height, repeats)
+        print('%-14s dt=%8g dx=%6g kappa=%8g %9.4f s  L2=%.3e  Linf=%.3e'
+              % (solver, dt, dx, kappa, r['wall_time_s'], r['l2'], r['linf']))
+        results.append(r)
+    if output is not None:
+        with open(output, 'w', newline = '') as f:
+            w = csv.DictWriter(f, fieldnames = list(results[0].keys()))
+            w.writeheader()
+            w.writerows(results)
+    return results
+
+
+def fastest(results, target, norm = 'linf'):
+    """
+    Fastest configuration with an error norm <= target (None if no
+    configuration meets it)
+    """
+    ok = [r for r in results if float(r[norm]) <= target]
+    return min(ok, key = lambda r: float(r['wall_time_s'])) if ok else None
+
+
+def read_results(fname):
+    with open(fname, newline = '') as f:
+        return list(csv.DictReader(f))
+
+
+def compare(results, baseline, time_factor = 1.5, error_factor = 1.01,
+            norms = ('l2', 'linf')):
+    """
+    Configurations that are more than time_factor slower or error_factor
+    less accurate than the same configuration in baseline (a list of dicts
+    or a CSV file); returns a list of (configuration, what, new, old)
+    """
+    if isinstance(baseline, str):
+        baseline = read_results(baseline)
+    old = {(r['solver'], float(r['dt']), float(r['dx']), float(r['kappa'])): r
+           for r in baseline}
+    regressions = []
+    for r in results:
+        key = (r['solver'], float(r['dt']), float(r['dx']), float(r['kappa']))
+        if key not in old:
+            continue
+        b = old[key]
+        if float(r['wall_time_s']) > time_factor * float(b['wall_time_s']):
+            regressions.append((key, 'wall_time_s', float(r['wall_time_s']),
+                                float(b['wall_time_s'])))
+        for norm in norms:
+            if float(r[norm]) > error_factor * float(b[norm]):
+                regressions.append((key, norm, float(r[norm]), float(b[norm])))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--solvers', nargs = '+', default = list(SOLVERS),
+                        choices = SOLVERS)
+    parser.add_argument('--dt', type = float, nargs = '+', default = [100., 250., 1000.])
+    parser.add_argument('--dx', type = float, nargs = '+', default = [1.])
+    parser.add_argument('--kappa', type = float, nargs = '+', default = [0.01])
+    parser.add_argument('--total-time', type = float, default = 12500.)
+    parser.add_argument('--length', type = float, default = 100.)
+    parser.add_argument('--width', type = float, default = 100.)
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--target', type = float, default = None,
+                        help = 'report the fastest setup with Linf error <= target [m]')
+    parser.add_argument('--baseline', default = None,
+                        help = 'earlier results table to check for regressions')
+    parser.add_argument('--output', default = 'faultscarp_benchmark.csv')
+    args = parser.parse_args()
+    #read before the output (possibly the same file) is written
+    baseline = None if args.baseline is None else read_results(args.baseline)
+    results = run_benchmark(args.solvers, args.dt, args.dx, args.kappa,
+                            args.total_time, args.length, args.width,
+                            repeats = args.repeats, output = args.output)
+    if args.target is not None:
+        best = fastest(results, args.target)
+        if best is None:
+            print('no configuration meets Linf <= %g' % args.target)
+        else:
+            print('fastest with Linf <= %g: %s' % (args.target,
+                  ' '.join('%s=%s' % (k, best[k]) for k in KEYS)))
+    if baseline is not None:
+        regressions = compare(results, baseline)
+        for key, what, new, old in regressions:
+            print('regression %s: %s %.4g (was %.4g)' % (' '.join(map(str, key)), what, new, old))
+        sys.exit(1 if regressions else 0)
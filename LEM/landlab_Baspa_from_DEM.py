@@ -19,12 +19,18 @@ from landlab.plot import imshow_grid
 from landlab import RasterModelGrid
 import matplotlib.pyplot as pl
 import numpy as np
-from landlab.components import FlowAccumulator, FastscapeEroder, FlowDirectorSteepest
-from landlab.components import SinkFiller, SteepnessFinder, ChiFinder, ChannelProfiler
+from landlab.components import FastscapeEroder, FlowDirectorSteepest
+from landlab.components import SteepnessFinder, ChiFinder, ChannelProfiler
 from landlab import load_params
 from landlab.components.uniform_precip import PrecipitationDistribution
 #from landlab.plot import drainage_plot, channel_profile
 from osgeo import gdal, gdalnumeric, ogr, osr
+from routing_cache import RoutingCache, cached_flow_routing
+from lem_pipeline import ErosionRate, Pipeline, Uplift
+from lem_checkpoint import Checkpointer, run_fingerprint
+from lem_fill import IncrementalSinkFiller
+from lem_routing import IncrementalFlowAccumulator
+from lem_snapshots import SnapshotWriter
 
 def load_dem_tif(dem_fname):
     """
@@ -72,29 +78,49 @@ imshow_grid(mg, 'topographic__elevation',
             allow_colorbar=True, cmap='terrain', vmin=1500, vmax=6200)
 
 ld = LinearDiffuser(mg, linear_diffusivity=0.005)
-fr = FlowAccumulator(mg, flow_director='D8')
+fr = IncrementalFlowAccumulator(mg)
 fse = FastscapeEroder(mg, K_sp = 5e-4, m_sp=0.3, n_sp=1.)
-sf = SinkFiller(mg, routing='D8')
+#fills only the catchments of pits, same result as SinkFiller(mg, routing='D8')
+sf = IncrementalSinkFiller(mg)
 
 ## instantiate helper components
 chif = ChiFinder(mg)
 steepnessf = SteepnessFinder(mg, reference_concavity=0.45)
 
+## cache of routing results (deterministic runs from the same DEM reuse them)
+routing_cache = RoutingCache('routing_cache', max_bytes=2**30)
+
 ## Set some variables
 rock_up_rate = 1e-3 #m/yr
 dt = 1000 # yr
-rock_up_len = dt*rock_up_rate # m
 nr_time_steps = 500
-## Time loop where evolution happens
-for i in range(nr_time_steps):
-    z[mg.core_nodes] += rock_up_len #uplift only the core nodes
-    ld.run_one_step(dt) #linear diffusion happens.
-    sf.run_one_step() #sink filling happens, time step not needed
-    fr.run_one_step() #flow routing happens, time step not needed
-    fse.run_one_step(dt) #fluvial incision happens
-    ## optional print statement
-    if np.mod(i,50) == 0:
-        print('i:', i)
+## Time loop where evolution happens: uplift only the core nodes, linear
+## diffusion, sink filling and flow routing (loaded from the routing cache
+## when the script is re-run), fluvial incision
+pipe = Pipeline([Uplift(mg, rock_up_rate), ld,
+                 ('IncrementalSinkFiller+IncrementalFlowAccumulator',
+                  lambda: cached_flow_routing(mg, routing_cache, fr, sf, method='D8')),
+                 ('FastscapeEroder', ErosionRate(mg, fse))],
+                dt, nr_time_steps, progress_every=50)
+## write a checkpoint every 50 steps or 10 minutes; a preempted run
+## continues from the newest checkpoint when the script is started again
+## (only with the same DEM and parameters, and not once the run has finished)
+params = {'dem': baspa_fname, 'K_sp': 5e-4, 'm_sp': 0.3, 'n_sp': 1.,
+          'linear_diffusivity': 0.005, 'rock_up_rate': rock_up_rate, 'dt': dt,
+          'nr_time_steps': nr_time_steps}
+ckpt = Checkpointer(mg, 'baspa_checkpoints', every_steps=50, every_seconds=600,
+                    fingerprint=run_fingerprint(mg, params))
+ckpt.restore(pipe)
+pipe.callbacks.append(ckpt)
+## elevation, drainage area and erosion rate every 10 steps, compressed on a
+## background thread (a resumed run continues the same store)
+snap = SnapshotWriter(mg, 'baspa_snapshots', every=10,
+                      fields=('topographic__elevation', 'drainage_area', 'erosion__rate'))
+pipe.callbacks.append(snap)
+pipe.run()
+snap.close()
+pipe.print_summary()
+pipe.save_timing('baspa_timing.csv')
 
 steepnessf.calculate_steepnesses()
 chif.calculate_chi()
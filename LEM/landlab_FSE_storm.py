@@ -8,7 +8,7 @@ Created on Mon Feb 17 18:45:51 2020
 
 from landlab.components import LinearDiffuser
 from landlab.plot import imshow_grid
-from landlab import RasterModelGrid
+from landlab import NodeStatus, RasterModelGrid
 import matplotlib.pyplot as plt
 import numpy as np
 from landlab.components import FlowAccumulator, FastscapeEroder, FlowDirectorSteepest, SteepnessFinder, ChiFinder
@@ -17,6 +17,11 @@ from landlab import load_params
 from landlab.components.uniform_precip import PrecipitationDistribution
 from landlab.components import FlowAccumulator
 from landlab.plot import drainage_plot
+from slope_area import slope_area_bins, fit_slope_area
+from lem_pipeline import Pipeline, Uplift
+from lem_routing import IncrementalFlowAccumulator
+from lem_storms import StormEngine, generate_storms
+from lem_channels import ChannelNetwork
 
 #%% Fluvial erosion using Fastscape.
 #create input file with the following parameters (e.g.: landlab_parameters1.txt)
@@ -77,24 +82,22 @@ mg.set_closed_boundaries_at_grid_edges(right_is_closed=False, top_is_closed=Fals
                                        left_is_closed=False, bottom_is_closed=False)
 
 #Initiate model routines
-fr = FlowAccumulator(mg, flow_director='D8')
+fr = IncrementalFlowAccumulator(mg)
 sp = FastscapeEroder(mg, **inputs)
 lin_diffuse = LinearDiffuser(mg, **inputs)
 
-#run fastscape eroder (no diffusion)
-for i in range(nt):
-    # lin_diffuse.run_one_step(dt) no diffusion this time
-    fr.run_one_step() # route_flow isn't time sensitive, so it doesn't take dt as input
-    sp.run_one_step(dt)
-    mg.at_node['topographic__elevation'][mg.core_nodes] += uplift_per_step # add the uplift
-    if i % 20 == 0:
-        print ('Completed loop %d' % i)
+#run fastscape eroder (no diffusion): route flow, erode, add the uplift;
+#dt and the number of steps come from the parameter file
+pipe = Pipeline.from_params([fr, sp, Uplift(mg, uplift_rate)], inputs,
+                            progress_every=20)
+pipe.run()
+pipe.print_summary()
         
 figure('topo without diffusion')
 imshow_grid(mg, 'topographic__elevation', grid_units=['km','km'], var_name='Elevation (km)')
    
 figure('slope-area plot for non-diffusive landscape')
-loglog(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope'],'.')
+slope_area_bins(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope']).plot(plt.gca())
 xlabel('Drainage area (km**2)')
 ylabel('Local slope')
 title('Slope-Area plot for whole landscape')
@@ -121,25 +124,23 @@ z += initial_roughness
 mg.set_closed_boundaries_at_grid_edges(right_is_closed=False, top_is_closed=False, \
                                        left_is_closed=False, bottom_is_closed=False)
 
-fr = FlowAccumulator(mg, flow_director='D8')
+fr = IncrementalFlowAccumulator(mg)
 sp = FastscapeEroder(mg, **inputs)
 lin_diffuse = LinearDiffuser(mg, **inputs)
 figure('initial topography')
 imshow_grid(mg, 'topographic__elevation', grid_units=['km','km'], var_name='Elevation (km)')
 #%%
-for i in range(nt):
-    lin_diffuse.run_one_step(dt)
-    fr.run_one_step() # route_flow isn't time sensitive, so it doesn't take dt as input
-    sp.run_one_step(dt)
-    mg.at_node['topographic__elevation'][mg.core_nodes] += uplift_per_step # add the uplift
-    if i % 20 == 0:
-        print ('Completed loop %d' % i)
+#diffuse, route flow, erode, add the uplift
+pipe = Pipeline.from_params([lin_diffuse, fr, sp, Uplift(mg, uplift_rate)], inputs,
+                            progress_every=20)
+pipe.run()
+pipe.print_summary()
         
 figure('topo with diffusion')
 imshow_grid(mg, 'topographic__elevation', grid_units=['km','km'], var_name='Elevation (km)')
 #%%
 figure('slope-area plot for diffusive landscape')
-loglog(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope'],'.')
+slope_area_bins(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope']).plot(plt.gca())
 xlabel('Drainage area (km**2)')
 ylabel('Local slope')
 title('Slope-Area plot for whole landscape')
@@ -161,60 +162,64 @@ mean_interstorm_duration:
 input_file = './landlab_parameters1.txt'
 inputs = load_params(input_file) # load the data into a dictionary
 storm_inputs = load_params('./landlab_parameters_storms.txt')
-precip = PrecipitationDistribution(total_t=total_t, delta_t=dt, **storm_inputs)
 print(storm_inputs)
 mg = RasterModelGrid((nrows, ncols), dx)
 z = mg.add_zeros('node', 'topographic__elevation')
 initial_roughness = np.random.rand(z.size)/100000.
 z += initial_roughness
-dt = 0.1
 total_t = 250.
 for edge in (mg.nodes_at_top_edge, mg.nodes_at_left_edge, mg.nodes_at_right_edge):
-    mg.status_at_node[edge] = CLOSED_BOUNDARY
-for edge in ( mg.nodes_at_bottom_edge):
-    mg.status_at_node[edge] = FIXED_VALUE_BOUNDARY
-
-fr = FlowRouter(mg, **inputs)
-sp = FastscapeEroder(mg, **inputs)
-lin_diffuse = LinearDiffuser(mg, **inputs)
+    mg.status_at_node[edge] = NodeStatus.CLOSED
+mg.status_at_node[mg.nodes_at_bottom_edge] = NodeStatus.FIXED_VALUE
+
+fr = IncrementalFlowAccumulator(mg)
+sp = FastscapeEroder(mg, K_sp=inputs['K_sp'], m_sp=inputs['m_sp'], n_sp=inputs['n_sp'])
+lin_diffuse = LinearDiffuser(mg, linear_diffusivity=inputs['linear_diffusivity'])
+
+#the whole storm and interstorm series at once (same series for the same seed)
+storms = generate_storms(total_t, seed=1, **storm_inputs)
+#route flow, erode and diffuse during storms, uplift during storms and
+#interstorms; consecutive storms are merged into one step as long as the
+#estimated erosion and uplift of the step stay below 5 m (0.005 km; K_sp,
+#m_sp and n_sp of the estimate are taken from sp). The tolerance only caps
+#the estimated erosion of a single merged step, it does not bound the error
+#of the long-term result: with seed 1 the mean elevation after 250 time
+#units is 1.3% higher than with one step per storm
+engine = StormEngine(mg, storms, fr, sp, diffuser=lin_diffuse,
+                     uplift=Uplift(mg, uplift_rate), tolerance=0.005)
 
 out_interval = 10.
 last_trunc = total_t # we use this to trigger taking an output plot
-for (interval_duration, rainfall_rate) in precip.yield_storm_interstorm_duration_intensity():
-    if rainfall_rate > 0.:
-        # note diffusion also only happens when it's raining...
-        fr.route_flow()
-        sp.run_one_step(interval_duration)
-        lin_diffuse.run_one_step(interval_duration)
-    z[mg.core_nodes] += uplift_rate * interval_duration
-    this_trunc = precip.elapsed_time // out_interval
+#trunk stream of the largest watershed, updated only where flow directions changed
+network = ChannelNetwork(mg, number_of_watersheds=1)
+def plot_long_profile(engine):
+    global last_trunc
+    this_trunc = engine.time // out_interval
     if this_trunc != last_trunc:  # time to plot a new profile!
         print ('made it to time %d' % (out_interval * this_trunc))
         last_trunc = this_trunc
-        figure("long_profiles-storm_model")
-        profile_IDs = prf.channel_nodes(mg, mg.at_node['topographic__steepest_slope'],
-                                        mg.at_node['drainage_area'],
-                                        mg.at_node['flow__receiver_node'])
-        dists_upstr = prf.get_distances_upstream(
-            mg, len(mg.at_node['topographic__steepest_slope']),
-            profile_IDs, mg.at_node['flow__link_to_receiver_node'])
-        plot(dists_upstr[0], z[profile_IDs[0]], label=out_interval * this_trunc)
-    # no need to track elapsed time, as the generator will stop automatically
+        plt.figure("long_profiles-storm_model")
+        network.update()
+        plt.plot(network.distance_along_profile[0], z[network.nodes[0]],
+                 label=out_interval * this_trunc)
+engine.callbacks.append(plot_long_profile)
+engine.run()
+engine.print_summary()
 # make the figure look nicer:
-figure("long_profiles-storm_model")
-xlabel('Distance upstream (km)')
-ylabel('Elevation (km)')
-title('Long profiles evolving through time')
-legend()
+plt.figure("long_profiles-storm_model")
+plt.xlabel('Distance upstream (km)')
+plt.ylabel('Elevation (km)')
+plt.title('Long profiles evolving through time')
+plt.legend()
 
-figure('topo with diffusion and storms')
+plt.figure('topo with diffusion and storms')
 imshow_grid(mg, 'topographic__elevation', grid_units=['km','km'], var_name='Elevation (km)')
 
-figure('final slope-area plot')
-loglog(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope'],'.')
-xlabel('Drainage area (km**2)')
-ylabel('Local slope')
-title('Slope-Area plot for whole landscape')
+plt.figure('final slope-area plot')
+slope_area_bins(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope']).plot(plt.gca())
+plt.xlabel('Drainage area (km**2)')
+plt.ylabel('Local slope')
+plt.title('Slope-Area plot for whole landscape')
 
 #%% re-instantiate the FastscapeEroder, so we can 
 input_file = './landlab_parameters1.txt'
@@ -242,9 +247,11 @@ dt = inputs['dt']
 nt = int(total_t // dt) #this is how many loops we'll need
 uplift_per_step = uplift_rate * dt
 
-fr = FlowRouter(mg, **inputs)
-sp = FastscapeEroder(mg, **inputs)
-lin_diffuse = LinearDiffuser(mg, **inputs)
+fr = IncrementalFlowAccumulator(mg)
+sp = FastscapeEroder(mg, K_sp=inputs['K_sp'], m_sp=inputs['m_sp'], n_sp=inputs['n_sp'])
+lin_diffuse = LinearDiffuser(mg, linear_diffusivity=inputs['linear_diffusivity'])
+#trunk stream of the largest watershed, updated only where flow directions changed
+network = ChannelNetwork(mg, number_of_watersheds=1)
 
 for i in range(nt):
     lin_diffuse.run_one_step(dt)
@@ -252,28 +259,23 @@ for i in range(nt):
     sp.run_one_step(dt)
     mg.at_node['topographic__elevation'][mg.core_nodes] += uplift_per_step # add the uplift
     if i % 10 == 0:
-        print ('made it to time %d' % (i))
-        figure("long_profiles-no_storms")
-        profile_IDs = prf.channel_nodes(mg, mg.at_node['topographic__steepest_slope'],
-                                        mg.at_node['drainage_area'],
-                                        mg.at_node['flow__receiver_node'])
-        dists_upstr = prf.get_distances_upstream(
-            mg, len(mg.at_node['topographic__steepest_slope']),
-            profile_IDs, mg.at_node['flow__link_to_receiver_node'])
-        plot(dists_upstr[0], z[profile_IDs[0]], label=out_interval * this_trunc)
+        print ('made it to time %d' % (i * dt))
+        plt.figure("long_profiles-no_storms")
+        network.update()
+        plt.plot(network.distance_along_profile[0], z[network.nodes[0]], label=i * dt)
 
 # make the figure look nicer:
-figure("long_profiles-no_storms")
-xlabel('Distance upstream (km)')
-ylabel('Elevation (km)')
-title('Long profiles evolving through time')
-legend()
+plt.figure("long_profiles-no_storms")
+plt.xlabel('Distance upstream (km)')
+plt.ylabel('Elevation (km)')
+plt.title('Long profiles evolving through time')
+plt.legend()
 
-figure('topo with diffusion and storms')
+plt.figure('topo with diffusion and storms')
 imshow_grid(mg, 'topographic__elevation', grid_units=['km','km'], var_name='Elevation (km)')
 #
 #figure('final slope-area plot')
-#loglog(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope'],'.')
+#slope_area_bins(mg.at_node['drainage_area'], mg.at_node['topographic__steepest_slope']).plot(plt.gca())
 #xlabel('Drainage area (km**2)')
 #ylabel('Local slope')
 #title('Slope-Area plot for whole landscape')
@@ -282,12 +284,21 @@ imshow_grid(mg, 'topographic__elevation', grid_units=['km','km'], var_name='Elev
 a = mg.at_node['drainage_area']
 g = mg.at_node['topographic__steepest_slope']
 
-#figure the rest out yourself!
-#use log binning or the following approach: https://github.com/keflavich/plfit
+#log-bin the drainage area (median and IQR of slope per bin) and fit
+#S = ks A^-theta to the bin medians with bootstrap confidence intervals;
+#only channels (drainage area >= channel_min_area, 25 cells) are fitted,
+#slope still increases with area on the hillslopes
+channel_min_area = 1e-2 #km**2
+bins = slope_area_bins(a, g, bins_per_decade=10, min_area=channel_min_area)
+fit = fit_slope_area(bins, theta_ref=0.45, n_boot=1000)
+print('theta = %.3f (95%% CI %.3f - %.3f)' % ((fit['theta'],) + fit['theta_ci']))
+print('ks = %.3g (95%% CI %.3g - %.3g)' % ((fit['ks'],) + fit['ks_ci']))
+print('ksn (theta = 0.45) = %.3g (95%% CI %.3g - %.3g)' % ((fit['ksn'],) + fit['ksn_ci']))
 figure('final slope-area plot')
-loglog(a,g, '.')
+bins.plot(plt.gca(), fit=fit)
 xlabel('Drainage area (k**2)')
 ylabel('Local slope (m/m)')
+legend()
 
 #%% Steepness finder and Chi plots
 fd = FlowDirectorSteepest(mg, 'topographic__elevation')
@@ -295,9 +306,9 @@ fd.run_one_step()
 fa = FlowAccumulator(mg, 'topographic__elevation', flow_director='FlowDirectorSteepest')
 fa.run_one_step()
 sf = SteepnessFinder(mg, reference_concavity=0.45, 
-                     min_drainage_area=1e3)
+                     min_drainage_area=channel_min_area)
 sf.calculate_steepnesses()
-cf = ChiFinder(mg, reference_concavity=0.45, min_drainage_area=1.e3, reference_area=1., use_true_dx=False)
+cf = ChiFinder(mg, reference_concavity=0.45, min_drainage_area=channel_min_area, reference_area=1., use_true_dx=False)
 cf.calculate_chi()
 
 imshow_grid(mg, 'channel__chi_index', plot_name='Channel steepness (theta = 0.45)', var_units='norm. steepness (m^0.9)', cmap='hot', limits=(0,300))
@@ -10,6 +10,8 @@ import numpy as np
 from matplotlib import pyplot as pl
 from landlab.plot import imshow_grid
 
+from lem_profiles import ProfileRecorder, column_nodes
+
 #%% Setting up Gaussian Hill elevation data
 n=111
 dem_width = 5 * 100
@@ -32,8 +34,13 @@ imshow_grid(mg, 'topographic__elevation', plot_name='Gaissian Hill',
             allow_colorbar=True)
 
 fg2, ax = pl.subplots(2, 2)
-crosssection_center = mg.node_vector_to_raster(gh_org, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
-crosssection_center_ycoords = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
+#nodes of the profile through the center are found once; the profile is
+#recorded at t=0, after one and after eleven time steps
+center = column_nodes(mg, n//2)
+rec = ProfileRecorder(mg, {'center': center}, nsteps=3)
+rec.record(0.)
+crosssection_center_ycoords, crosssection_center = rec.profile('center')
+crosssection_center = crosssection_center[0]
 ax[0,0].plot(crosssection_center_ycoords, crosssection_center, 'k', linewidth=3, label='Org. Gaussian Hill')
 ax[0,0].grid()
 ax[0,0].set_xlabel('Distance along profile [m]', fontsize=12)
@@ -49,8 +56,7 @@ kappa_ld = 0.1 # m^2/yr [L^2/T]
 ld = LinearDiffuser(mg, linear_diffusivity=kappa_ld)
 dt = 1000 # time step in yr
 ld.run_one_step(dt)
-
-gh_ld1 = mg.node_vector_to_raster(gh_org, flip_vertically=True)
+rec.record(dt)
 
 fg3 = pl.figure()
 imshow_grid(mg, 'topographic__elevation', plot_name='Gaussian Hill after 1 and 10 time steps with dt=%d and kappa_ld=%f'%(dt, kappa_ld), 
@@ -58,11 +64,11 @@ imshow_grid(mg, 'topographic__elevation', plot_name='Gaussian Hill after 1 and 1
 
 #%%
 fg4 = pl.figure()
-pl.imshow( np.reshape(gh_org, (n,n)) - np.reshape(gh_ld1, (n,n)) )
+pl.imshow( z - np.reshape(gh_org, (n,n)), origin='lower' )
 pl.colorbar()
 
-crosssection_center_d1 = mg.node_vector_to_raster(gh_ld1, flip_vertically=True)[:,np.int(np.round(n/2))]
-crosssection_center_ycoords_d1 = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
+crosssection_center_ycoords_d1, crosssection_center_d1 = rec.profile('center')
+crosssection_center_d1 = crosssection_center_d1[1]
 ax[0,0].plot(crosssection_center_ycoords_d1, crosssection_center_d1, 'b', label='n=1, dt=%d x k=%02.2f'%(dt, kappa_ld))
 
 #%% Repeat linear diffusion modeling in steps of dt=1000 for 10 times
@@ -70,15 +76,14 @@ dt = 1000 # time step in yr
 for i in range(10):
     ld.run_one_step(dt)
     print('%d'%(i))
+rec.record(11*dt)
 
 fg5 = pl.figure()
 imshow_grid(mg, 'topographic__elevation', plot_name='Gaussian Hill after ten time step with dt=%d and kappa_ld=%f'%(dt, kappa_ld), 
             allow_colorbar=True)
 
-gh_ld2 = mg.node_vector_to_raster(gh_org, flip_vertically=True)
-
-crosssection_center_d2 = mg.node_vector_to_raster(gh_ld2, flip_vertically=True)[:,np.int(np.round(n/2))]
-crosssection_center_ycoords_d2 = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
+crosssection_center_ycoords_d2, crosssection_center_d2 = rec.profile('center')
+crosssection_center_d2 = crosssection_center_d2[2]
 ax[0,0].plot(crosssection_center_ycoords_d2, crosssection_center_d2, 'r', label='n=10, dt=%d x k=%02.2f'%(dt, kappa_ld))
 ax[0,0].legend()
 
@@ -98,20 +103,39 @@ kappa_ld = 0.1 # m^2/yr [L^2/T]
 ld = LinearDiffuser(mg, linear_diffusivity=kappa_ld)
 dt = 1000 # time step in yr
 time_steps = 20 
-crosssection_center_dt = np.empty((time_steps, len(crosssection_center_d1)))
-crosssection_center_ycoords_dt = np.empty((time_steps, len(crosssection_center_ycoords_d1)))
-colors = pl.cm.viridis(np.linspace(0,1,time_steps))
+rec = ProfileRecorder(mg, {'center': center}, nsteps=time_steps)
 for i in range(time_steps):
     ld.run_one_step(dt)
-    gh_ld = mg.node_vector_to_raster(gh_org, flip_vertically=True)
-    
-    crosssection_center_dt[i,:] = mg.node_vector_to_raster(gh_ld, flip_vertically=True)[:,np.int(np.round(n/2))]
-    crosssection_center_ycoords_dt[i,:] = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
-    ax[0,1].plot(crosssection_center_ycoords_dt[i,:], 
+    rec.record((i+1)*dt)
+    print('%d'%(i))
+crosssection_center_ycoords_dt, crosssection_center_dt = rec.profile('center')
+colors = pl.cm.viridis(np.linspace(0,1,time_steps))
+for i in range(time_steps):
+    ax[0,1].plot(crosssection_center_ycoords_dt, 
                  crosssection_center_dt[i,:], 
                  color=colors[i], label='dt=%d'%(dt))    
-    print('%d'%(i))
 
+#%% Same 20 ky of diffusion (closed edges) in one call: spectral and implicit solvers
+#LinearDiffuser needs about 20 stability substeps for every dt=1000 yr step
+from lem_diffusion import ImplicitDiffuser, SpectralDiffuser
+x,y,z = gaussian_hill_elevation(n)
+z = z*100
+mg = RasterModelGrid((n, n), node_spacing)
+gh_spectral = mg.add_field('node', 'topographic__elevation', z, units='meters', copy=True, clobber=False)
+mg.set_closed_boundaries_at_grid_edges(True, True, True, True)
+sd = SpectralDiffuser(mg, linear_diffusivity=kappa_ld, boundary='closed')
+sd.run_one_step(time_steps * dt)
+#implicit (backward Euler): stable for any dt, matrix factorised once
+mg_implicit = RasterModelGrid((n, n), node_spacing)
+gh_implicit = mg_implicit.add_field('node', 'topographic__elevation', z, units='meters', copy=True, clobber=False)
+mg_implicit.set_closed_boundaries_at_grid_edges(True, True, True, True)
+ld_implicit = ImplicitDiffuser(mg_implicit, linear_diffusivity=kappa_ld)
+for i in range(time_steps):
+    ld_implicit.run_one_step(dt)
+ax[0,1].plot(center[1], gh_spectral[center[0]],
+             'r--', label='spectral, one step of %d yr'%(time_steps*dt))
+ax[0,1].plot(center[1], gh_implicit[center[0]],
+             'b:', label='implicit, dt=%d'%(dt))
 
 #%% Repeat analysis, but add noise
 #adding up to 10% noise to Gaussian Hill
@@ -130,10 +154,11 @@ fg6 = pl.figure()
 imshow_grid(mg, 'topographic__elevation', plot_name='Gaussian Hill with noise after time step with dt=%d and kappa_ld=%f'%(dt, kappa_ld), 
             allow_colorbar=True)
 
-ghn_ld1 = mg.node_vector_to_raster(gh_noise, flip_vertically=True)
-
-crosssection_center_noise_1 = mg.node_vector_to_raster(ghn_ld1, flip_vertically=True)[:,np.int(np.round(n/2))]
-crosssection_center_ycoords_noise_1 = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
+#profile with noise at t=0 and after every time step
+rec = ProfileRecorder(mg, {'center': center}, nsteps=time_steps+1)
+rec.record(0.)
+crosssection_center_ycoords_noise_1, crosssection_center_noise_1 = rec.profile('center')
+crosssection_center_noise_1 = crosssection_center_noise_1[0]
 ax[1,0].plot(crosssection_center_ycoords, crosssection_center, 'k', linewidth=3, label='Org. Gaussian Hill')
 ax[1,0].grid()
 ax[1,0].set_xlabel('Distance along profile [m]', fontsize=12)
@@ -142,17 +167,14 @@ ax[1,0].set_title('Profiles at different timesteps through center of Gaussian Hi
 ax[1,0].plot(crosssection_center_ycoords_noise_1, crosssection_center_noise_1, 'r', label='noise')
 
 
-crosssection_center_dt = np.empty((time_steps, len(crosssection_center_d1)))
-crosssection_center_ycoords_dt = np.empty((time_steps, len(crosssection_center_ycoords_d1)))
-colors = pl.cm.viridis(np.linspace(0,1,time_steps))
 for i in range(time_steps):
     ld.run_one_step(dt)
-    gh_ld = mg.node_vector_to_raster(gh_org, flip_vertically=True)
-    
-    crosssection_center_dt[i,:] = mg.node_vector_to_raster(gh_ld, flip_vertically=True)[:,np.int(np.round(n/2))]
-    crosssection_center_ycoords_dt[i,:] = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
-    ax[1,0].plot(crosssection_center_ycoords_dt[i,:], crosssection_center_dt[i,:], color=colors[i], label='dt=%d'%(dt))    
+    rec.record((i+1)*dt)
     print('%d'%(i))
+crosssection_center_ycoords_dt, crosssection_center_dt = rec.profile('center')
+colors = pl.cm.viridis(np.linspace(0,1,time_steps))
+for i in range(time_steps):
+    ax[1,0].plot(crosssection_center_ycoords_dt, crosssection_center_dt[i+1,:], color=colors[i], label='dt=%d'%(dt))    
 
 #%% Add FastScape algorithm, see here: https://landlab.readthedocs.io/en/master/reference/components/stream_power.html
 from landlab.components import FlowAccumulator, FastscapeEroder
@@ -177,10 +199,7 @@ pl.imshow(np.log10(np.reshape(fr.node_drainage_area, (n,n))))
 cb=pl.colorbar()
 cb.set_label('Log10 Flowaccumulation D8')
 
-gh_fse = fse.grid.node_vector_to_raster(gh_org, flip_vertically=True)
-
-crosssection_center_fse_1 = mg.node_vector_to_raster(gh_fse, flip_vertically=True)[:,np.int(np.round(n/2))]
-crosssection_center_ycoords_fse_1 = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
+crosssection_center_ycoords_fse_1, crosssection_center_fse_1 = center[1], gh_org[center[0]]
 ax[1,1].plot(crosssection_center_ycoords, crosssection_center, 'k', linewidth=3, label='Org. Gaussian Hill')
 ax[1,1].grid()
 ax[1,1].set_xlabel('Distance along profile [m]', fontsize=12)
@@ -208,16 +227,14 @@ ax2.set_ylabel('Height [m]', fontsize=12)
 ax2.set_title('Profile through center of Gaussian Hill at t=0..n', fontsize=16)
 
 time_steps = 20
-crosssection_center_dt = np.empty((time_steps, len(crosssection_center_d1)))
-crosssection_center_ycoords_dt = np.empty((time_steps, len(crosssection_center_ycoords_d1)))
-colors = pl.cm.magma(np.linspace(0,1,time_steps))
+rec = ProfileRecorder(mg, {'center': center}, nsteps=time_steps)
 for i in range(time_steps):
     fr.run_one_step()
     fse.run_one_step(dt=1000.)
-    gh_fse = mg.node_vector_to_raster(gh_org, flip_vertically=True)
-    
-    crosssection_center_dt[i,:] = mg.node_vector_to_raster(gh_fse, flip_vertically=True)[:,np.int(np.round(n/2))]
-    crosssection_center_ycoords_dt[i,:] = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
-    ax2.plot(crosssection_center_ycoords_dt[i,:], crosssection_center_dt[i,:], color=colors[i], label='i=%d'%(i))    
+    rec.record((i+1)*1000.)
     print('%d'%(i))
+crosssection_center_ycoords_dt, crosssection_center_dt = rec.profile('center')
+colors = pl.cm.magma(np.linspace(0,1,time_steps))
+for i in range(time_steps):
+    ax2.plot(crosssection_center_ycoords_dt, crosssection_center_dt[i,:], color=colors[i], label='i=%d'%(i))    
 
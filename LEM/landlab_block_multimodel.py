@@ -7,13 +7,19 @@ Created on Tue Feb 18 11:22:42 2020
 """
 ## Import what is needed
 from landlab import RasterModelGrid
-from landlab.components import LinearDiffuser, FlowAccumulator
-from landlab.components import FastscapeEroder, SinkFiller
+from landlab.components import LinearDiffuser
+from landlab.components import FastscapeEroder
 from landlab.components import ChiFinder, SteepnessFinder
 from landlab.plot import imshow_grid #function, not objects
-from landlab.components import Profiler, ChannelProfiler
+from landlab.components import Profiler
 from matplotlib import pyplot as pl
 import numpy as np
+from slope_area import slope_area_bins, fit_slope_area
+from lem_pipeline import Pipeline, Uplift
+from lem_checkpoint import Checkpointer, run_fingerprint
+from lem_fill import IncrementalSinkFiller
+from lem_routing import IncrementalFlowAccumulator
+from lem_channels import ChannelNetwork
 
 #%% Setup more complex modeling regime and analyse modeled streams
 ## Run model with a 100x100 grid (increasing to 200x200 will increase timing significantly). First step will be slower, because flow routing takes more time.
@@ -23,7 +29,8 @@ z = mg.add_zeros('node', 'topographic__elevation')
 mg.set_closed_boundaries_at_grid_edges(right_is_closed=False, top_is_closed=False, \
                                        left_is_closed=False, bottom_is_closed=False)
 
-#Create an uplifted block
+#Create an uplifted block (fixed seed: a restarted run can find its checkpoints)
+np.random.seed(1)
 blockuplift_nodes = np.where( (mg.node_y < 17500) & (mg.node_y > 2500) &
                               (mg.node_x < 17500) & (mg.node_x > 2500) )
 z[blockuplift_nodes] += 100.0
@@ -35,29 +42,46 @@ imshow_grid(mg, 'topographic__elevation',
             allow_colorbar=True)
 
 ld = LinearDiffuser(mg, linear_diffusivity=0.01)
-fr = FlowAccumulator(mg, flow_director='D8')
+fr = IncrementalFlowAccumulator(mg)
 fse = FastscapeEroder(mg, K_sp = 5e-5, m_sp=0.5, n_sp=1.)
-sf = SinkFiller(mg, routing='D8')
+#fills only the catchments of pits, same result as SinkFiller(mg, routing='D8')
+sf = IncrementalSinkFiller(mg)
 
-## instantiate helper components
-chif = ChiFinder(mg)
-steepnessf = SteepnessFinder(mg, reference_concavity=0.5)
+## instantiate helper components; channels drain at least channel_min_area
+channel_min_area = 1e6 #m^2
+chif = ChiFinder(mg, min_drainage_area=channel_min_area)
+steepnessf = SteepnessFinder(mg, reference_concavity=0.5, min_drainage_area=channel_min_area)
 
 ## Set some variables
 rock_up_rate = 1e-3 #m/yr
 dt = 1000 # yr
-rock_up_len = dt*rock_up_rate # m
 nr_time_steps = 500
-## Time loop where evolution happens
-for i in range(nr_time_steps):
-    z[mg.core_nodes] += rock_up_len #uplift only the core nodes
-    ld.run_one_step(dt) #linear diffusion happens.
-    sf.run_one_step() #sink filling happens, time step not needed
-    fr.run_one_step() #flow routing happens, time step not needed
-    fse.run_one_step(dt) #fluvial incision happens
-    ## optional print statement
-    if np.mod(i,10) == 0:
-        print('i:', i)
+## Time loop where evolution happens: uplift only the core nodes, linear
+## diffusion, sink filling, flow routing and fluvial incision
+pipe = Pipeline([Uplift(mg, rock_up_rate), ld, sf, fr, fse], dt, nr_time_steps,
+                progress_every=10)
+## write a checkpoint every 50 steps or 10 minutes; a preempted run
+## continues from the newest checkpoint when the script is started again
+## (only with the same parameters and initial topography, and not once the
+## run has finished)
+params = {'K_sp': 5e-5, 'm_sp': 0.5, 'n_sp': 1., 'linear_diffusivity': 0.01,
+          'rock_up_rate': rock_up_rate, 'dt': dt, 'nr_time_steps': nr_time_steps}
+ckpt = Checkpointer(mg, 'multimodel_checkpoints', every_steps=50, every_seconds=600,
+                    fingerprint=run_fingerprint(mg, params))
+ckpt.restore(pipe)
+pipe.callbacks.append(ckpt)
+## long profile of the largest stream every 25 steps; the channel network is
+## only updated where flow directions changed since the last profile
+network = ChannelNetwork(mg, minimum_channel_threshold=0, number_of_watersheds=1)
+long_profiles = []
+def record_long_profile(pipe):
+    if pipe.step % 25 == 0:
+        network.update()
+        long_profiles.append((pipe.time, network.distance_along_profile[0],
+                              z[network.nodes[0]].copy()))
+pipe.callbacks.append(record_long_profile)
+pipe.run()
+pipe.print_summary()
 
 steepnessf.calculate_steepnesses()  
 chif.calculate_chi()
@@ -91,28 +115,45 @@ imshow_grid(mg, 'channel__chi_index',
 
 #%% Plotting profiles and log-slope-area plots
 
-## find the location of the largest channels
-profile1 = ChannelProfiler(mg, number_of_watersheds=1,
-                                 minimum_channel_threshold=0,
-                                 main_channel_only=True)
-profile1.run_one_step()
+## the largest channel (trunk of the largest watershed) at the last step
+network.update()
+trunk = network.nodes[0]
+distance = network.distance_along_profile[0]
 pl.figure()
-profile1.plot_profiles(field='topographic__elevation', ylabel='Elevation [m]',
-                       title='Longitudinal River Profile of largest stream')
+colors = pl.cm.viridis(np.linspace(0, 1, len(long_profiles)))
+for (t, d, zp), c in zip(long_profiles, colors):
+    pl.plot(d, zp, color=c, label='%d ky'%(t/1000))
+pl.plot(distance, z[trunk], 'k', label='final')
+pl.xlabel('Distance upstream [m]')
+pl.ylabel('Elevation [m]')
+pl.title('Longitudinal River Profile of largest stream')
+pl.legend()
 
 pl.figure()
-profile1.plot_profiles(field='channel__steepness_index', ylabel='Channel Steepness Index (theta=0.5)',
-                       title='channel__steepness_index')
+pl.plot(distance, mg.at_node['channel__steepness_index'][trunk])
+pl.xlabel('Distance upstream [m]')
+pl.ylabel('Channel Steepness Index (theta=0.5)')
+pl.title('channel__steepness_index')
 
 pl.figure()
-profile1.plot_profiles(field='channel__chi_index', ylabel='Channel Chi Index (theta=0.5)',
-                       title='channel__chi_index')
+pl.plot(distance, mg.at_node['channel__chi_index'][trunk])
+pl.xlabel('Distance upstream [m]')
+pl.ylabel('Channel Chi Index (theta=0.5)')
+pl.title('channel__chi_index')
 
 area = mg.at_node['drainage_area']
 slope = mg.at_node['topographic__steepest_slope']
+#median and IQR of slope in log-area bins, fit of S = ks A^-theta to the
+#channel bins only (hillslope bins, where slope increases with area, would
+#bias theta and ksn)
+bins = slope_area_bins(area, slope, bins_per_decade=10, min_area=channel_min_area)
+fit = fit_slope_area(bins, theta_ref=0.5, n_boot=1000)
+print('theta = %.3f (95%% CI %.3f - %.3f), ksn = %.3g (95%% CI %.3g - %.3g)'
+      % ((fit['theta'],) + fit['theta_ci'] + (fit['ksn'],) + fit['ksn_ci']))
 pl.figure()
-pl.loglog(area, slope, 'k+')
+bins.plot(pl.gca(), fit=fit)
 pl.grid()
+pl.legend()
 pl.xlabel('Log Drainage Area [m^2]', fontsize=16)
 pl.ylabel('Log Slope [m/m]', fontsize=16)
 pl.title('Log-Area vs. Log-Slope plot for all channels')
\ No newline at end of file
@@ -13,6 +13,8 @@ from landlab.components.diffusion.diffusion import LinearDiffuser
 from landlab.plot import imshow_grid
 from pylab import show, figure
 
+from lem_uplift import PatternUplift, block_pattern
+
 #%% Create an uplifted block in the center of model domain
 #Create a raster grid with 100 rows, 100 columns, and cell spacing of 1 m
 n=100
@@ -69,8 +71,10 @@ dt = 100.
 #Evolve landscape and continue to uplift block at every time step
 rock_uplift_rate = 0.01 #m/yr
 time_steps = 25
+#uplift rate of the block nodes, computed once
+uplift = PatternUplift(mg, block_pattern(mg, (45, 55), (45, 55)), rate=rock_uplift_rate)
 for i in range(time_steps):
-    z[blockuplift_nodes] += rock_uplift_rate * dt #uplift the block nodes
+    uplift.run_one_step(dt) #uplift the block nodes
     ld.run_one_step(dt)
 
 #Plot new landscape
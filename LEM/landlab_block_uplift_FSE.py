@@ -6,11 +6,15 @@ Created on Tue Feb 18 09:05:44 2020
 @author: bodo
 """
 
-from landlab.components import FlowAccumulator, FastscapeEroder
+from landlab.components import FastscapeEroder
 from landlab import RasterModelGrid
 import numpy as np
 from matplotlib import pyplot as pl
 from landlab.plot import imshow_grid
+from lem_pipeline import ErosionRate, Pipeline
+from lem_routing import IncrementalFlowAccumulator
+from lem_snapshots import SnapshotWriter
+from lem_uplift import PatternUplift, block_pattern
 
 #%% Stream Power-based FastScape erosion model for an uplifted block
 n=100
@@ -33,7 +37,7 @@ imshow_grid(mg, 'topographic__elevation',
 #np.sin( np.deg2rad(10) )
 
 # Setup Stream Power Erosion Law
-fr = FlowAccumulator(mg, flow_director='D8')
+fr = IncrementalFlowAccumulator(mg)
 fse = FastscapeEroder(mg, K_sp = 1e-3, m_sp=0.5, n_sp=1.)
 fr.run_one_step()
 fse.run_one_step(dt=10000.)
@@ -54,10 +58,12 @@ dt = 1000.
 #Evolve landscape and continue to uplift block at every time step
 rock_uplift_rate = 0.01 #m/yr
 time_steps = 100
-for i in range(time_steps):
-    z[blockuplift_nodes] += rock_uplift_rate * dt #uplift the block nodes
-    fr.run_one_step()
-    fse.run_one_step(dt)
+#uplift the block nodes, route flow, erode
+pipe = Pipeline([PatternUplift(mg, block_pattern(mg, (150, 850), (150, 850)), rock_uplift_rate),
+                 fr, fse],
+                dt, time_steps)
+pipe.run()
+pipe.print_summary()
 
 pl.figure()
 imshow_grid(mg, 'topographic__elevation', 
@@ -87,15 +93,24 @@ imshow_grid(mg, 'topographic__elevation',
             allow_colorbar=True)
 
 #%% Evolve landscape and continue to uplift block at every time step
-fr = FlowAccumulator(mg, flow_director='D8')
+fr = IncrementalFlowAccumulator(mg)
 fse = FastscapeEroder(mg, K_sp = 1e-4, m_sp=0.5, n_sp=1.)
 rock_uplift_rate = 0.001 #m/yr
 dt = 100000.
 time_steps = 50
-for i in range(time_steps):
-    z[blockuplift_nodes] += rock_uplift_rate * dt #uplift the block nodes
-    fr.run_one_step()
-    fse.run_one_step(dt)
+#uplift the block nodes, route flow, erode (and keep the erosion rate)
+pipe = Pipeline([PatternUplift(mg, block_pattern(mg, (5000, 20000), (5000, 20000)),
+                               rock_uplift_rate), fr,
+                 ('FastscapeEroder', ErosionRate(mg, fse))],
+                dt, time_steps)
+#elevation, drainage area and erosion rate of every 5th step are written
+#in the background; read them with lem_snapshots.SnapshotStore('block_uplift_snapshots')
+snap = SnapshotWriter(mg, 'block_uplift_snapshots', every=5,
+                      fields=('topographic__elevation', 'drainage_area', 'erosion__rate'))
+pipe.callbacks.append(snap)
+pipe.run()
+snap.close()
+pipe.print_summary()
 
 pl.figure()
 imshow_grid(mg, 'topographic__elevation', 
@@ -14,6 +14,8 @@ from landlab.components.diffusion.diffusion import LinearDiffuser
 from landlab.plot import imshow_grid
 from pylab import show, figure
 
+from lem_profiles import ProfileRecorder, column_nodes
+
 #%% Create simple fault scarp model with linear diffusion
 
 #Create a raster grid with 100 rows, 100 columns, and cell spacing of 1 m
@@ -43,9 +45,12 @@ figure()
 imshow_grid(mg, 'topographic__elevation', cmap='viridis', grid_units=['m','m'])
 show()
 
-#make cross section
-crosssection_center_org = mg.node_vector_to_raster(z, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
-crosssection_center_ycoords = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
+#make cross section: nodes of the center column are found once and the
+#profile is recorded before and after diffusion
+rec = ProfileRecorder(mg, {'center': column_nodes(mg, n//2)}, nsteps=2)
+rec.record()
+crosssection_center_ycoords, crosssection_center = rec.profile('center')
+crosssection_center_org = crosssection_center[0]
 
 #and plot
 fg = pl.figure()
@@ -75,9 +80,9 @@ imshow_grid(mg, 'topographic__elevation', cmap='viridis', grid_units=['m','m'])
 show()
 
 # Plot profile across the fault
-mg_ld1 = mg.node_vector_to_raster(z, flip_vertically=True)
-crosssection_center_ld = mg.node_vector_to_raster(mg_ld1)[:,np.int(np.round(n/2))]
-crosssection_center_ycoords_ld = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))]
+rec.record()
+crosssection_center_ycoords_ld, crosssection_center = rec.profile('center')
+crosssection_center_ld = crosssection_center[-1]
 fg = pl.figure()
 pl.plot(crosssection_center_ycoords, crosssection_center_org, 'k', \
         linewidth=3, label='Original Topography')
@@ -98,14 +103,15 @@ fault_y = 50.0
 upthrown_nodes = np.where(mg.node_y>fault_y)
 z[upthrown_nodes] += 10.0
 
-crosssection_center_org = mg.node_vector_to_raster(z, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
-crosssection_center_ycoords = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
 kappa_linear_diffusivity=0.01 #in m2 per year L2/T
 ld = LinearDiffuser(grid=mg, linear_diffusivity=kappa_linear_diffusivity)
 dt = 250.
 time_steps = 50
-crosssection_center_ld = np.empty((time_steps, len(crosssection_center_org)))
-crosssection_center_ycoords_ld = np.empty((time_steps, len(crosssection_center_org)))
+#profile of the original topography and after every time step
+rec = ProfileRecorder(mg, {'center': column_nodes(mg, n//2)}, nsteps=time_steps+1)
+rec.record(0.)
+crosssection_center_ycoords, crosssection_center = rec.profile('center')
+crosssection_center_org = crosssection_center[0]
 
 fg = pl.figure()
 pl.plot(crosssection_center_ycoords, crosssection_center_org, 'k', \
@@ -117,10 +123,11 @@ pl.title('Profile across linear diffusion scarp', fontsize=16)
 
 for i in range(time_steps):
     ld.run_one_step(dt)
-    mg_ld1 = mg.node_vector_to_raster(z, flip_vertically=True)
-    crosssection_center_ld[i,:] = mg.node_vector_to_raster(mg_ld1)[:,np.int(np.round(n/2))].copy()
-    crosssection_center_ycoords_ld[i,:] = mg.node_vector_to_raster(mg.node_y, flip_vertically=True)[:,np.int(np.round(n/2))].copy()
-    pl.plot(crosssection_center_ycoords_ld[i,:], crosssection_center_ld[i,:], 'b', \
+    rec.record((i+1)*dt)
+
+#time steps x nodes of the center column
+crosssection_center_ycoords_ld, crosssection_center_ld = rec.profile('center')
+pl.plot(crosssection_center_ycoords_ld, crosssection_center_ld[1:].T, 'b', \
         linewidth=1, label='ld after n*dt')
 
 
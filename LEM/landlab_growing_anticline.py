@@ -11,6 +11,8 @@ import numpy as np
 from matplotlib import pyplot as pl
 from landlab.plot import imshow_grid
 
+from lem_uplift import PatternUplift, fold_pattern
+
 #%% Setup initial topography
 x = np.arange(0,100,1)
 y = (-1)*np.power(x-50, 2.)
@@ -40,16 +42,12 @@ imshow_grid(mg, 'topographic__elevation', plot_name='Initional Topography',
             allow_colorbar=True)
 
 
-# #Setup varying uplift rate
-x_uplift = np.arange(0,100,1)
-y_uplift = (-1)*np.power(x_uplift-50, 2.)
-y_uplift = y_uplift - np.min(y_uplift)
-y_uplift = y_uplift / np.max(y_uplift)
-y_uplift = y_uplift / 1000
-y_uplift2d = np.empty((100,100))
-y_uplift2d = np.reshape(np.repeat(y_uplift,100), (100, 100) )
+# #Setup varying uplift rate: parabolic fold with the axis at y=500 m, 1 mm/yr
+#at the axis and 0 at the lower edge, computed once for all nodes
+uplift = PatternUplift(mg, fold_pattern(mg, axis=n/2*node_spacing, half_width=n/2*node_spacing),
+                       rate=1e-3, core_only=False)
 pl.figure()
-pl.imshow(y_uplift2d)
+pl.imshow(np.reshape(uplift.rate_at_node, (n,n)))
 pl.colorbar()
 
 fr = FlowAccumulator(mg, flow_director='D8')
@@ -57,7 +55,7 @@ fse = FastscapeEroder(mg, K_sp = 1e-5, m_sp=0.5, n_sp=1.)
 dt = 10000.
 time_steps = 50
 for i in range(time_steps):
-    z += np.reshape(y_uplift2d, n*n) * dt #uplift the block nodes
+    uplift.run_one_step(dt) #uplift the fold in place
     fr.run_one_step()
     fse.run_one_step(dt)
 
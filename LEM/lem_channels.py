@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Channel network and trunk-stream long profiles kept up to date between
+output intervals.
+
+ChannelProfiler extracts the channels from scratch every time it runs.
+ChannelNetwork keeps the state of the last update:
+    - the flow distance of every node to its outlet. It is recomputed only
+      for the nodes upstream of nodes whose receiver changed. Each of these
+      is one block of the upstream node order (stack), and the distances
+      within the blocks are found by pointer jumping.
+    - the largest donor of every node. It is recomputed only for receivers
+      that gained or lost a donor or whose donors' drainage area changed.
+    - the trunk streams. Each starts at the outlet of one of the
+      number_of_watersheds largest watersheds and follows the largest donor
+      upstream while the drainage area is >= minimum_channel_threshold. A
+      trunk is re-walked only from its first node whose largest donor
+      changed.
+Channel nodes are all nodes with drainage area >= minimum_channel_threshold.
+The trunks are the main channels of ChannelProfiler(main_channel_only =
+True). If more than fallback_fraction of the receivers changed, or the
+boundary conditions changed, everything is rebuilt. check() compares the
+state with a full rebuild.
+
+Usage:
+    cn = ChannelNetwork(mg, minimum_channel_threshold = 1e6)
+    pipe.callbacks.append(cn)                 #update every step, or:
+    cn.update()                               #at every output interval
+    pl.plot(cn.distance_along_profile[0], z[cn.nodes[0]])
+"""
+import numpy as np
+
+from landlab.components.flow_accum import flow_accum_bw
+
+
+def _jump(parent, acc):
+    #pointer jumping: acc[i] becomes the sum of acc along the chain of
+    #parents from i to the end of its chain (parent -1)
+    parent = parent.copy()
+    acc = acc.copy()
+    active = np.flatnonzero(parent >= 0)
+    while active.size:
+        p = parent[active]
+        acc[active] += acc[p]
+        parent[active] = parent[p]
+        active = active[parent[active] >= 0]
+    return acc
+
+
+class ChannelNetwork(object):
+    def __init__(self, mg, minimum_channel_threshold = 0., number_of_watersheds = 1,
+                 fallback_fraction = 0.05, every = 1):
+        self.mg = mg
+        self.minimum_channel_threshold = minimum_channel_threshold
+        self.number_of_watersheds = number_of_watersheds
+        self.fallback_fraction = fallback_fraction
+        self.every = every
+        self._r = None
+        #trunk nodes from the outlet upstream and their distance to the outlet
+        self.nodes = []
+        self.distance_along_profile = []
+        #nodes with new distances in the last update
+        self.n_updated = 0
+        self.full_rebuilds = 0
+
+    @property
+    def channel_mask(self):
+        return self.mg.at_node['drainage_area'] >= self.minimum_channel_threshold
+
+    @property
+    def channel_nodes(self):
+        return np.flatnonzero(self.channel_mask)
+
+    def _link_length(self, r):
+        link = self.mg.at_node['flow__link_to_receiver_node']
+        length = np.zeros(r.size)
+        has = (link >= 0) & (r != np.arange(r.size))
+        length[has] = self.mg.length_of_d8[link[has]]
+        return length
+
+    def _largest_donor(self, r, area, receivers = None):
+        #largest donor of every receiver (of the given receivers), -1 if none
+        n = np.arange(r.size)
+        donor = (r != n)
+        if receivers is not None:
+            self._best[receivers] = -1
+            on = np.zeros(r.size, dtype = bool)
+            on[receivers] = True
+            donor &= on[r]
+        else:
+            self._best = np.full(r.size, -1)
+        d = np.flatnonzero(donor)
+        #sorted by receiver, area and descending node: the last donor of a
+        #receiver wins (the lowest node id of equal areas, as ChannelProfiler)
+        d = d[np.lexsort((-d, area[d], r[d]))]
+        last = np.ones(d.size, dtype = bool)
+        last[:-1] = r[d[1:]] != r[d[:-1]]
+        self._best[r[d[last]]] = d[last]
+
+    def full_rebuild(self):
+        r = np.array(self.mg.at_node['flow__receiver_node'])
+        area = np.array(self.mg.at_node['drainage_area'])
+        self._length = self._link_length(r)
+        parent = np.where(r != np.arange(r.size), r, -1)
+        self.distance = _jump(parent, self._length)
+        self._largest_donor(r, area)
+        self._r, self._area = r, area
+        self._status = self.mg.status_at_node.copy()
+        self.nodes = []
+        self.n_updated = r.size
+        self.full_rebuilds += 1
+
+    def update(self):
+        r = np.asarray(self.mg.at_node['flow__receiver_node'])
+        area = np.asarray(self.mg.at_node['drainage_area'])
+        if self._r is None or not np.array_equal(self.mg.status_at_node, self._status):
+            self.full_rebuild()
+        else:
+            changed = np.flatnonzero(r != self._r)
+            if changed.size > self.fallback_fraction * r.size:
+                self.full_rebuild()
+            else:
+                if changed.size:
+                    self._update_distance(r, changed)
+                else:
+                    self.n_updated = 0
+                #receivers that gained or lost donors or whose donors' area changed
+                grown = np.flatnonzero(area != self._area)
+                receivers = np.unique(np.concatenate((r[changed], self._r[changed], r[grown])))
+                if receivers.size:
+                    self._largest_donor(r, area, receivers)
+                self._r = r.copy()
+                self._area = area.copy()
+        self._update_trunks(area)
+        return self
+
+    def _update_distance(self, r, changed):
+        #subtrees of the changed nodes are blocks of the (depth-first) stack
+        stack = np.asarray(self.mg.at_node['flow__upstream_node_order'])
+        pos = np.empty_like(stack)
+        pos[stack] = np.arange(stack.size)
+        size = flow_accum_bw.find_drainage_area_and_discharge(stack, r)[0].astype(np.int64)
+        edges = np.zeros(stack.size + 1, dtype = np.int64)
+        np.add.at(edges, pos[changed], 1)
+        np.add.at(edges, pos[changed] + size[changed], -1)
+        nodes = stack[np.cumsum(edges[:-1]) > 0]
+        self._length[changed] = self._link_length(r)[changed]
+        inside = np.zeros(r.size, dtype = bool)
+        inside[nodes] = True
+        #chains end at the first node outside the subtrees (distance known)
+        local = np.full(r.size, -1)
+        local[nodes] = np.arange(nodes.size)
+        rec = r[nodes]
+        parent = np.where(inside[rec] & (rec != nodes), local[rec], -1)
+        acc = self._length[nodes] + np.where(parent < 0, self.distance[rec], 0.)
+        #outlets (own receiver) have distance 0
+        acc[rec == nodes] = 0.
+        self.distance[nodes] = _jump(parent, acc)
+        self.n_updated = nodes.size
+
+    def _outlets(self, area):
+        #open boundary nodes with the largest drainage area, in the order
+        #of ChannelProfiler
+        boundary = self.mg.boundary_nodes
+        return boundary[np.argsort(area[boundary])][-self.number_of_watersheds:]
+
+    def _walk(self, start, area):
+        path = [start]
+        best = self._best
+        node = best[start]
+        while node >= 0 and area[node] >= self.minimum_channel_threshold:
+            path.append(node)
+            node = best[node]
+        return path
+
+    def _update_trunks(self, area):
+        trunks = []
+        for outlet in self._outlets(area):
+            old = next((t for t in self.nodes if t[0] == outlet), None)
+            if old is None:
+                trunks.append(np.array(self._walk(outlet, area)))
+                continue
+            #first node whose upstream continuation changed; the head is
+            #always re-walked, the channel may have grown
+            ok = np.append((self._best[old[:-1]] == old[1:]) &
+                           (area[old[1:]] >= self.minimum_channel_threshold), False)
+            k = int(np.argmin(ok))
+            trunks.append(np.concatenate((old[:k], self._walk(old[k], area))))
+        self.nodes = trunks
+        self.distance_along_profile = [self.distance[t] for t in trunks]
+
+    def __call__(self, pipeline):
+        #Pipeline callback
+        if pipeline.step % self.every == 0:
+            self.update()
+
+    def check(self):
+        """
+        Compare distances and trunks with a full rebuild; raises
+        RuntimeError if they differ
+        """
+        distance, nodes = self.distance, self.nodes
+        rebuilds = self.full_rebuilds
+        self.full_rebuild()
+        self.full_rebuilds = rebuilds
+        self._update_trunks(self._area)
+        if not np.allclose(distance, self.distance, rtol = 1e-12, atol = 1e-9):
+            raise RuntimeError('channel network: distances differ from a full rebuild')
+        if (len(nodes) != len(self.nodes) or
+                any(not np.array_equal(a, b) for a, b in zip(nodes, self.nodes))):
+            raise RuntimeError('channel network: trunks differ from a full rebuild')
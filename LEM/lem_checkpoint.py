@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoint and restart of landscape-evolution runs.
+
+A checkpoint holds every field of the landlab grid (nodes, links, cells,
+...), the node boundary status, the state of the NumPy random number
+generators and the step, time and timing log of a Pipeline. Restoring
+writes the fields back into the existing arrays, so the components keep
+working on them, and the run continues bit for bit as if it had never
+stopped. A finished run can be extended with Pipeline.extend().
+
+A checkpoint also holds the fingerprint of its run (run_fingerprint(): a
+hash of the model parameters, the grid and the initial surface) and
+whether the run had finished. Checkpointer.restore() only continues an
+unfinished run with the same fingerprint; otherwise the run starts from the
+beginning and its first checkpoint replaces the old ones.
+
+Like the routing cache, a checkpoint is a directory of .npy files that can
+be loaded memory-mapped or, with compress = True, one compressed .npz
+file. Both are written under a temporary name and renamed, so a job that
+is killed while writing leaves the previous checkpoint intact.
+
+Usage:
+    ckpt = Checkpointer(mg, 'baspa_checkpoints', every_steps = 50,
+                        every_seconds = 600,
+                        fingerprint = run_fingerprint(mg, {'K_sp': K_sp, 'dt': dt}))
+    ckpt.restore(pipe)          #continue a preempted run, if there is one
+    pipe.callbacks.append(ckpt)
+    pipe.run()
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+LOCATIONS = ('node', 'link', 'patch', 'corner', 'face', 'cell')
+PREFIX = 'checkpoint_'
+
+
+def _state_to_json(state):
+    #bit generator states may hold arrays (MT19937 key)
+    def default(o):
+        if isinstance(o, np.ndarray):
+            return {'__array__': o.tolist(), 'dtype': o.dtype.str}
+        if isinstance(o, np.integer):
+            return int(o)
+        raise TypeError(repr(o))
+    return json.dumps(state, default = default)
+
+
+def _state_from_json(s):
+    def hook(d):
+        if '__array__' in d:
+            return np.array(d['__array__'], dtype = d['dtype'])
+        return d
+    return json.loads(s, object_hook = hook)
+
+
+def run_fingerprint(mg, params = None, fields = ('topographic__elevation',)):
+    """
+    Hash of the model parameters (dict), the grid shape, spacing and node
+    boundary status and the initial values of fields; call it before the
+    run starts
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps(params or {}, sort_keys = True, default = str).encode())
+    h.update(json.dumps([[int(s) for s in mg.shape],
+                         [float(s) for s in np.atleast_1d(mg.spacing)]]).encode())
+    h.update(np.ascontiguousarray(mg.status_at_node).tobytes())
+    for name in fields:
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(mg.at_node[name]).tobytes())
+    return h.hexdigest()
+
+
+def checkpoint_arrays(mg, pipeline = None, rng = None, fingerprint = None):
+    """
+    Dict of arrays describing the state of grid mg, pipeline and the random
+    number generators (the global np.random state and the Generator rng)
+    """
+    arrays = {}
+    for loc in LOCATIONS:
+        if loc not in mg.groups:
+            continue
+        fields = getattr(mg, 'at_' + loc)
+        for name in fields.keys():
+            arrays['%s:%s' % (loc, name)] = np.asarray(fields[name])
+    arrays['status_at_node'] = np.asarray(mg.status_at_node)
+    meta = {'fingerprint': fingerprint}
+    kind, keys, pos, has_gauss, cached = np.random.get_state()
+    arrays['np_random_keys'] = keys
+    meta['np_random'] = [kind, int(pos), int(has_gauss), float(cached)]
+    if rng is not None:
+        meta['rng'] = _state_to_json(rng.bit_generator.state)
+    if pipeline is not None:
+        meta['step'] = pipeline.step
+        meta['time'] = pipeline.time
+        meta['dt'] = pipeline.dt
+        meta['finished'] = bool(getattr(pipeline, 'finished', False))
+        arrays['pipeline_dts'] = pipeline.dts[:pipeline.step]
+        arrays['pipeline_wall_time'] = pipeline.wall_time[:pipeline.step]
+        arrays['pipeline_calls'] = pipeline.calls
+    arrays['meta'] = np.array(json.dumps(meta))
+    return arrays
+
+
+def save_checkpoint(path, mg, pipeline = None, rng = None, compress = False,
+                    fingerprint = None):
+    """
+    Write a checkpoint atomically to path (a directory, or a .npz file with
+    compress = True)
+    """
+    arrays = checkpoint_arrays(mg, pipeline, rng, fingerprint)
+    parent = os.path.dirname(os.path.abspath(path))
+    if compress:
+        fd, tmp = tempfile.mkstemp(suffix = '.npz', dir = parent)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+    else:
+        tmp = tempfile.mkdtemp(dir = parent)
+        for name, a in arrays.items():
+            np.save(os.path.join(tmp, name.replace(':', '@') + '.npy'), a)
+    if os.path.isdir(path):
+        #a directory cannot be replaced in one step: move the old one away
+        old = tempfile.mkdtemp(dir = parent)
+        os.replace(path, os.path.join(old, 'old'))
+        os.replace(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.replace(tmp, path)
+    return path
+
+
+def _read(path):
+    if os.path.isdir(path):
+        return {f[:-4].replace('@', ':'): np.load(os.path.join(path, f), mmap_mode = 'r')
+                for f in os.listdir(path) if f.endswith('.npy')}
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
+
+
+def read_meta(path):
+    """
+    Metadata (step, time, fingerprint, finished, ...) of the checkpoint at
+    path without loading its fields
+    """
+    if os.path.isdir(path):
+        meta = np.load(os.path.join(path, 'meta.npy'))
+    else:
+        with np.load(path) as f:
+            meta = f['meta']
+    return json.loads(str(meta[()]))
+
+
+def load_checkpoint(path, mg, pipeline = None, rng = None):
+    """
+    Restore grid fields, boundary status, random number generator states
+    and the pipeline step and timing log from the checkpoint at path
+    """
+    arrays = _read(path)
+    meta = json.loads(str(arrays.pop('meta')[()]))
+    status = arrays.pop('status_at_node')
+    if not np.array_equal(mg.status_at_node, status):
+        mg.status_at_node[:] = status
+    keys = arrays.pop('np_random_keys')
+    kind, pos, has_gauss, cached = meta['np_random']
+    np.random.set_state((kind, np.array(keys), pos, has_gauss, cached))
+    if rng is not None and 'rng' in meta:
+        rng.bit_generator.state = _state_from_json(meta['rng'])
+    dts = arrays.pop('pipeline_dts', None)
+    wall_time = arrays.pop('pipeline_wall_time', None)
+    calls = arrays.pop('pipeline_calls', None)
+    if pipeline is not None and 'step' in meta:
+        if meta['step'] > pipeline.nt:
+            pipeline.extend(meta['step'] - pipeline.nt)
+        pipeline.step = meta['step']
+        pipeline.time = meta['time']
+        #the current step of an adaptive run
+        pipeline.dt = meta.get('dt', pipeline.dt)
+        if dts is not None:
+            pipeline.dts[:pipeline.step] = dts
+        pipeline.wall_time[:pipeline.step] = wall_time
+        pipeline.calls[:] = calls
+    for key, a in arrays.items():
+        loc, name = key.split(':', 1)
+        fields = getattr(mg, 'at_' + loc)
+        if name in fields:
+            fields[name][...] = a
+        else:
+            mg.add_field(name, np.array(a), at = loc)
+    return meta
+
+
+class Checkpointer(object):
+    """
+    Pipeline callback that writes a checkpoint every every_steps steps
+    and/or every every_seconds seconds of wall time, keeping the newest
+    `keep` checkpoints in checkpoint_dir; with a fingerprint (see
+    run_fingerprint) only checkpoints of the same run are restored
+    """
+    def __init__(self, mg, checkpoint_dir, every_steps = None,
+                 every_seconds = None, rng = None, keep = 2, compress = False,
+                 fingerprint = None):
+        if every_steps is None and every_seconds is None:
+            raise ValueError('set every_steps and/or every_seconds')
+        self.mg = mg
+        self.checkpoint_dir = checkpoint_dir
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.rng = rng
+        self.keep = keep
+        self.compress = compress
+        self.fingerprint = fingerprint
+        #False until a checkpoint of this run was restored or written; the
+        #first save of a new run removes the checkpoints of older runs
+        self._own = False
+        self._last = time.monotonic()
+        os.makedirs(checkpoint_dir, exist_ok = True)
+
+    def checkpoints(self):
+        """
+        Paths of the checkpoints in checkpoint_dir, oldest first
+        """
+        names = sorted(f for f in os.listdir(self.checkpoint_dir)
+                       if f.startswith(PREFIX))
+        return [os.path.join(self.checkpoint_dir, f) for f in names]
+
+    def save(self, pipeline):
+        path = os.path.join(self.checkpoint_dir, '%s%08d' % (PREFIX, pipeline.step))
+        if self.compress:
+            path += '.npz'
+        save_checkpoint(path, self.mg, pipeline, self.rng, self.compress,
+                        self.fingerprint)
+        self._last = time.monotonic()
+        paths = self.checkpoints()
+        if self._own:
+            paths = paths[:-self.keep]
+        else:
+            paths = [p for p in paths if p != path]
+            self._own = True
+        for old in paths:
+            if os.path.isdir(old):
+                shutil.rmtree(old)
+            else:
+                os.remove(old)
+        return path
+
+    def restore(self, pipeline = None, resume_finished = False):
+        """
+        Load the newest checkpoint; returns its metadata or None if there
+        is no checkpoint yet, it belongs to a run with another fingerprint
+        or, unless resume_finished, its run had finished
+        """
+        paths = self.checkpoints()
+        if not paths:
+            return None
+        meta = read_meta(paths[-1])
+        if self.fingerprint is not None and meta.get('fingerprint') != self.fingerprint:
+            print('ignoring %s: parameters, grid or initial surface changed' % paths[-1])
+            return None
+        if meta.get('finished') and not resume_finished:
+            print('ignoring %s: the run had finished' % paths[-1])
+            return None
+        meta = load_checkpoint(paths[-1], self.mg, pipeline, self.rng)
+        self._own = True
+        self._last = time.monotonic()
+        print('resumed from %s' % paths[-1])
+        return meta
+
+    def __call__(self, pipeline):
+        due = (self.every_steps is not None and pipeline.step % self.every_steps == 0)
+        if self.every_seconds is not None:
+            due |= time.monotonic() - self._last >= self.every_seconds
+        #always save the end of the run (step nt or end_time)
+        if due or getattr(pipeline, 'finished', pipeline.step == pipeline.nt):
+            self.save(pipeline)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Linear hillslope diffusion with large time steps.
+
+LinearDiffuser is explicit and splits every step into substeps shorter
+than dx^2 / (4 kappa) (e.g., 20 substeps for each 1000 yr step of the
+Gaussian Hill with kappa = 0.1). Both diffusers here solve the same
+discrete equations (fluxes -kappa dz/dx on the active links, fixed-value
+boundaries unchanged, no flux across closed boundaries) with one solve per
+step:
+    ImplicitDiffuser  backward Euler (theta = 1, unconditionally stable) or
+                      Crank-Nicolson (theta = 0.5) on the core nodes. The
+                      sparse matrix is factorised once per dt and boundary
+                      setup and reused for every step.
+    SpectralDiffuser  exact solution in time via the cosine transform
+                      (rectangular core block surrounded by closed nodes)
+                      or the Fourier transform (periodic grid). One call
+                      advances any time span at the cost of two transforms.
+
+Usage:
+    ld = ImplicitDiffuser(mg, linear_diffusivity = 0.1)
+    ld.run_one_step(1000.)
+    ld = SpectralDiffuser(mg, linear_diffusivity = 0.1, boundary = 'closed')
+    ld.run_one_step(20000.)
+"""
+import numpy as np
+import scipy.fft
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+
+from landlab import NodeStatus
+
+
+def diffusion_matrix(mg, linear_diffusivity):
+    """
+    Sparse (nodes x nodes) matrix L with dz/dt = L z for linear diffusion
+    on the active links of mg (diffusivity scalar or at nodes)
+    """
+    links = mg.active_links
+    tail = mg.node_at_link_tail[links]
+    head = mg.node_at_link_head[links]
+    kappa = linear_diffusivity
+    if np.ndim(kappa):
+        #as LinearDiffuser: the larger diffusivity of the two link nodes
+        kappa = np.maximum(kappa[tail], kappa[head])
+    conductance = kappa * mg.length_of_face[mg.face_at_link[links]] / mg.length_of_link[links]
+    n = mg.number_of_nodes
+    w = sp.coo_matrix((np.concatenate((conductance, conductance)),
+                       (np.concatenate((tail, head)), np.concatenate((head, tail)))),
+                      shape = (n, n)).tocsr()
+    laplacian = w - sp.diags(np.asarray(w.sum(axis = 1)).ravel())
+    area = mg.cell_area_at_node
+    inv_area = np.zeros(n)
+    inv_area[area > 0] = 1. / area[area > 0]
+    return sp.diags(inv_area) @ laplacian
+
+
+class ImplicitDiffuser(object):
+    def __init__(self, mg, linear_diffusivity, theta = 1.,
+                 values_to_diffuse = 'topographic__elevation'):
+        if not 0.5 <= theta <= 1.:
+            raise ValueError('theta must be between 0.5 (Crank-Nicolson) and 1 (backward Euler)')
+        self.mg = mg
+        self.z = mg.at_node[values_to_diffuse]
+        self.linear_diffusivity = linear_diffusivity
+        self.theta = theta
+        self._bc_set_code = None
+        self._dt = None
+        #number of factorisations (one per dt and boundary setup)
+        self.factorisations = 0
+
+    def _assemble(self):
+        core = self.mg.status_at_node == NodeStatus.CORE
+        self.core = np.flatnonzero(core)
+        self.fixed = np.flatnonzero(~core)
+        L = diffusion_matrix(self.mg, self.linear_diffusivity)
+        self.L_core = L[self.core][:, self.core].tocsc()
+        self.L_fixed = L[self.core][:, self.fixed].tocsr()
+        self._bc_set_code = self.mg.bc_set_code
+        self._dt = None
+
+    def run_one_step(self, dt):
+        if self._bc_set_code != self.mg.bc_set_code or self._bc_set_code is None:
+            self._assemble()
+        if dt != self._dt:
+            n = self.core.size
+            self._lu = splu((sp.identity(n, format = 'csc') -
+                             self.theta * dt * self.L_core).tocsc())
+            self._dt = dt
+            self.factorisations += 1
+        z = self.z
+        zc = z[self.core]
+        rhs = zc + dt * (self.L_fixed @ z[self.fixed])
+        if self.theta < 1:
+            rhs += (1. - self.theta) * dt * (self.L_core @ zc)
+        z[self.core] = self._lu.solve(rhs)
+
+
+class SpectralDiffuser(object):
+    def __init__(self, mg, linear_diffusivity, boundary = 'closed',
+                 values_to_diffuse = 'topographic__elevation'):
+        if boundary not in ('closed', 'periodic'):
+            raise ValueError("boundary must be 'closed' or 'periodic'")
+        self.mg = mg
+        self.z = mg.at_node[values_to_diffuse]
+        self.linear_diffusivity = float(linear_diffusivity)
+        self.boundary = boundary
+        rows, cols = mg.shape
+        if boundary == 'closed':
+            #core block: all nodes but the (closed) perimeter
+            status = mg.status_at_node.reshape(rows, cols)
+            perimeter = np.ones((rows, cols), dtype = bool)
+            perimeter[1:-1, 1:-1] = False
+            if ((status[1:-1, 1:-1] != NodeStatus.CORE).any() or
+                    (status[perimeter] != NodeStatus.CLOSED).any()):
+                raise ValueError('closed SpectralDiffuser needs core nodes surrounded '
+                                 'by closed edges; use ImplicitDiffuser')
+            self.block = (slice(1, -1), slice(1, -1))
+            ny, nx = rows - 2, cols - 2
+            ky = np.pi * np.arange(ny) / ny
+            kx = np.pi * np.arange(nx) / nx
+        else:
+            self.block = (slice(None), slice(None))
+            ny, nx = rows, cols
+            ky = 2 * np.pi * np.fft.fftfreq(ny)
+            kx = 2 * np.pi * np.fft.rfftfreq(nx)
+        #eigenvalues of the 5-point Laplacian
+        self.eigenvalues = -((2 - 2 * np.cos(ky))[:, np.newaxis] / mg.dy**2 +
+                             (2 - 2 * np.cos(kx))[np.newaxis, :] / mg.dx**2)
+
+    def run_one_step(self, dt):
+        z = self.z.reshape(self.mg.shape)
+        decay = np.exp(self.linear_diffusivity * dt * self.eigenvalues)
+        block = z[self.block]
+        if self.boundary == 'closed':
+            zh = scipy.fft.dctn(block, type = 2, norm = 'ortho')
+            block[...] = scipy.fft.idctn(zh * decay, type = 2, norm = 'ortho')
+        else:
+            zh = scipy.fft.rfftn(block)
+            block[...] = scipy.fft.irfftn(zh * decay, s = block.shape)
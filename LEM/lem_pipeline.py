@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative landscape-evolution pipeline with per-component timing.
+
+The time loop of the LEM scripts (uplift, LinearDiffuser, SinkFiller,
+FlowAccumulator, FastscapeEroder, ...) is described as an ordered list of
+stages and a time schedule (dt and number of steps, e.g. from a load_params
+file). Pipeline.run() executes the loop and records the wall time of every
+stage in every step in a (steps x stages) array, so the stage that
+dominates a run can be read from the timing summary.
+
+A stage is a landlab component (its run_one_step() is called with dt if it
+takes a time step, e.g. LinearDiffuser, and without otherwise, e.g.
+FlowAccumulator), a callable f(dt) or f(), or a tuple (name, stage) or
+(name, stage, every) to run it only every n-th step. With a controller
+(lem_timestep.StepController) the time step is chosen anew before every
+step and run(end_time = ...) runs to a given model time.
+
+Usage:
+    pipe = Pipeline.from_params([Uplift(mg, inputs['uplift_rate']), ld, sf, fr, fse],
+                                'landlab_baspa_parameters1.txt')
+    pipe.run()
+    pipe.print_summary()
+    pipe.save_timing('timing.csv')
+"""
+import csv
+import inspect
+import time
+
+import numpy as np
+
+from lem_uplift import PatternUplift
+
+
+class Uplift(PatternUplift):
+    """
+    Rock uplift z[nodes] += rate * dt, by default of the core nodes (see
+    lem_uplift for spatial patterns and time-varying rates)
+    """
+    def __init__(self, mg, rate, nodes = None,
+                 field = 'topographic__elevation'):
+        if nodes is None:
+            PatternUplift.__init__(self, mg, 1., rate, field = field)
+        else:
+            pattern = np.zeros(mg.number_of_nodes)
+            pattern[nodes] = 1.
+            PatternUplift.__init__(self, mg, pattern, rate, field = field,
+                                   core_only = False)
+
+
+class ErosionRate(object):
+    """
+    Runs an erosion component (e.g., FastscapeEroder) and stores its
+    erosion rate (z before - z after) / dt in the node field
+    'erosion__rate', e.g., for snapshots
+    """
+    def __init__(self, mg, component, field = 'topographic__elevation'):
+        self.z = mg.at_node[field]
+        self.component = component
+        if 'erosion__rate' not in mg.at_node:
+            mg.add_zeros('erosion__rate', at = 'node')
+        self.rate = mg.at_node['erosion__rate']
+        self._before = np.empty_like(self.z)
+
+    def run_one_step(self, dt):
+        self._before[:] = self.z
+        self.component.run_one_step(dt)
+        np.subtract(self._before, self.z, out = self.rate)
+        self.rate /= dt
+
+
+def _number(v):
+    for t in (int, float):
+        try:
+            return t(v)
+        except ValueError:
+            pass
+    return v
+
+
+def read_params(fname):
+    """
+    Model parameters from a load_params file. The older two-line format
+    used by the parameter files of this repository ("name:" and the value
+    on the next line), which current YAML-based landlab versions no longer
+    read, is parsed directly.
+    """
+    with open(fname) as f:
+        lines = [l.strip() for l in f if l.strip() and not l.lstrip().startswith('#')]
+    if lines and all(k.endswith(':') for k in lines[0::2]) and len(lines) % 2 == 0:
+        return {k[:-1].strip(): _number(v) for k, v in zip(lines[0::2], lines[1::2])}
+    from landlab import load_params
+    return load_params(fname)
+
+
+def _takes_dt(func):
+    #True if func has a required positional argument (the time step)
+    try:
+        params = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return True
+    return any(p.default is p.empty and
+               p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+               for p in params)
+
+
+class Stage(object):
+    def __init__(self, stage, name = None, every = 1):
+        func = getattr(stage, 'run_one_step', stage)
+        if not callable(func):
+            raise TypeError('stage %r has no run_one_step() and is not callable'
+                            % (stage,))
+        self.component = stage
+        self.func = func
+        self.takes_dt = _takes_dt(func)
+        if name is None:
+            name = getattr(stage, '__name__', type(stage).__name__)
+        self.name = name
+        self.every = every
+
+    def __call__(self, dt):
+        if self.takes_dt:
+            self.func(dt)
+        else:
+            self.func()
+
+
+class Pipeline(object):
+    def __init__(self, stages, dt, nt, progress_every = None, controller = None):
+        self.stages = []
+        for s in stages:
+            if isinstance(s, tuple):
+                self.stages.append(Stage(s[1], s[0], *s[2:]))
+            else:
+                self.stages.append(Stage(s))
+        self.dt = float(dt)
+        self.nt = int(nt)
+        self.progress_every = progress_every
+        #adaptive time stepping, e.g. lem_timestep.StepController
+        self.controller = controller
+        #functions f(pipeline) called after every step (output, checkpoints)
+        self.callbacks = []
+        self.step = 0
+        self.time = 0.
+        #model time the current run() ends at, None for a fixed number of steps
+        self.end_time = None
+        self.dts = np.full(self.nt, np.nan)
+        self.wall_time = np.full((self.nt, len(self.stages)), np.nan)
+        self.calls = np.zeros(len(self.stages), dtype = np.int64)
+
+    @classmethod
+    def from_params(cls, stages, params, **kwargs):
+        """
+        Pipeline with dt and nt = total_time // dt from a load_params
+        dictionary or file name
+        """
+        if isinstance(params, str):
+            params = read_params(params)
+        dt = params['dt']
+        return cls(stages, dt, int(params['total_time'] // dt), **kwargs)
+
+    def extend(self, nsteps):
+        """
+        Append nsteps steps to the schedule, e.g., to continue a finished run
+        """
+        self.nt += int(nsteps)
+        self.dts = np.concatenate((self.dts, np.full(int(nsteps), np.nan)))
+        self.wall_time = np.vstack((self.wall_time,
+                                    np.full((int(nsteps), len(self.stages)), np.nan)))
+        return self
+
+    @property
+    def names(self):
+        return [s.name for s in self.stages]
+
+    @property
+    def finished(self):
+        """
+        True at the end of the run: step nt or, for run(end_time = ...), the
+        model time end_time
+        """
+        if self.end_time is None:
+            return self.step >= self.nt
+        return self.end_time - self.time <= 1e-9 * abs(self.end_time)
+
+    def run(self, nsteps = None, end_time = None):
+        """
+        Run nsteps steps (default: up to nt) from the current step or, if
+        end_time is given, until the model time reaches end_time. The
+        schedule is extended as needed and the last step is shortened to
+        end exactly at end_time.
+        """
+        self.end_time = end_time
+        if end_time is None:
+            stop = self.nt if nsteps is None else min(self.nt, self.step + nsteps)
+        else:
+            stop = np.inf if nsteps is None else self.step + nsteps
+        timer = time.perf_counter
+        while self.step < stop:
+            if end_time is not None and self.finished:
+                break
+            i = self.step
+            if i == self.nt:
+                self.extend(max(self.nt, 16))
+            dt = self.dt
+            if self.controller is not None:
+                dt = self.controller.propose(self)
+            if end_time is not None:
+                dt = min(dt, end_time - self.time)
+            row = self.wall_time[i]
+            for j, stage in enumerate(self.stages):
+                if i % stage.every:
+                    continue
+                t0 = timer()
+                stage(dt)
+                row[j] = timer() - t0
+                self.calls[j] += 1
+            self.dts[i] = dt
+            self.step += 1
+            self.time += dt
+            if self.controller is not None:
+                self.controller.update(self, dt)
+            for f in self.callbacks:
+                f(self)
+            if self.progress_every and i % self.progress_every == 0:
+                print('i:', i)
+        return self
+
+    def summary(self):
+        """
+        Calls, total, mean and maximum wall time and share of the total time
+        per stage as a list of dicts
+        """
+        done = self.wall_time[:self.step]
+        total = np.nansum(done, axis = 0)
+        grand = total.sum()
+        rows = []
+        for j, name in enumerate(self.names):
+            t = done[:, j]
+            n = int(self.calls[j])
+            rows.append({'stage': name, 'calls': n, 'total_s': float(total[j]),
+                         'mean_s': float(total[j] / n) if n else np.nan,
+                         'max_s': float(np.nanmax(t)) if n else np.nan,
+                         'fraction': float(total[j] / grand) if grand > 0 else np.nan})
+        return rows
+
+    def print_summary(self):
+        print('%-24s %7s %10s %10s %10s %6s'
+              % ('stage', 'calls', 'total [s]', 'mean [s]', 'max [s]', '%'))
+        for r in self.summary():
+            print('%-24s %7d %10.3f %10.5f %10.5f %6.1f'
+                  % (r['stage'], r['calls'], r['total_s'], r['mean_s'],
+                     r['max_s'], 100 * r['fraction']))
+
+    def save_timing(self, fname):
+        """
+        Write the timing log (one row per step and stage run) as CSV
+        """
+        with open(fname, 'w', newline = '') as f:
+            w = csv.writer(f)
+            w.writerow(['step', 'time', 'dt', 'stage', 'wall_time_s'])
+            t = np.cumsum(self.dts[:self.step])
+            for i in range(self.step):
+                for j, name in enumerate(self.names):
+                    if not np.isnan(self.wall_time[i, j]):
+                        w.writerow([i, t[i], self.dts[i], name, self.wall_time[i, j]])
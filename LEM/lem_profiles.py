@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record cross-section profiles of a landlab field during a time loop.
+
+The node indices and the distance along every transect (grid columns and
+rows or polylines through the grid) are found once. Each call of record()
+gathers the field values at these nodes with one np.take directly into a
+preallocated (steps x nodes) array, or a memory-mapped .npy file for long
+runs, without building rasters of the grid. profile() returns the
+distances and the recorded values of one transect for plotting.
+
+Usage:
+    rec = ProfileRecorder(mg, {'center': column_nodes(mg, mg.shape[1] // 2)},
+                          nsteps = time_steps + 1)
+    rec.record()                          #initial topography
+    for i in range(time_steps):
+        ld.run_one_step(dt)
+        rec.record()
+    y, z = rec.profile('center')          #z: (recorded steps x nodes)
+    pl.plot(y, z.T)
+"""
+import numpy as np
+
+
+def column_nodes(mg, column):
+    """
+    Nodes of a grid column from bottom to top and their y coordinates
+    """
+    nodes = np.arange(mg.shape[0]) * mg.shape[1] + column
+    return nodes, mg.node_y[nodes]
+
+
+def row_nodes(mg, row):
+    """
+    Nodes of a grid row from left to right and their x coordinates
+    """
+    nodes = row * mg.shape[1] + np.arange(mg.shape[1])
+    return nodes, mg.node_x[nodes]
+
+
+def polyline_nodes(mg, vertices, spacing = None):
+    """
+    Nodes closest to a polyline through the (x, y) vertices, sampled every
+    spacing (default: the smaller grid spacing), and the distance of the
+    sample points along the polyline. Repeated nodes are dropped.
+    """
+    vertices = np.asarray(vertices, dtype = float)
+    if spacing is None:
+        spacing = min(mg.dx, mg.dy)
+    seg = np.hypot(*np.diff(vertices, axis = 0).T)
+    along = np.concatenate(([0.], np.cumsum(seg)))
+    s = np.append(np.arange(0., along[-1], spacing), along[-1])
+    x = np.interp(s, along, vertices[:, 0])
+    y = np.interp(s, along, vertices[:, 1])
+    col = np.clip(np.round((x - mg.node_x[0]) / mg.dx), 0, mg.shape[1] - 1).astype(int)
+    row = np.clip(np.round((y - mg.node_y[0]) / mg.dy), 0, mg.shape[0] - 1).astype(int)
+    nodes = row * mg.shape[1] + col
+    keep = np.ones(nodes.size, dtype = bool)
+    keep[1:] = nodes[1:] != nodes[:-1]
+    return nodes[keep], s[keep]
+
+
+class ProfileRecorder(object):
+    """
+    transects is a dict of name -> (nodes, distance) as returned by
+    column_nodes(), row_nodes() and polyline_nodes(). With filename, the
+    records are kept in a memory-mapped .npy file.
+    """
+    def __init__(self, mg, transects, nsteps, field = 'topographic__elevation',
+                 filename = None, dtype = np.float64):
+        self.values = mg.at_node[field]
+        self.names = list(transects)
+        nodes = [np.asarray(transects[k][0], dtype = np.intp) for k in self.names]
+        self.distance = {k: np.asarray(transects[k][1], dtype = float) for k in self.names}
+        self.nodes = np.concatenate(nodes)
+        ends = np.cumsum([len(a) for a in nodes])
+        self.slices = {k: slice(e - len(a), e) for k, a, e in zip(self.names, nodes, ends)}
+        shape = (int(nsteps), self.nodes.size)
+        if filename is None:
+            self.buffer = np.empty(shape, dtype = dtype)
+        else:
+            self.buffer = np.lib.format.open_memmap(filename, mode = 'w+',
+                                                    dtype = dtype, shape = shape)
+        self.times = np.full(shape[0], np.nan)
+        self.n = 0
+
+    def record(self, time = np.nan):
+        if self.n == self.buffer.shape[0]:
+            raise IndexError('ProfileRecorder is full (%d steps)' % self.n)
+        np.take(self.values, self.nodes, out = self.buffer[self.n])
+        self.times[self.n] = time
+        self.n += 1
+
+    def __call__(self, pipeline):
+        #Pipeline callback
+        self.record(pipeline.time)
+
+    def profile(self, name):
+        """
+        Distance along the transect and the recorded values (steps x nodes)
+        """
+        return self.distance[name], self.buffer[:self.n, self.slices[name]]
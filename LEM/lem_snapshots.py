@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write full-field snapshots of a landscape-evolution run in the background.
+
+Every `every` steps SnapshotWriter copies the chosen node fields
+(elevation, drainage area, erosion rate, ...) into one of `maxsize`
+preallocated buffers and hands it to a writer thread. The thread cuts
+every field into chunks (rows x columns of the grid), compresses them with
+zlib and writes one file per chunk, so the time loop only pays for the
+copy. If all buffers are still waiting to be written, the time loop waits
+for a free one (backpressure, memory stays bounded) or, with
+block = False, the snapshot is dropped and counted.
+
+The store is a directory:
+    meta.json                            grid shape, chunks, fields, dtypes,
+                                         steps and model times written so far
+    <field>/<step>/<chunk row>.<chunk column>   zlib-compressed chunk
+meta.json is replaced after every snapshot, so SnapshotStore can read a
+run while it is still going. SnapshotStore.read() decompresses only the
+chunks of one step that overlap the requested window.
+
+Usage:
+    snap = SnapshotWriter(mg, 'baspa_snapshots', every = 10,
+                          fields = ('topographic__elevation', 'drainage_area'))
+    pipe.callbacks.append(snap)
+    pipe.run()
+    snap.close()
+
+    store = SnapshotStore('baspa_snapshots')
+    z = store.read('topographic__elevation', store.steps[-1],
+                   window = (slice(100, 200), slice(0, 50)))
+"""
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+
+META = 'meta.json'
+
+
+def _write_meta(path, meta):
+    fd, tmp = tempfile.mkstemp(suffix = '.json', dir = path)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, META))
+
+
+def _chunk_bounds(n, size):
+    return [(i, min(i + size, n)) for i in range(0, n, size)]
+
+
+class SnapshotWriter(object):
+    """
+    Pipeline callback writing the node fields of mg to the store at path
+    every `every` steps (dtype = np.float32 halves the output of float
+    fields). An existing store with the same grid shape is continued.
+    """
+    def __init__(self, mg, path, fields = ('topographic__elevation',), every = 1,
+                 chunks = (256, 256), maxsize = 4, compresslevel = 1,
+                 dtype = None, block = True):
+        self.mg = mg
+        self.path = path
+        self.fields = list(fields)
+        self.every = every
+        self.block = block
+        self.compresslevel = compresslevel
+        shape = tuple(int(s) for s in mg.shape)
+        dtypes = {k: np.dtype(dtype or mg.at_node[k].dtype) for k in self.fields}
+        os.makedirs(path, exist_ok = True)
+        if os.path.exists(os.path.join(path, META)):
+            with open(os.path.join(path, META)) as f:
+                self.meta = json.load(f)
+            if tuple(self.meta['shape']) != shape:
+                raise ValueError('%s holds snapshots of a %s grid, not %s'
+                                 % (path, tuple(self.meta['shape']), shape))
+            chunks = self.meta['chunks']
+            for k, d in dtypes.items():
+                self.meta['fields'].setdefault(k, d.str)
+            dtypes = {k: np.dtype(self.meta['fields'][k]) for k in self.fields}
+        else:
+            self.meta = {'shape': shape, 'chunks': list(chunks), 'steps': [],
+                         'times': [], 'fields': {k: d.str for k, d in dtypes.items()}}
+        self.chunks = tuple(chunks)
+        #preallocated buffers; a buffer returns to the pool once written
+        self._free = queue.Queue()
+        for i in range(maxsize):
+            self._free.put({k: np.empty(shape, dtype = d) for k, d in dtypes.items()})
+        self._todo = queue.Queue()
+        self._error = None
+        #snapshots written and dropped, time the loop waited for a buffer
+        self.n_written = 0
+        self.n_dropped = 0
+        self.wait_time = 0.
+        self.bytes_written = 0
+        self._thread = threading.Thread(target = self._work, daemon = True)
+        self._thread.start()
+
+    def _work(self):
+        rows = _chunk_bounds(self.meta['shape'][0], self.chunks[0])
+        cols = _chunk_bounds(self.meta['shape'][1], self.chunks[1])
+        while True:
+            item = self._todo.get()
+            if item is None:
+                return
+            step, t, buffers = item
+            try:
+                if self._error is None:
+                    for name, a in buffers.items():
+                        d = os.path.join(self.path, name, '%08d' % step)
+                        os.makedirs(d, exist_ok = True)
+                        for i, (r0, r1) in enumerate(rows):
+                            for j, (c0, c1) in enumerate(cols):
+                                data = zlib.compress(np.ascontiguousarray(a[r0:r1, c0:c1]),
+                                                     self.compresslevel)
+                                with open(os.path.join(d, '%d.%d' % (i, j)), 'wb') as f:
+                                    f.write(data)
+                                self.bytes_written += len(data)
+                    if step in self.meta['steps']:
+                        self.meta['times'][self.meta['steps'].index(step)] = t
+                    else:
+                        self.meta['steps'].append(step)
+                        self.meta['times'].append(t)
+                    _write_meta(self.path, self.meta)
+                    self.n_written += 1
+            except Exception as e:
+                self._error = e
+            finally:
+                self._free.put(buffers)
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError('snapshot writer failed: %r' % (self._error,))
+
+    def snapshot(self, step, model_time = np.nan):
+        """
+        Queue a copy of the fields as the snapshot of step; returns False if
+        it was dropped (block = False and no free buffer)
+        """
+        self._check()
+        t0 = time.perf_counter()
+        try:
+            buffers = self._free.get(block = self.block)
+        except queue.Empty:
+            self.n_dropped += 1
+            return False
+        self.wait_time += time.perf_counter() - t0
+        for name, a in buffers.items():
+            np.copyto(a, self.mg.at_node[name].reshape(a.shape), casting = 'unsafe')
+        self._todo.put((int(step), float(model_time), buffers))
+        return True
+
+    def __call__(self, pipeline):
+        #Pipeline callback
+        if pipeline.step % self.every == 0:
+            self.snapshot(pipeline.step, pipeline.time)
+
+    def close(self):
+        """
+        Write the queued snapshots and stop the writer thread
+        """
+        if self._thread.is_alive():
+            self._todo.put(None)
+            self._thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotStore(object):
+    """
+    Lazy reader of a store written by SnapshotWriter
+    """
+    def __init__(self, path):
+        self.path = path
+        self.refresh()
+
+    def refresh(self):
+        """
+        Re-read meta.json, e.g., to see the new steps of a running model
+        """
+        with open(os.path.join(self.path, META)) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.fields = {k: np.dtype(d) for k, d in meta['fields'].items()}
+        self.steps = list(meta['steps'])
+        self.times = np.array(meta['times'])
+
+    def read(self, field, step, window = None):
+        """
+        Values of field at step (grid rows x columns) or, with window =
+        (row slice, column slice), only that part of the grid
+        """
+        if step not in self.steps:
+            raise KeyError('no snapshot of step %d in %s' % (step, self.path))
+        dtype = self.fields[field]
+        if window is None:
+            window = (slice(None), slice(None))
+        rs, cs = (w.indices(n) for w, n in zip(window, self.shape))
+        if rs[2] != 1 or cs[2] != 1:
+            raise ValueError('window slices must have step 1')
+        out = np.empty((max(rs[1] - rs[0], 0), max(cs[1] - cs[0], 0)), dtype = dtype)
+        d = os.path.join(self.path, field, '%08d' % step)
+        cr, cc = self.chunks
+        for i in range(rs[0] // cr, (rs[1] - 1) // cr + 1 if out.shape[0] else 0):
+            r0, r1 = i * cr, min((i + 1) * cr, self.shape[0])
+            for j in range(cs[0] // cc, (cs[1] - 1) // cc + 1 if out.shape[1] else 0):
+                c0, c1 = j * cc, min((j + 1) * cc, self.shape[1])
+                with open(os.path.join(d, '%d.%d' % (i, j)), 'rb') as f:
+                    chunk = np.frombuffer(zlib.decompress(f.read()),
+                                          dtype = dtype).reshape(r1 - r0, c1 - c0)
+                a0, a1 = max(r0, rs[0]), min(r1, rs[1])
+                b0, b1 = max(c0, cs[0]), min(c1, cs[1])
+                out[a0 - rs[0]:a1 - rs[0], b0 - cs[0]:b1 - cs[0]] = \
+                    chunk[a0 - r0:a1 - r0, b0 - c0:b1 - c0]
+        return out
+
+    def iter_steps(self, field, window = None, steps = None):
+        """
+        (step, time, values) of field for every step (or the given steps),
+        read one step at a time
+        """
+        for s in self.steps if steps is None else steps:
+            yield s, self.times[self.steps.index(s)], self.read(field, s, window)
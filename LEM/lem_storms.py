@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stochastic storms for landscape-evolution runs, generated and run in
+batches.
+
+generate_storms() draws the whole storm series at once from a seed with
+the distributions of landlab's PrecipitationDistribution: exponential
+storm and interstorm durations, gamma storm depths (shape = duration /
+mean duration, scale = mean depth) and intensity = depth / duration. The
+series ends exactly at total_time.
+
+StormEngine runs flow routing, erosion and diffusion during the storms and
+uplift during storms and interstorms (as the storm loop of
+landlab_FSE_storm.py). Each storm erodes for its effective duration
+    duration * intensity**intensity_exponent
+(intensity_exponent = 0: erosion proportional to the storm duration;
+m_sp: stream power in discharge = drainage area * intensity for uniform
+rain). With a tolerance, consecutive storms are merged into one step. The
+effective durations of the merged storms are added, so the total forcing of
+the series is kept exactly. A group ends before its estimated largest
+erosion, max(K A^m S^n) times its effective duration, or the largest
+uplift during its time span exceeds tolerance (and, with max_span, before
+it spans more than max_span of model time).
+Flow is routed once per group instead of once per storm. The uplift of a
+step is split in halves, before and after flow routing, erosion and
+diffusion, so longer groups do not erode a surface that has not been
+uplifted yet. The group is chosen with the slopes and drainage areas of
+the previous flow routing.
+
+Usage:
+    storms = generate_storms(250., mean_storm_duration = 0.1,
+                             mean_interstorm_duration = 0.4,
+                             mean_storm_depth = 0.2, seed = 1)
+    engine = StormEngine(mg, storms, fr, fse, diffuser = ld, uplift = up,
+                         tolerance = 1e-4)
+    engine.run()
+    engine.print_summary()
+"""
+import numpy as np
+
+
+class StormSeries(object):
+    """
+    Storms with their start time, duration and intensity and the duration
+    of the interstorm period after each storm
+    """
+    def __init__(self, start, duration, intensity, interstorm):
+        self.start = start
+        self.duration = duration
+        self.intensity = intensity
+        self.interstorm = interstorm
+
+    def __len__(self):
+        return len(self.duration)
+
+    @property
+    def total_time(self):
+        return float(self.duration.sum() + self.interstorm.sum())
+
+    def intervals(self):
+        """
+        (duration, intensity) of every storm and interstorm, as
+        PrecipitationDistribution.yield_storm_interstorm_duration_intensity()
+        """
+        for d, i, g in zip(self.duration, self.intensity, self.interstorm):
+            yield d, i
+            if g > 0:
+                yield g, 0.
+
+
+def generate_storms(total_time, mean_storm_duration, mean_interstorm_duration,
+                    mean_storm_depth, seed = None):
+    """
+    StormSeries of total_time from the random number generator seed
+    """
+    rng = np.random.default_rng(seed)
+    mean_cycle = mean_storm_duration + mean_interstorm_duration
+    chunk = int(1.1 * total_time / mean_cycle) + 16
+    durations, gaps = [], []
+    covered = 0.
+    while covered < total_time:
+        d = rng.exponential(mean_storm_duration, chunk)
+        g = rng.exponential(mean_interstorm_duration, chunk)
+        durations.append(d)
+        gaps.append(g)
+        covered += d.sum() + g.sum()
+    d = np.concatenate(durations)
+    g = np.concatenate(gaps)
+    end = np.cumsum(d + g)
+    start = end - d - g
+    n = int(np.searchsorted(start, total_time, side = 'left'))
+    d, g, start = d[:n], g[:n], start[:n]
+    #cut the last storm or interstorm at total_time
+    d[-1] = min(d[-1], total_time - start[-1])
+    g[-1] = total_time - start[-1] - d[-1]
+    depth = rng.gamma(d / mean_storm_duration, mean_storm_depth)
+    return StormSeries(start, d, depth / d, g)
+
+
+def _eroder_parameter(eroder, name, value, attributes):
+    #value of a stream-power parameter of the eroder; a given value has to
+    #agree with it
+    known = next((getattr(eroder, a) for a in attributes
+                  if getattr(eroder, a, None) is not None), None)
+    if known is None or isinstance(known, str):
+        return value
+    if value is not None and not np.allclose(value, known):
+        raise ValueError('%s = %r differs from the eroder (%r)' % (name, value, known))
+    return known if value is None else value
+
+
+class StormEngine(object):
+    """
+    Run flow_router (no time step), eroder and diffuser (during storms) and
+    uplift (storms and interstorms) through a StormSeries; with tolerance
+    (maximum estimated erosion of a merged step) storms are merged. K_sp,
+    m_sp and n_sp are read from the eroder (FastscapeEroder) if not given;
+    given values must agree with it
+    """
+    def __init__(self, mg, storms, flow_router, eroder, diffuser = None,
+                 uplift = None, intensity_exponent = 0., tolerance = None,
+                 max_span = None, K_sp = None, m_sp = None, n_sp = None):
+        K_sp = _eroder_parameter(eroder, 'K_sp', K_sp, ('K', '_K'))
+        m_sp = _eroder_parameter(eroder, 'm_sp', m_sp, ('_m',))
+        n_sp = _eroder_parameter(eroder, 'n_sp', n_sp, ('_n',))
+        if m_sp is None:
+            m_sp = 0.5
+        if n_sp is None:
+            n_sp = 1.
+        if tolerance is not None and K_sp is None:
+            raise ValueError('merging storms with a tolerance needs K_sp')
+        self.mg = mg
+        self.storms = storms
+        self.flow_router = flow_router
+        self.eroder = eroder
+        self.diffuser = diffuser
+        self.uplift = uplift
+        self.tolerance = tolerance
+        self.max_span = max_span
+        self.K_sp = K_sp
+        #largest uplift rate (Uplift, lem_uplift.PatternUplift)
+        rate = getattr(uplift, 'rate_at_node', None)
+        self.max_uplift_rate = float(np.abs(rate).max()) if rate is not None else 0.
+        self.m_sp = m_sp
+        self.n_sp = n_sp
+        wet = storms.intensity > 0
+        forcing = np.where(wet, storms.duration *
+                           np.power(storms.intensity, intensity_exponent), 0.)
+        #cumulative effective duration, storm time and model time
+        self.cum_forcing = np.concatenate(([0.], np.cumsum(forcing)))
+        self.cum_storm = np.concatenate(([0.], np.cumsum(np.where(wet, storms.duration, 0.))))
+        self.cum_time = np.concatenate(([0.], np.cumsum(storms.duration + storms.interstorm)))
+        #functions f(engine) called after every step
+        self.callbacks = []
+        self.storm = 0
+        self.time = 0.
+        #storms per step, effective duration and time span of every step
+        self.group_sizes = []
+        self.forcing = []
+        self.spans = []
+
+    def erosion_rate(self):
+        """
+        Largest K A^m S^n of the core nodes after the last flow routing
+        (erosion per unit effective duration)
+        """
+        core = self.mg.core_nodes
+        K = np.broadcast_to(self.K_sp, (self.mg.number_of_nodes,))[core]
+        A = self.mg.at_node['drainage_area'][core]
+        S = np.maximum(self.mg.at_node['topographic__steepest_slope'][core], 0.)
+        c = K * A**self.m_sp * S**self.n_sp
+        return float(c.max()) if c.size else 0.
+
+    def _group_end(self, i):
+        n = len(self.storms)
+        if self.tolerance is None:
+            return i + 1
+        c = self.erosion_rate()
+        j = n
+        if c > 0:
+            j = int(np.searchsorted(self.cum_forcing, self.cum_forcing[i] + self.tolerance / c,
+                                    side = 'right')) - 1
+        max_span = self.max_span if self.max_span is not None else np.inf
+        if self.max_uplift_rate > 0:
+            max_span = min(max_span, self.tolerance / self.max_uplift_rate)
+        if max_span < np.inf:
+            j = min(j, int(np.searchsorted(self.cum_time, self.cum_time[i] + max_span,
+                                           side = 'right')) - 1)
+        return min(max(j, i + 1), n)
+
+    def run_one_step(self):
+        """
+        Run the next storm or group of storms; returns False at the end of
+        the series
+        """
+        i = self.storm
+        if i >= len(self.storms):
+            return False
+        if self.tolerance is not None and i == 0:
+            #slopes and drainage areas for the first group
+            self.flow_router.run_one_step()
+        j = self._group_end(i)
+        forcing = self.cum_forcing[j] - self.cum_forcing[i]
+        storm_time = self.cum_storm[j] - self.cum_storm[i]
+        span = self.cum_time[j] - self.cum_time[i]
+        if self.uplift is not None:
+            self.uplift.run_one_step(span / 2.)
+        self.flow_router.run_one_step()
+        if forcing > 0:
+            self.eroder.run_one_step(forcing)
+        if storm_time > 0 and self.diffuser is not None:
+            #diffusion also only happens when it's raining
+            self.diffuser.run_one_step(storm_time)
+        if self.uplift is not None:
+            self.uplift.run_one_step(span / 2.)
+        self.storm = j
+        self.time = float(self.cum_time[j])
+        self.group_sizes.append(j - i)
+        self.forcing.append(forcing)
+        self.spans.append(span)
+        for f in self.callbacks:
+            f(self)
+        return True
+
+    def run(self, until = None):
+        """
+        Run the storm series to its end or to model time until
+        """
+        while (until is None or self.time < until) and self.run_one_step():
+            pass
+        return self
+
+    def print_summary(self):
+        n = len(self.group_sizes)
+        print('%d storms in %d steps (%.1f storms per step, at most %d)'
+              % (self.storm, n, self.storm / max(n, 1), max(self.group_sizes, default = 0)))
+        print('model time %.4g, effective erosion duration %.4g (series: %.4g)'
+              % (self.time, sum(self.forcing), self.cum_forcing[self.storm]))
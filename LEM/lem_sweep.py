@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps of landlab models in a process pool.
+
+A base parameter file (landlab_baspa_parameters1.txt format) and value
+lists for some of its parameters are expanded into one job per
+combination. The initial DEM is copied once into shared memory. Every
+model gets a read-only view of it and starts from its own copy, without
+re-reading or pickling the DEM. At most 2 * n_workers jobs are in flight.
+Each finished run appends one row of summary metrics to the results CSV
+right away. Every run has an id derived from its parameters and the
+initial DEM (and the seed of a generated one), so a sweep that is started
+again with the same DEM skips the runs already in the table, finished or
+failed, and only runs the rest. A results table whose columns lack
+parameters or metrics of the sweep is not appended to.
+
+The default model is the Baspa set-up: block uplift of the core nodes,
+LinearDiffuser, IncrementalSinkFiller, IncrementalFlowAccumulator (D8)
+and FastscapeEroder. Any picklable function model(params, z0) -> dict of
+metrics can be used instead; z0 is read-only, so it has to copy the DEM
+before changing it.
+
+Usage:
+    sweep('landlab_baspa_parameters1.txt',
+          {'K_sp': [1e-4, 5e-4, 1e-3], 'm_sp': [0.4, 0.5, 0.6]},
+          z0 = None, n_workers = 8, output = 'sweep.csv')
+    python lem_sweep.py landlab_baspa_parameters1.txt --range K_sp 1e-4 5e-4 \
+        --range m_sp 0.4 0.5 --workers 8 --output sweep.csv
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from lem_pipeline import Pipeline, Uplift, read_params
+
+METRICS = ('n_steps', 'mean_elevation', 'max_elevation', 'relief',
+           'mean_slope', 'theta', 'ksn')
+#drainage area of the channels in the slope-area fit (m^2, as in
+#landlab_block_multimodel.py); parameter channel_min_area
+CHANNEL_MIN_AREA = 1e6
+
+#set in every worker by _attach()
+_shared = {}
+
+
+def expand_grid(ranges):
+    """
+    List of dicts, one per combination of the value lists in ranges
+    """
+    names = sorted(ranges)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(ranges[k] for k in names))]
+
+
+def dem_hash(z0):
+    """
+    Hash of the shape and values of an initial DEM
+    """
+    z0 = np.ascontiguousarray(z0, dtype = np.float64)
+    h = hashlib.sha1(str(z0.shape).encode())
+    h.update(z0.tobytes())
+    return h.hexdigest()
+
+
+def run_id(params, dem = None, seed = None):
+    """
+    Short stable id of a parameter set, initial DEM (dem_hash) and seed
+    """
+    key = dict(params)
+    if dem is not None:
+        key['__dem__'] = dem
+    if seed is not None:
+        key['__seed__'] = seed
+    s = json.dumps(key, sort_keys = True, default = float)
+    return hashlib.sha1(s.encode()).hexdigest()[:12]
+
+
+def baspa_model(params, z0):
+    """
+    Uplift, linear diffusion, sink filling, D8 routing and FastScape
+    stream-power erosion of the DEM z0 with open boundaries; theta and ksn
+    are fitted to the channels (drainage area >= channel_min_area)
+    """
+    from landlab import RasterModelGrid
+    from landlab.components import FastscapeEroder, LinearDiffuser
+    from lem_fill import IncrementalSinkFiller
+    from lem_routing import IncrementalFlowAccumulator
+    from slope_area import fit_slope_area, slope_area_bins
+
+    mg = RasterModelGrid(z0.shape, params['dx'])
+    z = mg.add_field('topographic__elevation', z0.ravel().copy(), at = 'node')
+    mg.set_closed_boundaries_at_grid_edges(False, False, False, False)
+    ld = LinearDiffuser(mg, linear_diffusivity = params['linear_diffusivity'])
+    sf = IncrementalSinkFiller(mg)
+    fr = IncrementalFlowAccumulator(mg)
+    fse = FastscapeEroder(mg, K_sp = params['K_sp'], m_sp = params['m_sp'],
+                          n_sp = params['n_sp'])
+    pipe = Pipeline.from_params([Uplift(mg, params['uplift_rate']), ld, sf, fr,
+                                 fse], params)
+    pipe.run()
+
+    core = z[mg.core_nodes]
+    slope = mg.at_node['topographic__steepest_slope']
+    result = {'n_steps': pipe.step, 'mean_elevation': float(core.mean()),
+              'max_elevation': float(core.max()),
+              'relief': float(core.max() - core.min()),
+              'mean_slope': float(slope[mg.core_nodes].mean()),
+              'theta': np.nan, 'ksn': np.nan}
+    try:
+        bins = slope_area_bins(mg.at_node['drainage_area'], slope,
+                               min_area = params.get('channel_min_area', CHANNEL_MIN_AREA))
+        fit = fit_slope_area(bins,
+                             theta_ref = params['m_sp'] / params['n_sp'],
+                             n_boot = 0)
+        result['theta'] = float(fit['theta'])
+        result['ksn'] = float(fit['ksn'])
+    except ValueError:
+        #no channel network (e.g., too few bins)
+        pass
+    return result
+
+
+def _attach(name, shape):
+    #pool initializer: map the shared initial DEM
+    shm = shared_memory.SharedMemory(name = name)
+    _shared['shm'] = shm
+    _shared['z0'] = np.ndarray(shape, dtype = np.float64, buffer = shm.buf)
+
+
+def _run_job(model, rid, params):
+    t0 = time.perf_counter()
+    #a model must not change the initial DEM of the following jobs
+    z0 = _shared['z0'].view()
+    z0.setflags(write = False)
+    try:
+        result = model(params, z0)
+        status, error = 'ok', ''
+    except Exception as e:
+        result, status, error = {}, 'failed', '%s: %s' % (type(e).__name__, e)
+    result.update({'run_id': rid, 'status': status, 'error': error,
+                   'wall_time_s': time.perf_counter() - t0})
+    return result
+
+
+def completed_runs(output):
+    """
+    Ids of the runs already recorded in the results table
+    """
+    if not os.path.exists(output):
+        return set()
+    with open(output, newline = '') as f:
+        return {row['run_id'] for row in csv.DictReader(f)}
+
+
+def sweep(params, ranges, z0 = None, model = baspa_model, n_workers = None,
+          output = 'sweep.csv', metrics = METRICS, seed = 0):
+    """
+    Run model for every combination of ranges on top of the base params (a
+    dict or parameter file). z0 is the initial DEM; by default a flat
+    nrows x ncols grid with 1e-5 random roughness. Returns the number of
+    runs done in this call; the results are in the CSV file output.
+    """
+    if isinstance(params, str):
+        params = read_params(params)
+    if z0 is None:
+        rng = np.random.default_rng(seed)
+        z0 = rng.random((params['nrows'], params['ncols'])) / 100000.
+    else:
+        #the DEM is given, the seed is not used
+        seed = None
+    z0 = np.asarray(z0, dtype = np.float64)
+    dem = dem_hash(z0)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    names = sorted(ranges)
+    done = completed_runs(output)
+    jobs = []
+    for combo in expand_grid(ranges):
+        p = dict(params)
+        p.update(combo)
+        rid = run_id(p, dem, seed)
+        if rid not in done:
+            jobs.append((rid, p))
+    n_total = len(expand_grid(ranges))
+    print('%d runs, %d already done' % (n_total, n_total - len(jobs)))
+    if not jobs:
+        return 0
+
+    new_file = not os.path.exists(output)
+    #all parameters, so later sweeps over other parameters fit the table
+    fieldnames = (['run_id', 'status'] + sorted(set(params) | set(names)) +
+                  list(metrics) + ['wall_time_s', 'error'])
+    if not new_file:
+        with open(output, newline = '') as f:
+            header = next(csv.reader(f))
+        missing = [k for k in fieldnames if k not in header]
+        if missing:
+            raise ValueError('%s has no columns %s; write the results to a new file'
+                             % (output, ', '.join(missing)))
+        fieldnames = header
+    shm = shared_memory.SharedMemory(create = True, size = z0.nbytes)
+    try:
+        np.ndarray(z0.shape, dtype = np.float64, buffer = shm.buf)[...] = z0
+        with open(output, 'a', newline = '') as f, \
+             ProcessPoolExecutor(n_workers, initializer = _attach,
+                                 initargs = (shm.name, z0.shape)) as pool:
+            w = csv.DictWriter(f, fieldnames = fieldnames, extrasaction = 'ignore')
+            if new_file:
+                w.writeheader()
+            combos = {}
+            pending = set()
+            n_done = 0
+            jobs = iter(jobs)
+            while True:
+                #keep at most 2 * n_workers jobs in flight
+                for rid, p in itertools.islice(jobs, 2 * n_workers - len(pending)):
+                    fut = pool.submit(_run_job, model, rid, p)
+                    combos[fut] = p
+                    pending.add(fut)
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for fut in finished:
+                    row = fut.result()
+                    row.update(combos.pop(fut))
+                    w.writerow(row)
+                    f.flush()
+                    n_done += 1
+                    print('%s %-6s %s %.1f s' % (row['run_id'], row['status'],
+                                                 ' '.join('%s=%g' % (k, row[k]) for k in names),
+                                                 row['wall_time_s']))
+    finally:
+        shm.close()
+        shm.unlink()
+    return n_done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('params', help = 'base parameter file')
+    parser.add_argument('--range', nargs = '+', action = 'append', default = [],
+                        metavar = ('NAME', 'VALUE'),
+                        help = 'parameter name followed by its values')
+    parser.add_argument('--dem', default = None, help = 'initial DEM (.npy)')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--output', default = 'sweep.csv')
+    args = parser.parse_args()
+    ranges = {r[0]: [float(v) for v in r[1:]] for r in args.range}
+    z0 = None if args.dem is None else np.load(args.dem)
+    sweep(args.params, ranges, z0, n_workers = args.workers, output = args.output)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive time steps for coupled hillslope diffusion and stream-power
+erosion.
+
+Before every step the controller limits dt by
+    - the stream-power Courant condition dt <= courant * dx / max(c), with
+      the knickpoint celerity c = K A^m S^(n-1) from the last flow routing
+    - max_diffusion_substeps times the stable explicit step of the
+      LinearDiffuser (which otherwise silently splits a long step into many
+      substeps)
+    - dt_min and dt_max.
+After the step, the largest elevation change caused by the processes
+(uplift subtracted) is compared with the tolerance and the next step grows
+or shrinks by safety * tolerance / change, at most by the factor growth.
+The tolerance is a limit on the elevation change per step, not an error
+control: no step is rejected and redone, so a single step can change the
+surface by more than the tolerance (the next one is then shorter). The
+number of internal substeps of each LinearDiffuser is recorded per step.
+
+Usage:
+    ctl = StepController(mg, tolerance = 1., dt_min = 10., dt_max = 1e5,
+                         K_sp = 1e-4, m_sp = 0.5, n_sp = 1., diffuser = ld,
+                         uplift = up)
+    pipe = Pipeline([up, ld, fr, fse], dt = 1000., nt = 100, controller = ctl)
+    pipe.run(end_time = 5e6)
+    ctl.report()
+"""
+import numpy as np
+
+
+class StepController(object):
+    def __init__(self, mg, tolerance = 1., dt_min = 0., dt_max = np.inf,
+                 growth = 1.5, shrink = 0.2, safety = 0.9, courant = 1.,
+                 K_sp = None, m_sp = 0.5, n_sp = 1., diffuser = None,
+                 max_diffusion_substeps = None, uplift = None,
+                 field = 'topographic__elevation'):
+        self.mg = mg
+        self.z = mg.at_node[field]
+        self.tolerance = tolerance
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        self.growth = growth
+        self.shrink = shrink
+        self.safety = safety
+        self.courant = courant
+        self.K_sp = K_sp
+        self.m_sp = m_sp
+        self.n_sp = n_sp
+        self.diffuser = diffuser
+        self.max_diffusion_substeps = max_diffusion_substeps
+        self.uplift = uplift
+        self.dx = float(np.min(mg.spacing))
+        self._z0 = np.empty_like(self.z)
+        #per step: dt, limiting criterion, largest process change, substeps
+        self.dts = []
+        self.limits = []
+        self.changes = []
+        self.substeps = []
+
+    def courant_dt(self):
+        """
+        Stream-power Courant limit from the current drainage area and slope
+        (inf before the first flow routing)
+        """
+        if self.K_sp is None or 'drainage_area' not in self.mg.at_node:
+            return np.inf
+        core = self.mg.core_nodes
+        c = self.K_sp * self.mg.at_node['drainage_area'][core]**self.m_sp
+        if self.n_sp != 1:
+            s = self.mg.at_node['topographic__steepest_slope'][core]
+            with np.errstate(divide = 'ignore'):
+                c = c * s**(self.n_sp - 1)
+        cmax = np.nanmax(c) if len(c) else 0.
+        return self.courant * self.dx / cmax if cmax > 0 else np.inf
+
+    def diffusion_dt(self):
+        """
+        max_diffusion_substeps times the internal stable step of the
+        LinearDiffuser (known after its first run)
+        """
+        if self.max_diffusion_substeps is None or self.diffuser is None:
+            return np.inf
+        return self.max_diffusion_substeps * getattr(self.diffuser, '_dt', np.inf)
+
+    def propose(self, pipeline):
+        """
+        Time step for the next step of pipeline (called before the step)
+        """
+        limits = {'change': pipeline.dt, 'courant': self.courant_dt(),
+                  'diffusion': self.diffusion_dt(), 'dt_max': self.dt_max}
+        limit = min(limits, key = limits.get)
+        dt = max(limits[limit], self.dt_min)
+        self.limits.append(limit if dt > self.dt_min else 'dt_min')
+        np.copyto(self._z0, self.z)
+        return dt
+
+    def update(self, pipeline, dt):
+        """
+        Measure the change of the last step and set the next pipeline.dt
+        """
+        dz = self.z - self._z0
+        if self.uplift is not None:
+            #uplift of the last step (Uplift or lem_uplift.PatternUplift)
+            dz -= self.uplift.last_scale * self.uplift.rate_at_node
+        change = float(np.abs(dz[self.mg.core_nodes]).max()) if self.mg.number_of_core_nodes else 0.
+        if change > 0:
+            factor = min(self.growth, max(self.shrink, self.safety * self.tolerance / change))
+        else:
+            factor = self.growth
+        pipeline.dt = min(max(dt * factor, self.dt_min), self.dt_max)
+        self.dts.append(dt)
+        self.changes.append(change)
+        if self.diffuser is not None and getattr(self.diffuser, '_dt', np.inf) < np.inf:
+            #substeps of at most _dt that advance time (LinearDiffuser adds a
+            #pass of zero length if dt is a multiple of _dt)
+            self.substeps.append(int(np.ceil(dt / self.diffuser._dt)))
+        else:
+            self.substeps.append(1)
+
+    def report(self):
+        """
+        Print the number of steps, the range of dt, how often each criterion
+        limited dt and the diffusion substeps
+        """
+        dts = np.asarray(self.dts)
+        if not len(dts):
+            print('no steps taken')
+            return
+        print('%d steps, dt min %.4g, mean %.4g, max %.4g, total %.4g'
+              % (len(dts), dts.min(), dts.mean(), dts.max(), dts.sum()))
+        for name in sorted(set(self.limits)):
+            print('  dt limited by %-9s %6d steps' % (name, self.limits.count(name)))
+        if self.diffuser is not None:
+            print('  %s: %d substeps in %d steps (max %d per step)'
+                  % (type(self.diffuser).__name__, sum(self.substeps),
+                     len(self.substeps), max(self.substeps)))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rock uplift with a fixed spatial pattern and a time-varying rate.
+
+The uplift rate at every node is the product of a spatial pattern (a node
+vector, built once) and a time function:
+    uplift rate(node, t) = rate * pattern[node] * time_function(t)
+Patterns of unit height:
+    block_pattern    1 inside a rectangle (x_range, y_range), 0 outside
+    fold_pattern     parabolic fold, 1 at the fold axis and 0 at half_width
+                     from it (e.g. the growing anticline)
+    fault_pattern    1 on the hanging wall (left of the fault line from p0
+                     to p1), optionally decaying with distance to the fault
+    raster_pattern   any (rows x columns) array, e.g. from a GeoTIFF
+Time functions f(t) (model time in yr; multiply the rate):
+    constant, ramp(t0, t1), pulse(t_on, t_off), periodic(period, amplitude)
+Patterns can be added and scaled like any NumPy array.
+
+PatternUplift multiplies the pattern by rate once. Every step then adds
+dt * time_function(t + dt/2) times this rate vector to the elevation with
+one in-place BLAS axpy over all nodes, instead of building
+pattern * dt arrays or gathering and scattering the nodes of a block.
+
+Usage:
+    uplift = PatternUplift(mg, fold_pattern(mg, axis = 500., half_width = 500.),
+                           rate = 1e-3, time_function = ramp(0., 2e5))
+    pipe = Pipeline([uplift, fr, fse], dt, time_steps)
+"""
+import numpy as np
+from scipy.linalg.blas import daxpy
+
+
+def block_pattern(mg, x_range, y_range):
+    """
+    1 at the nodes with x_range[0] < x < x_range[1] and
+    y_range[0] < y < y_range[1], 0 elsewhere
+    """
+    inside = ((mg.node_x > x_range[0]) & (mg.node_x < x_range[1]) &
+              (mg.node_y > y_range[0]) & (mg.node_y < y_range[1]))
+    return inside.astype(float)
+
+
+def fold_pattern(mg, axis, half_width, direction = 'x'):
+    """
+    Parabolic fold 1 - (d / half_width)^2 (0 beyond half_width), where d
+    is the distance to the fold axis at y = axis (direction 'x': the axis
+    runs along x) or at x = axis (direction 'y')
+    """
+    d = (mg.node_y if direction == 'x' else mg.node_x) - axis
+    return np.clip(1. - (d / half_width)**2, 0., None)
+
+
+def fault_pattern(mg, p0, p1, decay_length = None):
+    """
+    1 at the nodes left of the fault line from p0 = (x0, y0) to
+    p1 = (x1, y1), 0 on the right; with decay_length the uplift decays as
+    exp(-distance to the fault / decay_length) on the hanging wall
+    """
+    (x0, y0), (x1, y1) = p0, p1
+    length = np.hypot(x1 - x0, y1 - y0)
+    #signed distance, positive left of the fault line
+    d = ((x1 - x0) * (mg.node_y - y0) - (y1 - y0) * (mg.node_x - x0)) / length
+    if decay_length is None:
+        return (d > 0).astype(float)
+    return np.where(d > 0, np.exp(-d / decay_length), 0.)
+
+
+def raster_pattern(mg, raster, flip_vertically = False):
+    """
+    Node vector of a (rows x columns) raster; flip_vertically for rasters
+    with the top row first (images, GeoTIFFs)
+    """
+    raster = np.asarray(raster, dtype = float).reshape(mg.shape)
+    if flip_vertically:
+        raster = raster[::-1]
+    return raster.ravel().copy()
+
+
+def constant(t):
+    return 1.
+
+
+def ramp(t0, t1):
+    """
+    0 before t0, increasing linearly to 1 at t1
+    """
+    def f(t):
+        return min(max((t - t0) / (t1 - t0), 0.), 1.)
+    return f
+
+
+def pulse(t_on, t_off):
+    """
+    1 between t_on and t_off, 0 otherwise
+    """
+    def f(t):
+        return 1. if t_on <= t < t_off else 0.
+    return f
+
+
+def periodic(period, amplitude = 1., phase = 0.):
+    """
+    1 + amplitude * sin(2 pi (t / period + phase))
+    """
+    def f(t):
+        return 1. + amplitude * np.sin(2 * np.pi * (t / period + phase))
+    return f
+
+
+class PatternUplift(object):
+    """
+    Uplift of field by rate * pattern * time_function(t); by default only
+    the core nodes are uplifted and the boundary nodes keep their elevation
+    """
+    def __init__(self, mg, pattern, rate = 1., time_function = constant,
+                 field = 'topographic__elevation', core_only = True, start_time = 0.):
+        self.z = mg.at_node[field]
+        rate_at_node = np.zeros(mg.number_of_nodes)
+        rate_at_node[:] = rate * np.broadcast_to(pattern, rate_at_node.shape)
+        if core_only:
+            core = np.zeros(mg.number_of_nodes, dtype = bool)
+            core[mg.core_nodes] = True
+            rate_at_node[~core] = 0.
+        self.rate_at_node = rate_at_node
+        self.time_function = time_function
+        self.time = start_time
+        #dt * time_function of the last step
+        self.last_scale = 0.
+        #BLAS works in place on contiguous float64 fields only
+        self._axpy = (self.z.dtype == np.float64 and self.z.flags.c_contiguous)
+        if not self._axpy:
+            self._buffer = np.empty(self.z.shape, dtype = self.z.dtype)
+
+    def run_one_step(self, dt):
+        #rate at the middle of the step
+        a = dt * self.time_function(self.time + dt / 2.)
+        self.time += dt
+        self.last_scale = a
+        if a == 0:
+            return
+        if self._axpy:
+            daxpy(self.rate_at_node, self.z, a = a)
+        else:
+            np.multiply(self.rate_at_node, a, out = self._buffer, casting = 'unsafe')
+            self.z += self._buffer
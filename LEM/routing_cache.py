@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache of flow-routing results.
+
+Sink filling and flow routing only depend on the elevations, the boundary
+conditions, the grid spacing and the routing method, so their results are
+stored under a SHA-1 hash of exactly these inputs. Re-running an analysis
+on the same DEM (or a deterministic model run from the same DEM) loads the
+receivers, drainage area, filled elevations etc. instead of routing again.
+
+Each entry is a directory of .npy files that are loaded memory-mapped, or,
+with compress = True, a single compressed .npz file (smaller, but read
+fully into memory). Entries are written to a temporary name and renamed,
+so an interrupted run never leaves a partial entry. When the cache grows
+beyond max_bytes the least recently used entries are deleted.
+
+Usage:
+    cache = RoutingCache('routing_cache', max_bytes = 2**30)
+    cached_flow_routing(mg, cache, fr, sf, method = 'D8')    #instead of
+                                                              #sf.run_one_step(); fr.run_one_step()
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+#landlab node fields written by SinkFiller / FlowAccumulator
+ROUTING_FIELDS = ('topographic__elevation', 'flow__receiver_node',
+                  'flow__upstream_node_order', 'flow__link_to_receiver_node',
+                  'flow__sink_flag', 'drainage_area', 'surface_water__discharge',
+                  'topographic__steepest_slope', 'water__unit_flux_in',
+                  'flow__data_structure_delta')
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+class RoutingCache(object):
+    def __init__(self, cache_dir = 'routing_cache', max_bytes = 2**30,
+                 compress = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def key(self, z, method, **params):
+        """
+        Hash of the elevation bytes, shape and dtype plus method and
+        parameters (e.g., spacing, boundary status, flow director)
+        """
+        z = np.ascontiguousarray(z)
+        h = hashlib.sha1()
+        h.update(('%s %s %s' % (z.dtype, z.shape, method)).encode())
+        h.update(z.view(np.uint8))
+        for name in sorted(params):
+            v = params[name]
+            h.update(name.encode())
+            if isinstance(v, np.ndarray):
+                h.update(('%s %s' % (v.dtype, v.shape)).encode())
+                h.update(np.ascontiguousarray(v).view(np.uint8))
+            else:
+                h.update(repr(v).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ('.npz' if self.compress else ''))
+
+    def load(self, key):
+        """
+        Dict of the arrays stored under key, or None if there is no entry
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        #the modification time orders the entries for eviction
+        os.utime(path)
+        self.hits += 1
+        if self.compress:
+            with np.load(path) as f:
+                return {name: f[name] for name in f.files}
+        return {f[:-4]: np.load(os.path.join(path, f), mmap_mode = 'r')
+                for f in os.listdir(path) if f.endswith('.npy')}
+
+    def save(self, key, arrays):
+        """
+        Store the dict of arrays under key and evict old entries
+        """
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        if self.compress:
+            fd, tmp = tempfile.mkstemp(suffix = '.npz', dir = self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+        else:
+            tmp = tempfile.mkdtemp(dir = self.cache_dir)
+            for name, a in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'), a)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            #another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors = True)
+        self.evict()
+
+    def entries(self):
+        """
+        List of (mtime, bytes, path) of all entries, oldest first
+        """
+        out = []
+        for f in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, f)
+            if len(f.split('.')[0]) == 40 and not f.startswith('tmp'):
+                out.append((os.path.getmtime(path), _size(path), path))
+        return sorted(out)
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits max_bytes
+        """
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors = True)
+            else:
+                os.remove(path)
+            total -= size
+
+    def cached(self, z, method, func, **params):
+        """
+        Arrays computed by func() for z, method and params, loaded from the
+        cache if present and stored otherwise
+        """
+        key = self.key(z, method, **params)
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = func()
+            self.save(key, arrays)
+        return arrays
+
+
+def cached_flow_routing(mg, cache, fr, sf = None, method = 'D8',
+                        fields = ROUTING_FIELDS, **params):
+    """
+    Run SinkFiller sf (optional) and FlowAccumulator fr on the landlab grid
+    mg, or copy their node fields from the cache. method and params must
+    describe the components (flow director, filling method, runoff, ...);
+    the elevations, node status and spacing are added to the key.
+    """
+    z = mg.at_node['topographic__elevation']
+
+    def route():
+        if sf is not None:
+            sf.run_one_step()
+        fr.run_one_step()
+        return {f: np.array(mg.at_node[f]) for f in fields if f in mg.at_node}
+
+    key = cache.key(z, method, status = np.asarray(mg.status_at_node),
+                    spacing = tuple(mg.spacing), filled = sf is not None,
+                    **params)
+    arrays = cache.load(key)
+    if arrays is None:
+        cache.save(key, route())
+        return False
+    for f, a in arrays.items():
+        if f in mg.at_node:
+            mg.at_node[f][:] = a
+        else:
+            mg.add_field(f, np.array(a), at = 'node')
+    return True
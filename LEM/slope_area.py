@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Log-binned slope-area statistics and channel concavity / steepness fits.
+
+Instead of scattering every node, drainage area is binned in equal steps of
+log10(A) and the median and interquartile range (IQR) of slope are computed
+per bin. The nodes are sorted once by (bin, slope); counts and mean log
+area come from np.bincount, and the quantiles are read directly from the
+sorted array. The output therefore has O(bins) size regardless of the grid
+size.
+
+The fit S = ks A^-theta is a Theil-Sen regression of log10(median S) on
+log10(A) over bins with at least min_count nodes. ksn is the median of
+S A^theta_ref over the same bins. Confidence intervals come from a
+bootstrap that resamples nodes within each area bin. Only the bin medians
+of a resample enter the fit, so they are drawn directly from the order
+statistics (O(bins) per replicate). The replicates run in chunks in
+parallel threads; every chunk has its own seed, so the result does not
+depend on the number of workers.
+
+Usage:
+    bins = slope_area_bins(mg.at_node['drainage_area'],
+                           mg.at_node['topographic__steepest_slope'])
+    fit = fit_slope_area(bins, n_boot = 1000)
+    bins.plot(pl.gca(), fit = fit)
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+#bootstrap replicates per seed / task
+BOOT_CHUNK = 250
+
+
+def _bin_quantile(values, starts, counts, q):
+    #quantile q of each bin of the (bin, value)-sorted array values
+    pos = starts + q * np.maximum(counts - 1, 0)
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.minimum(lo + 1, len(values) - 1)
+    t = pos - lo
+    out = values[lo] * (1 - t) + values[hi] * t
+    out[counts == 0] = np.nan
+    return out
+
+
+class SlopeAreaBins(object):
+    def __init__(self, area, slope, bins_per_decade = 10, min_area = None):
+        area = np.asarray(area, dtype = np.float64).ravel()
+        slope = np.asarray(slope, dtype = np.float64).ravel()
+        valid = np.isfinite(area) & np.isfinite(slope) & (area > 0) & (slope > 0)
+        if min_area is not None:
+            valid &= area >= min_area
+        if not valid.any():
+            raise ValueError('no nodes with positive drainage area and slope')
+        la = np.log10(area[valid])
+        ls = np.log10(slope[valid])
+        self.bins_per_decade = bins_per_decade
+        lo = np.floor(la.min() * bins_per_decade) / bins_per_decade
+        b = ((la - lo) * bins_per_decade).astype(np.intp)
+        nbins = b.max() + 1
+        self.edges = 10**(lo + np.arange(nbins + 1) / float(bins_per_decade))
+        self.count = np.bincount(b, minlength = nbins)
+        with np.errstate(invalid = 'ignore'):
+            #geometric mean drainage area of the nodes in each bin
+            self.area = 10**(np.bincount(b, weights = la, minlength = nbins) / self.count)
+        order = np.lexsort((ls, b))
+        #log10 slope sorted by bin and, within each bin, by slope
+        self._log_slope = ls[order]
+        self._starts = np.concatenate(([0], np.cumsum(self.count)[:-1]))
+        self.q25 = 10**_bin_quantile(self._log_slope, self._starts, self.count, 0.25)
+        self.median = 10**_bin_quantile(self._log_slope, self._starts, self.count, 0.5)
+        self.q75 = 10**_bin_quantile(self._log_slope, self._starts, self.count, 0.75)
+
+    @property
+    def nbins(self):
+        return len(self.count)
+
+    def plot(self, ax, fit = None, color = 'k', **kwargs):
+        """
+        Median slope per bin with IQR error bars on log axes and, if given,
+        the fitted power law
+        """
+        ok = self.count > 0
+        m = self.median[ok]
+        ax.errorbar(self.area[ok], m, yerr = (m - self.q25[ok], self.q75[ok] - m),
+                    fmt = 'o', color = color, mfc = 'none', **kwargs)
+        if fit is not None:
+            a = self.area[fit['bins']]
+            ax.plot(a, fit['ks'] * a**-fit['theta'], '-', color = 'r',
+                    label = 'theta = %.2f, ks = %.3g' % (fit['theta'], fit['ks']))
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        return ax
+
+
+def slope_area_bins(area, slope, bins_per_decade = 10, min_area = None):
+    """
+    Log-binned slope-area statistics (count, geometric mean area, quartiles
+    of slope per bin) of node arrays area and slope
+    """
+    return SlopeAreaBins(area, slope, bins_per_decade, min_area)
+
+
+def _fit_log(la, ls, theta_ref):
+    #Theil-Sen fit of log slope vs log area for one or a stack (rows) of
+    #log slope vectors: theta, ks, ksn
+    i, j = np.triu_indices(len(la), 1)
+    m = np.median((ls[..., j] - ls[..., i]) / (la[j] - la[i]), axis = -1)
+    c = np.median(ls, axis = -1) - m * np.median(la)
+    return -m, 10**c, 10**np.median(ls + theta_ref * la, axis = -1)
+
+
+def _bootstrap_medians(log_slope, starts, counts, n, rng):
+    """
+    Bin medians of n bootstrap resamples of the nodes of each bin, shape
+    (n, bins). The median of m nodes drawn with replacement from a sorted
+    bin of m values is read at the middle order statistics of m uniform
+    draws, which are sampled directly (Beta distribution and the minimum
+    of the remaining draws), so no resample is ever built or sorted.
+    """
+    k = (counts + 1) // 2
+    u = rng.beta(k, counts - k + 1, size = (n, len(counts)))
+    lo = starts + (u * counts).astype(np.intp)
+    #second middle order statistic for even counts
+    u2 = u + (1 - u) * rng.beta(1, np.maximum(counts - k, 1), size = u.shape)
+    hi = np.where(counts % 2, lo, starts + (u2 * counts).astype(np.intp))
+    return 0.5 * (log_slope[lo] + log_slope[hi])
+
+
+def _bootstrap(log_slope, starts, counts, la, n, seed, theta_ref):
+    #n bootstrap fits, resampling nodes within each bin of the fit
+    ls = _bootstrap_medians(log_slope, starts, counts, n,
+                            np.random.default_rng(seed))
+    return np.column_stack(_fit_log(la, ls, theta_ref))
+
+
+def fit_slope_area(bins, theta_ref = 0.45, min_count = 5, n_boot = 1000,
+                   ci = 95., n_workers = None, seed = 0):
+    """
+    Fit S = ks A^-theta to the binned medians and estimate ksn at
+    theta_ref. Returns a dict with theta, ks, ksn, their bootstrap
+    confidence intervals (theta_ci, ks_ci, ksn_ci) and the bins used.
+    """
+    use = np.flatnonzero(bins.count >= max(min_count, 1))
+    if len(use) < 3:
+        raise ValueError('need at least 3 bins with >= %d nodes' % min_count)
+    la = np.log10(bins.area[use])
+    ls = np.log10(bins.median[use])
+    theta, ks, ksn = _fit_log(la, ls, theta_ref)
+    result = {'theta': theta, 'ks': ks, 'ksn': ksn, 'theta_ref': theta_ref,
+              'bins': use, 'n_boot': n_boot}
+    if n_boot:
+        #nodes of the fitted bins, still sorted by (bin, slope)
+        counts = bins.count[use]
+        parts = [bins._log_slope[bins._starts[k]:bins._starts[k] + bins.count[k]]
+                 for k in use]
+        log_slope = np.concatenate(parts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        chunks = np.array_split(np.arange(n_boot), -(-n_boot // BOOT_CHUNK))
+        seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+        with ThreadPoolExecutor(n_workers) as pool:
+            boot = np.concatenate(list(pool.map(
+                lambda args: _bootstrap(log_slope, starts, counts, la,
+                                        len(args[0]), args[1], theta_ref),
+                zip(chunks, seeds))))
+        p = (100 - ci) / 2.
+        for j, name in enumerate(('theta', 'ks', 'ksn')):
+            result[name + '_ci'] = tuple(np.percentile(boot[:, j], (p, 100 - p)))
+    return result